@@ -1,8 +1,12 @@
 # Nathaniel Alden Homans Youngren
 # September 13, 2023
 
+import heapq
+import itertools
 import numpy as np
+from collections import OrderedDict
 from time import time
+from typing import NamedTuple
 
 # NOTE: INSTRUCTIONS
 #
@@ -10,25 +14,145 @@ from time import time
 # 2. Adjust the cost of traversing individual cells by modifying the cost_grid, negative values are considered impassable.
 # 3. If using portals, add them to the portals dict.
 # 4. Manually call search_cell() to seed a starting cell.
+#       (Or search_sources() to seed many starting cells at once, each with an optional initial g)
 # 5. Step() the simulation until a path is found or no more cells can be traversed.
-# 6. Examine pathfinding results with reconstruct_path(), step_count, step_time, heuristic_count and path_length.
+#       (Or call run() to search to completion, using the compiled engine in a_star_jit.py if jit is set and numba is installed)
+#       (Or skip steps 4 and 5 and call solve(start_pos, end_pos), which runs a fresh search and returns a Search_Result)
+#       (Or call solve_sources(sources, end_pos), which finds the source closest to the end in a single search)
+# 6. Examine pathfinding results with reconstruct_path(), step_count, step_time, heuristic_count, path_length, open_count and closed_count.
 #
 
-# TODO: Implement non-grid version of A* (i.e. for a continuous space or graph)
-# TODO: Use numba to optimize speed?
-# TODO: Storing a start_pos is potentially redundant, as multiple starts could be used.
-# TODO: Consider allowing for multiple end positions as well, which must all be reached.
+# NOTE: A non-grid version of A* (over any graph, e.g. navmeshes or road networks) is A_Star_Graph in a_star_graph.py.
+# NOTE: start_pos is only the default start, any number of starts may be seeded with search_sources().
+# NOTE: Multiple end positions (reaching the nearest, or visiting all of them) are handled by A_Star_Goals in a_star_goals.py.
 
 # TODO: Consider a dict to store parents? (i.e. {pos: parent_pos})
 # TODO: Alternately, consider a grid to store portals? (i.e. portals[x, y] = (x, y))
 
 
+# Dtypes of each cell grid, selected by the grid_dtypes argument of A_Star.
+#   > 'standard' uses numpy's default int, roughly 36 bytes per cell.
+#   > 'compact' uses the smallest types that fit the cost model, 15 bytes per cell, allowing for very large maps.
+#       Cell costs must fit in int16, and g/h values in int32.
+GRID_DTYPES = {'standard': {'state': int,     'cost': int,      'h': int,      'g': int,      'p': np.int32},
+               'compact':  {'state': np.int8, 'cost': np.int16, 'h': np.int32, 'g': np.int32, 'p': np.int32}}
+
+
+class Search_Result(NamedTuple):
+    """ Summary of a search performed by A_Star.solve(). """
+    path: list              # Cells from start to end, empty if the end was not reached
+    cost: int               # g of the end cell (10 per orthogonal step, 14 per diagonal, multiplied by cell cost), None if not reached
+    expansions: int         # Number of cells traversed
+    heuristic_count: int    # Number of distance heuristics calculated
+    time: float             # Wall time of the search in seconds
+    source: tuple = None    # Start of the path, i.e. the seeded source it came from, None if the end was not reached
+    
+    @property
+    def found(self):
+        return self.cost is not None
+
+
+def octile_distance(dx, dy, orthogonal_cost=10, diagonal_cost=14):
+    """ Heuristic distance covering an offset of (dx, dy) cells, assuming no obstructions.
+            Works on scalars as well as numpy arrays of offsets.
+
+    Args:
+        dx (int or np.ndarray): Horizontal offset(s).
+        dy (int or np.ndarray): Vertical offset(s).
+        orthogonal_cost (int, optional): Cost of horizontal/vertical travel. Defaults to 10.
+        diagonal_cost (int, optional): Cost of diagonal travel. Defaults to 14.
+
+    Returns:
+        int or np.ndarray: Heuristic distance(s).
+    """
+    dx, dy = np.abs(dx), np.abs(dy)
+    
+    # Orthogonal movement is the difference between h and v travel, diagonal is the overlap.
+    return orthogonal_cost * np.abs(dx - dy) + diagonal_cost * np.minimum(dx, dy)
+
+
+# (dx, dy) offsets of the 8 direct neighbors of a cell, and the distance of a step to each of them.
+NEIGHBOR_OFFSETS = np.array([(w, h) for w in range(-1, 2) for h in range(-1, 2) if w != 0 or h != 0])
+NEIGHBOR_DISTANCES = octile_distance(NEIGHBOR_OFFSETS[:, 0], NEIGHBOR_OFFSETS[:, 1])
+
+# Number of portals from which A_Star_Portals.distance_heuristic() visits portals through the bucket index, nearest first,
+#   rather than looping over every portal.
+#   Measured per distance_heuristic() call to the end, from random cells of 128^2 to 1024^2 maps with randomly placed portals:
+#   the loop is faster up to about 24 portals, both break even around 24-28, and the index is ahead from 32 on
+#   (about 40us against 45us at 32 portals, 45us against 65us at 48, 80us against 230us at 128).
+PORTAL_INDEX_THRESHOLD = 32
+
+
+class Portal_Dict(dict):
+    """ Dict of portal entrances to exits, with a version that changes whenever the portals do.
+            Versions are drawn from a single counter, so no two states of any Portal_Dict share one,
+            allowing portal_distance_table() to detect changes without comparing every portal.
+    """
+    _versions = itertools.count()
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = next(self._versions)
+    
+    def _changed(self):
+        self.version = next(self._versions)
+    
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed()
+    
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+    
+    def __ior__(self, other):
+        super().__ior__(other)
+        self._changed()
+        return self
+    
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._changed()
+        return value
+    
+    def popitem(self):
+        item = super().popitem()
+        self._changed()
+        return item
+    
+    def setdefault(self, key, default=None):
+        value = super().setdefault(key, default)
+        self._changed()
+        return value
+    
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+    
+    def clear(self):
+        super().clear()
+        self._changed()
+
+
+class Portal_Heuristics(dict):
+    """ Dict of portal entrances to heuristic distances to a target, from A_Star_Portals.sort_portal_heuristics().
+            min_h, the lowest of them, is kept alongside so the bucket index can bound its search without a pass over every portal.
+    """
+    def __init__(self, *args, min_h:int=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_h = min_h
+
+
 class A_Star():
     
     def __init__(self, w:int=20, h:int=20,
                  start_pos:(int, int)=None,
                  end_pos:(int, int)=None,
-                 default_cost:int=1) -> None:
+                 default_cost:int=1,
+                 grid_dtypes:str='standard',
+                 precompute_h:bool=False,
+                 jit:bool=False,
+                 cost_grid:np.ndarray=None) -> None:
         
         # Pathfinding variables
         self.w, self.h = w, h               # Width and height of cell grid
@@ -37,26 +161,56 @@ class A_Star():
         self.default_cost = default_cost    # Default cost multiplier of moving through a cell
                                             #   Negative cell costs are considered impassable
                                             #   Lower cost cells contribute to a shorter overall path, and are prioritized
+        self.precompute_h = precompute_h    # If True, h_grid is filled in a single vectorized pass when the first cell is searched
+        self.jit = jit                      # If True, run() uses the compiled engine when numba is available
 
         # Cell grids
-        self.state_grid = np.zeros((self.w, self.h), dtype=int)                             # Holds status of each cell, 0 = unsearched, 1 = searched, -1 = traversed
-        self.cost_grid = np.full((self.w, self.h), fill_value=self.default_cost, dtype=int) # Cost to travel through each cell, used to define terrain
-        self.h_grid = np.full((self.w, self.h), fill_value=np.iinfo(int).max, dtype=int)    # Heuristic distance from each cell to the end, (could be precomputed)
-        self.g_grid = np.full((self.w, self.h), fill_value=np.iinfo(int).max, dtype=int)    # Distance from start to each cell, based on shortest path found so far
-        self.p_grid = np.full((self.w, self.h, 2), fill_value=-1, dtype=int)                # Parent of each cell, used to reconstruct path. (stored as (x, y) coords)
+        self.grid_dtypes = grid_dtypes                      # Key of GRID_DTYPES used to allocate the cell grids
+        dtypes = GRID_DTYPES[grid_dtypes]
+        self.max_value = np.iinfo(dtypes['g']).max          # Sentinel for g and h values that have not been calculated
+        
+        self.state_grid = np.zeros((self.w, self.h), dtype=dtypes['state'])                             # Holds status of each cell, 0 = unsearched, 1 = searched, -1 = traversed
+        self.cost_grid = np.full((self.w, self.h), fill_value=self.default_cost, dtype=dtypes['cost']) \
+                            if cost_grid is None else cost_grid                                         # Cost to travel through each cell, used to define terrain
+                                                                                                        #   An existing grid (e.g. memory-mapped) is used without copying
+        self.h_grid = np.full((self.w, self.h), fill_value=self.max_value, dtype=dtypes['h'])           # Heuristic distance from each cell to the end, (could be precomputed)
+        self.g_grid = np.full((self.w, self.h), fill_value=self.max_value, dtype=dtypes['g'])           # Distance from start to each cell, based on shortest path found so far
+        self.p_grid = np.full((self.w, self.h), fill_value=-1, dtype=dtypes['p'])                       # Parent of each cell, used to reconstruct path. (stored as flat x * h + y index)
+        
+        # Open set
+        self.open_heap = [] # Priority queue of searched cells, stored as (f, h, (x, y)) tuples.
+                            #   Cells are pushed again whenever their g improves, outdated entries are skipped when popped.
         
         # Pathfinding stats
         self.step_count = 0      # Number of steps taken
         self.step_time = 0       # Cumulative time spent stepping
         self.heuristic_count = 0 # Number of times a distance heuristic has been calculated
         self.path_length = 0     # Length of the path found
-        self.last_path = []      # List of cells traversed in the last step
+        self.last_pos = None     # Cell traversed in the last step, its path is only reconstructed when last_path is requested
+        self.last_path_cache = None # (pos, path) of the most recent last_path reconstruction
+        self.open_count = 0      # Number of searched cells waiting to be traversed (state 1)
+        self.closed_count = 0    # Number of traversed cells (state -1)
+        self.sources = {}        # {(x, y): initial g} of each cell seeded without a parent
 
         
     @property
     def f_grid(self):
         # The sum of g and h for each cell, used to determine which cell to traverse next.
-        return np.add(self.h_grid, self.g_grid)
+        #   Summed as int64 so that compact int32 grids do not overflow on max_value sentinels.
+        return np.add(self.h_grid, self.g_grid, dtype=np.int64)
+
+
+    @property
+    def last_path(self):
+        # List of cells leading to the cell traversed in the last step.
+        # Reconstructed lazily, so headless runs that never request it do not pay for it.
+        if self.last_pos is None:
+            return []
+        
+        # Traversed cells never change parent, so a path can be reused until a new cell is traversed.
+        if self.last_path_cache is None or self.last_path_cache[0] != self.last_pos:
+            self.last_path_cache = (self.last_pos, self.reconstruct_path(self.last_pos))
+        return self.last_path_cache[1]
 
 
     @property
@@ -68,7 +222,7 @@ class A_Star():
     @property
     def blocked(self):
         # True if there are no more cells to traverse and the end has not been found.
-        return not (any(self.state_grid.flatten() == 1) or self.finished)
+        return not (self.open_count > 0 or self.finished)
 
 
     def step(self):
@@ -83,38 +237,221 @@ class A_Star():
             return self.end_pos
         
         if self.blocked: # No searched cells to traverse.
-            if self.last_path: print('No more positions to check.')
-            self.last_path = []
+            if self.last_pos is not None: print('No more positions to check.')
+            self.last_pos = None
             return None                                     # NOTE: Could also return start_pos
         
         st = time()                                         # Start timer
+        next_pos = self.traverse_next()                     # Select, expand and traverse a single cell
+        self.step_time += time() - st                       # Stop timer and add to cumulative time
         
+        return next_pos
+
+
+    def traverse_next(self):
+        """ Core of step(), without timing, printing or finished/blocked checks.
+                There must be at least one searched cell.
+
+        Returns:
+            (int, int): Coordinate of cell traversed.
+        """
         next_pos = self.select_next_pos()                   # Find next cell to traverse
         self.search_neighbors(next_pos)                     # Add neighbors to searched cells
         self.state_grid[next_pos] = -1                      # Mark cell as traversed
+        self.open_count -= 1                                # Move cell from open to closed count
+        self.closed_count += 1
         
         self.step_count += 1                                # Increment step counter
-        self.last_path = self.reconstruct_path(next_pos)    # Reconstruct path to cell
+        self.last_pos = next_pos                            # Store cell, path is reconstructed on request
         
         self.path_length = max(self.path_length, self.g_grid[next_pos]/10)  # Divide by 10 to remove the heuristic scalar
         
-        self.step_time += time() - st                       # Stop timer and add to cumulative time
-        
         return next_pos
 
 
+    def run(self):
+        """ Step the simulation until a path is found or no more cells can be traversed.
+                If jit is set and numba is installed, the whole search runs in the compiled engine instead,
+                producing identical grids, step_count and path_length.
+                If no cell has been searched yet, the search is seeded with start_pos.
+
+        Returns:
+            bool: True if the end position was found.
+        """
+        if self.open_count == 0 and self.closed_count == 0 and self.start_pos is not None:
+            self.search_cell(self.start_pos)
+        
+        if self.jit and self.jit_supported():
+            self.run_jit()
+        else:
+            st = time()
+            while self.open_count > 0 and not self.finished:
+                self.traverse_next()
+            self.step_time += time() - st
+        
+        return self.finished
+
+
+    def solve(self, start_pos:(int, int)=None, end_pos:(int, int)=None):
+        """ Run a fresh search from start_pos to end_pos and summarize it.
+                Any previous search state is cleared, terrain and portals are kept.
+                Heuristics are reused if end_pos has not changed.
+
+        Args:
+            start_pos (int, int, optional): Start position, defaults to the current start_pos.
+            end_pos (int, int, optional): End position, defaults to the current end_pos.
+
+        Returns:
+            Search_Result: Path, cost, expansions, heuristic count and wall time of the search.
+        """
+        st = time()
+        
+        clear_h = end_pos is not None and end_pos != self.end_pos
+        self.start_pos = self.start_pos if start_pos is None else start_pos
+        self.end_pos = self.end_pos if end_pos is None else end_pos
+        self.reset_search(clear_h=clear_h)
+        
+        self.search_cell(self.start_pos)
+        found = self.run()
+        
+        return Search_Result(path=self.reconstruct_path(self.end_pos) if found else [],
+                             cost=int(self.g_grid[self.end_pos]) if found else None,
+                             expansions=self.step_count,
+                             heuristic_count=self.heuristic_count,
+                             time=time() - st,
+                             source=tuple(self.start_pos) if found else None)
+
+
+    def solve_sources(self, sources, end_pos:(int, int)=None):
+        """ Run a fresh search from many sources at once, finding the one with the shortest path to end_pos.
+                e.g. Which of many units reaches the end first, in a single search rather than one per unit.
+
+        Args:
+            sources ([(int, int), ...] or {(int, int): int}): Start positions, or a dict of start positions to initial g offsets
+                        (e.g. the distance a unit has already travelled, or a delay before it sets off, in path cost units).
+            end_pos (int, int, optional): End position, defaults to the current end_pos.
+
+        Returns:
+            Search_Result: Path from the best source, its cost (including the offset), expansions, heuristic count, wall time and the source.
+        """
+        st = time()
+        
+        clear_h = end_pos is not None and end_pos != self.end_pos
+        self.end_pos = self.end_pos if end_pos is None else end_pos
+        self.reset_search(clear_h=clear_h)
+        
+        # If no source could be seeded, run() would fall back to start_pos, so the search ends here.
+        self.search_sources(sources)
+        found = self.run() if self.open_count > 0 else False
+        
+        path = self.reconstruct_path(self.end_pos) if found else []
+        return Search_Result(path=path,
+                             cost=int(self.g_grid[self.end_pos]) if found else None,
+                             expansions=self.step_count,
+                             heuristic_count=self.heuristic_count,
+                             time=time() - st,
+                             source=path[0] if found else None)
+
+
+    def init_kwargs(self):
+        """ Constructor arguments that reproduce this simulation's setup (excluding terrain), e.g. for worker processes.
+
+        Returns:
+            dict: Keyword arguments for the constructor.
+        """
+        return dict(w=self.w, h=self.h, start_pos=self.start_pos, end_pos=self.end_pos, default_cost=self.default_cost,
+                    grid_dtypes=self.grid_dtypes, precompute_h=self.precompute_h, jit=self.jit)
+
+
+    def reset_search(self, clear_h:bool=True):
+        """ Clear all search state and stats, retaining terrain (and portals).
+
+        Args:
+            clear_h (bool, optional): If False, keep the h_grid, which is only valid while end_pos is unchanged. Defaults to True.
+        """
+        self.state_grid.fill(0)
+        self.g_grid.fill(self.max_value)
+        self.p_grid.fill(-1)
+        if clear_h:
+            self.h_grid.fill(self.max_value)
+        
+        self.open_heap = []
+        self.step_count = 0
+        self.step_time = 0
+        self.heuristic_count = 0
+        self.path_length = 0
+        self.last_pos = None
+        self.last_path_cache = None
+        self.open_count = 0
+        self.closed_count = 0
+        self.sources = {}
+
+
+    def jit_supported(self):
+        """ Whether the compiled engine is installed and reproduces this simulation's heuristic. """
+        from a_star_jit import JIT_AVAILABLE
+        return JIT_AVAILABLE
+
+
+    def jit_portals(self):
+        """ Portal arrays passed to the compiled engine (none for plain A*).
+
+        Returns:
+            (np.ndarray, np.ndarray, np.ndarray, np.ndarray): Portal index entered at each cell (-1 if none), (n, 2) entrances, (n, 2) exits,
+                and (n, n) distances from each exit to each entrance.
+        """
+        return (np.full((self.w, self.h), -1, dtype=np.int32), np.zeros((0, 2), dtype=np.int64), np.zeros((0, 2), dtype=np.int64),
+                np.zeros((0, 0), dtype=np.int64))
+
+
+    def run_jit(self):
+        """ Run the search to completion in the compiled engine, continuing from the current open set. """
+        from a_star_jit import search
+        
+        st = time()                                         # Start timer
+        
+        # The compiled engine does not calculate heuristics on the fly, so the whole h_grid is precomputed.
+        if self.open_heap and (self.h_grid == self.max_value).any():
+            self.precompute_heuristics()
+        
+        heap = np.array([(f, h, x * self.h + y) for f, h, (x, y) in self.open_heap], dtype=np.int64).reshape(-1, 3)
+        entry_grid, entries, exits, portal_distances = self.jit_portals()
+        
+        steps, max_g, last_i, self.open_count, self.closed_count, heuristic_count, heap_f, heap_h, heap_i = search(
+            self.cost_grid, self.h_grid, self.g_grid, self.p_grid, self.state_grid, entry_grid, entries, exits, portal_distances,
+            self.end_pos[0], self.end_pos[1], heap[:, 0], heap[:, 1], heap[:, 2], self.open_count, self.closed_count)
+        
+        # Rebuild the python open set, so the simulation may still be stepped afterwards
+        self.open_heap = [(f, h, divmod(i, self.h)) for f, h, i in zip(heap_f.tolist(), heap_h.tolist(), heap_i.tolist())]
+        
+        if steps > 0:
+            self.step_count += steps
+            self.last_pos = divmod(last_i, self.h)
+            self.path_length = max(self.path_length, max_g/10)  # Divide by 10 to remove the heuristic scalar
+        self.heuristic_count += heuristic_count
+        
+        self.step_time += time() - st                       # Stop timer and add to cumulative time
+
+
     def select_next_pos(self):
         """ Selects most promising cell from viable searched cells.
                 > Searched cells -> lowest f -> lowest h
                 > i.e. Searched but untraversed cell that may be on a shortest path and is closest to the end.
+                
+                Cells are popped from the open_heap, ties in f and h are broken by the lowest (x, y) coordinate.
+                Entries belonging to cells that have since been traversed are outdated and discarded (lazy deletion).
 
         Returns:
-            tuple: (int x, int y) coordinate of next cell to traverse
+            tuple: (int x, int y) coordinate of next cell to traverse, None if the open set is empty.
         """
-        masked_f = np.ma.masked_where(self.state_grid != 1, self.f_grid)         # Mask to only searched cells
-        masked_h = np.ma.masked_where(masked_f != np.min(masked_f), self.h_grid) # Mask further to only cells with the lowest f
-        return_pos = np.argmin(masked_h)                                         # Return argument that is closest to the end cell
-        return tuple(np.unravel_index(return_pos, self.h_grid.shape))            # Return coordinate in 2D
+        while self.open_heap:
+            _, _, pos = heapq.heappop(self.open_heap)
+            
+            # A cell may have been pushed multiple times as its g improved, only the lowest f entry is still valid.
+            if self.state_grid[pos] == 1:
+                return pos
+            
+        return None
     
     
     def search_neighbors(self, pos):
@@ -128,21 +465,106 @@ class A_Star():
         Args:
             pos (int, int): origin cell
         """
-        for w in range(-1, 2):
-            for h in range(-1, 2):
-                if w == 0 and h == 0: # Skip if origin cell
-                    continue
-                
-                neighbor_pos = (pos[0] + w, pos[1] + h)
-                self.search_cell(neighbor_pos, pos)
+        # All neighbors are expanded as a single batch, using the precomputed step distances.
+        xs = pos[0] + NEIGHBOR_OFFSETS[:, 0]
+        ys = pos[1] + NEIGHBOR_OFFSETS[:, 1]
+        self.search_cells(xs, ys, pos, self.step_distances(pos, xs, ys))
+
+
+    def step_distances(self, pos, xs, ys):
+        """ Distance of a single step from pos to each of its direct neighbors, before multiplying by cell cost.
+
+        Args:
+            pos (int, int): Origin cell.
+            xs (np.ndarray): X coordinates of neighbors, in NEIGHBOR_OFFSETS order.
+            ys (np.ndarray): Y coordinates of neighbors, in NEIGHBOR_OFFSETS order.
+
+        Returns:
+            np.ndarray: Distance to each neighbor.
+        """
+        return NEIGHBOR_DISTANCES
+
+
+    def search_cells(self, xs, ys, prev_pos, distances, step_costs=None):
+        """ Batched search_cell, searching many cells that share the parent prev_pos at once.
+                Bounds, cost and state checks, g comparison and updates are all vectorized.
+                Cells must be unique.
+
+        Args:
+            xs (np.ndarray): X coordinates of cells to add.
+            ys (np.ndarray): Y coordinates of cells to add.
+            prev_pos (int, int): Position of the parent cell.
+            distances (np.ndarray): Distance from prev_pos to each cell, before multiplying by cell cost.
+            step_costs (np.ndarray, optional): Full cost of reaching each cell from prev_pos, used instead of distances * cell cost.
+        """
+        if step_costs is not None:
+            distances = step_costs
+        
+        # Discard positions outside of the grid.
+        in_grid = (xs >= 0) & (xs < self.w) & (ys >= 0) & (ys < self.h)
+        xs, ys, distances = xs[in_grid], ys[in_grid], distances[in_grid]
+        
+        # Discard impassable (negative cost) and traversed cells.
+        costs = self.cost_grid[xs, ys]
+        states = self.state_grid[xs, ys]
+        viable = (costs >= 0) & (states != -1)
+        xs, ys, distances, costs, states = xs[viable], ys[viable], distances[viable], costs[viable], states[viable]
+        if step_costs is not None:
+            costs = 1 # Cell costs are already included
+        
+        if len(xs) == 0:
+            return
+        
+        # Calculate any missing distances from these cells to the end
+        missing_h = self.h_grid[xs, ys] == self.max_value
+        if missing_h.any():
+            if self.precompute_h:
+                self.precompute_heuristics()
+            else:
+                self.h_grid[xs[missing_h], ys[missing_h]] = self.end_heuristic_array(xs[missing_h], ys[missing_h])
+        
+        # g = (distance from prev cell to start) + (distance from this cell to prev cell * cost of this cell)
+        g = int(self.g_grid[prev_pos]) + distances.astype(np.int64) * costs
+        
+        # Update g_grid and parents where g is shorter than the previous g
+        improved = g < self.g_grid[xs, ys]
+        if improved.any():
+            xs_i, ys_i, g_i = xs[improved], ys[improved], g[improved]
+            h_i = self.h_grid[xs_i, ys_i]
+            self.g_grid[xs_i, ys_i] = g_i
+            self.p_grid[xs_i, ys_i] = prev_pos[0] * self.h + prev_pos[1]
+            
+            # Push the improved f, any previous entries for these cells become outdated.
+            for f, h, x, y in zip((g_i + h_i).tolist(), h_i.tolist(), xs_i.tolist(), ys_i.tolist()):
+                heapq.heappush(self.open_heap, (f, h, (x, y)))
+        
+        # Cells will remain searched until they are traversed or pathfinding ends.
+        self.open_count += int(np.count_nonzero(states == 0))
+        self.state_grid[xs, ys] = 1
+
+
+    def search_sources(self, sources):
+        """ Seed the search with many starting cells, sharing a single open set.
+                Paths may start from any source, the first to reach the end (counting its offset) gives the shortest path.
+                A source seeded twice keeps its lowest offset.
 
+        Args:
+            sources ([(int, int), ...] or {(int, int): int}): Start positions, or a dict of start positions to initial g offsets.
+        """
+        if not isinstance(sources, dict):
+            sources = {tuple(pos): 0 for pos in sources}
+        
+        for pos, start_g in sources.items():
+            self.search_cell(tuple(pos), start_g=int(start_g))
 
-    def search_cell(self, pos, prev_pos=None):
+
+    def search_cell(self, pos, prev_pos=None, start_g:int=0):
         """ Calculate f, g, and h values for a given cell and set its state to searched.
 
         Args:
             pos (int, int): Position of cell to add
             prev_pos ((int, int), optional): Position of parent cell, to track prior path. Defaults to None.
+            start_g (int, optional): Initial g of a cell without a parent cell (a source). Defaults to 0.
         """
         # If position is not in grid, abort.
         if pos[0] < 0 or pos[0] >= self.w or pos[1] < 0 or pos[1] >= self.h:
@@ -158,13 +580,22 @@ class A_Star():
             return
         
         # If we have not yet calculated the distance from this cell to the end, do so now
-        if self.h_grid[pos] == np.iinfo(int).max:
-            self.h_grid[pos] = self.distance_heuristic(pos, self.end_pos)
+        if self.h_grid[pos] == self.max_value:
+            if self.precompute_h:
+                self.precompute_heuristics() # Fills every cell, so this only happens once
+            else:
+                self.h_grid[pos] = self.end_heuristic(pos)
         
         
         if prev_pos is None:
-            # If we have no parent cell, the distance from our parent is 0 and we do NOT update p_grid.
-            self.g_grid[pos] = 0
+            # If we have no parent cell, g is the source's initial offset (usually 0).
+            #   Any parent from an earlier search of this cell is dropped, as the cell is now the start of its own path.
+            if start_g < self.g_grid[pos]:
+                self.g_grid[pos] = start_g
+                self.p_grid[pos] = -1
+                self.sources[pos] = start_g
+                h = int(self.h_grid[pos])
+                heapq.heappush(self.open_heap, (start_g + h, h, pos))
             
         else:
             # Calculate distance from start position to this cell
@@ -173,10 +604,16 @@ class A_Star():
             
             # Update g_grid and parent if g is shorter than the previous g
             if g < self.g_grid[pos]:
-                self.p_grid[pos] = prev_pos
+                self.p_grid[pos] = prev_pos[0] * self.h + prev_pos[1]
                 self.g_grid[pos] = g
+                
+                # Push the improved f, any previous entry for this cell becomes outdated.
+                h = int(self.h_grid[pos])
+                heapq.heappush(self.open_heap, (int(g) + h, h, pos))
         
         # Cell will remain searched until it is traversed or pathfinding ends.
+        if self.state_grid[pos] == 0:
+            self.open_count += 1
         self.state_grid[pos] = 1
 
     
@@ -194,7 +631,8 @@ class A_Star():
         if prev_pos is None:
             return 0
         else:
-            return self.g_grid[prev_pos] + self.distance_heuristic(prev_pos, pos) * self.cost_grid[pos]
+            # Cast to python ints, so compact grid dtypes cannot overflow during the calculation.
+            return int(self.g_grid[prev_pos]) + self.distance_heuristic(prev_pos, pos) * int(self.cost_grid[pos])
     
     
     def distance_heuristic(self, pos1, pos2, orthogonal_cost=10, diagonal_cost=14, increment_count=True):
@@ -215,13 +653,62 @@ class A_Star():
         """
         self.heuristic_count += increment_count
         
-        # Convert to distance vector
-        vector = np.abs(np.array(pos1) - np.array(pos2))
+        # Convert to distance vector (plain ints, numpy arrays are too costly for a single pair of cells)
+        dx, dy = abs(pos1[0] - pos2[0]), abs(pos1[1] - pos2[1])
         
         # Orthogonal movement is the difference between h and v travel, diagonal is the overlap.
-        return int(orthogonal_cost * abs(vector[0] - vector[1]) + diagonal_cost * min(vector))
+        return int(orthogonal_cost * abs(dx - dy) + diagonal_cost * min(dx, dy))
+
 
+    def heuristic_array(self, xs, ys, target_pos):
+        """ Vectorized distance_heuristic from many cells to a single target.
+
+        Args:
+            xs (np.ndarray): X coordinates of cells.
+            ys (np.ndarray): Y coordinates of cells, same shape as xs.
+            target_pos (int, int): Target cell coordinate.
+
+        Returns:
+            np.ndarray: Heuristic distance from each cell to target_pos.
+        """
+        self.heuristic_count += np.size(xs) # One distance per cell
+        return octile_distance(xs - target_pos[0], ys - target_pos[1])
+    
+    
+    def precompute_heuristics(self):
+        """ Fill the whole h_grid with the heuristic distance to end_pos in one vectorized pass.
+                Called automatically by search_cell when precompute_h is set, may be called manually otherwise.
+        """
+        xs, ys = np.indices((self.w, self.h))
+        self.h_grid[:] = self.end_heuristic_array(xs, ys)
+    
+    
+    def end_heuristic(self, pos):
+        """ Heuristic distance from a cell to the end, as stored in h_grid.
+                Subclasses searching for other targets (e.g. several goals) override this and end_heuristic_array().
 
+        Args:
+            pos (int, int): Cell coordinate.
+
+        Returns:
+            int: Heuristic distance from pos to end_pos.
+        """
+        return self.distance_heuristic(pos, self.end_pos)
+    
+    
+    def end_heuristic_array(self, xs, ys):
+        """ Vectorized end_heuristic().
+
+        Args:
+            xs (np.ndarray): X coordinates of cells.
+            ys (np.ndarray): Y coordinates of cells, same shape as xs.
+
+        Returns:
+            np.ndarray: Heuristic distance from each cell to end_pos.
+        """
+        return self.heuristic_array(xs, ys, self.end_pos)
+    
+    
     def reconstruct_path(self, pos):
         """ Generates the list of parent cells leading up to pos.
 
@@ -232,11 +719,13 @@ class A_Star():
             [(int, int), ...]: A list of cell coordinates, from the original parent of pos to pos.
         """
         path = [pos]
+        parent = self.p_grid[pos]
         
-        # If we encounter a coordinate containing -1, we reached a cell with no parent (i.e. start_pos)
-        while -1 not in self.p_grid[pos]:
-            pos = tuple(self.p_grid[pos])
+        # If we encounter a parent of -1, we reached a cell with no parent (i.e. start_pos)
+        while parent != -1:
+            pos = divmod(int(parent), self.h) # Convert flat index back into (x, y) coords
             path.append(pos)
+            parent = self.p_grid[pos]
             
         return path[::-1] # Reversed to give path from start -> end
         
@@ -255,7 +744,12 @@ class A_Star_Portals(A_Star):
                  start_pos:(int, int)=None,
                  end_pos:(int, int)=None,
                  default_cost:int=1,
-                 h_mode='standard') -> None:
+                 h_mode='standard',
+                 grid_dtypes:str='standard',
+                 precompute_h:bool=False,
+                 jit:bool=False,
+                 portal_cache_size:int=None,
+                 cost_grid:np.ndarray=None) -> None:
         """ Initialize A* with portals.
 
         Args:
@@ -267,37 +761,121 @@ class A_Star_Portals(A_Star):
             h_mode (str, optional): Determines the method of heuristic calculation. Defaults to 'standard'.
                         (n = number of portals)
                                 O(n^2)  > 'standard' stores and reuses the portal heuristic distances to the end position (as it is the most common query)
-                                O(n^2)  > 'store_all'  stores and reuses calculated portal heuristics for all queried target positions (most memory intensive)
+                                O(n^2)  > 'store_all'  stores and reuses calculated portal heuristics for all queried target positions (most memory intensive, see portal_cache_size)
                                 O(n^2)  > 'store_none' recalculates portal heuristics for each queried target position (least memory intensive)
                                 O(n!)   > 'naive' uses my initial costly recursive algorithm (highest)
+            grid_dtypes (str, optional): Key of GRID_DTYPES, 'compact' reduces memory use of large grids. Defaults to 'standard'.
+            precompute_h (bool, optional): If True, compute the whole h_grid in one vectorized pass before searching. Defaults to False.
+            jit (bool, optional): If True, run() uses the compiled engine when numba is installed (not for 'naive' h_mode). Defaults to False.
+            portal_cache_size (int, optional): Maximum number of target positions in stored_portal_h, the least recently used are evicted first.
+                        The end position is never evicted. Defaults to None (unbounded).
+            cost_grid (np.ndarray, optional): Existing (w, h) terrain to use without copying, e.g. a memory-mapped grid from scenario.py.
+                        Defaults to None (a new grid filled with default_cost).
         """
-        super().__init__(w, h, start_pos, end_pos, default_cost)
+        super().__init__(w, h, start_pos, end_pos, default_cost, grid_dtypes, precompute_h, jit, cost_grid)
         
-        # Dict of portal entrances and exits, stored as (x, y) coordinates
-        self.portals = {}
+        # Dict of portal entrances and exits, stored as (x, y) coordinates (any dict assigned is converted to a Portal_Dict)
+        self.portals = Portal_Dict()
         
-        self.stored_portal_h = {} # Dict of precalculated portal heuristics for each queried target position
+        self.stored_portal_h = OrderedDict() # Dict of precalculated portal heuristics for each queried target position, least recently used first
+        self.portal_cache_size = portal_cache_size
         self.portal_query_counts = {}
         self.portal_sort_count = 0
+        self.portal_cache_hits = 0      # Queries answered from stored_portal_h
+        self.portal_cache_misses = 0    # Queries that had to be calculated and stored
+        self.portal_cache_evictions = 0 # Stored targets discarded to respect portal_cache_size
+        self.portal_table = None  # (portals version, entrances, exits, distances) all-pairs portal distances, rebuilt when portals change
+        self.portal_buckets = {}  # {(bx, by): [entrance, ...]} portal entrances bucketed into square blocks of cells, rebuilt with portal_table
+        self.portal_bucket_size = 1
         
         # # # # # # # # # # # # #
         # Testing variables
         self.h_mode = h_mode
     
+    
+    @property
+    def portals(self):
+        return self._portals
+    
+    @portals.setter
+    def portals(self, portals):
+        """ Assigned dicts are wrapped in a Portal_Dict (a Portal_Dict is kept as is, so sims may share one). """
+        self._portals = portals if isinstance(portals, Portal_Dict) else Portal_Dict(portals)
 
     
     
     def search_neighbors(self, pos):
         """ Seach neighbors of a given cell, and if the cell is a portal, search the corresponding exit cell as well.
+                The portal exit is added to the same batch as the neighbors, at a distance of 0.
 
         Args:
-            pos (int, int): _description_
+            pos (int, int): Origin cell.
         """
-        super().search_neighbors(pos)
+        xs = pos[0] + NEIGHBOR_OFFSETS[:, 0]
+        ys = pos[1] + NEIGHBOR_OFFSETS[:, 1]
+        distances = self.step_distances(pos, xs, ys)
         
         # If the cell is a portal, search the corresponding exit cell as well.
         if pos in self.portals:
-            self.search_cell(self.portals[pos], pos)
+            p_exit = self.portals[pos]
+            
+            # An exit adjacent to the portal replaces that neighbor, as the portal is never the longer route.
+            adjacent = (xs != p_exit[0]) | (ys != p_exit[1])
+            xs = np.append(xs[adjacent], p_exit[0])
+            ys = np.append(ys[adjacent], p_exit[1])
+            distances = np.append(distances[adjacent], 0)
+        
+        self.search_cells(xs, ys, pos, distances)
+    
+    
+    def step_distances(self, pos, xs, ys):
+        """ Distance of a single step from pos to each of its direct neighbors, considering portal shortcuts.
+                A portal can only shorten a single step if its entrance is on pos or orthogonally adjacent to it,
+                in that case the full distance_heuristic is calculated, otherwise the precomputed step distances are used.
+
+        Args:
+            pos (int, int): Origin cell.
+            xs (np.ndarray): X coordinates of neighbors, in NEIGHBOR_OFFSETS order.
+            ys (np.ndarray): Y coordinates of neighbors, in NEIGHBOR_OFFSETS order.
+
+        Returns:
+            np.ndarray: Distance to each neighbor.
+        """
+        x, y = pos
+        if not any(entry in self.portals for entry in ((x, y), (x-1, y), (x+1, y), (x, y-1), (x, y+1))):
+            return NEIGHBOR_DISTANCES
+        
+        in_grid = (xs >= 0) & (xs < self.w) & (ys >= 0) & (ys < self.h)
+        return np.array([self.distance_heuristic(pos, (nx, ny)) if valid else 0
+                         for nx, ny, valid in zip(xs.tolist(), ys.tolist(), in_grid.tolist())])
+    
+    
+    def init_kwargs(self):
+        """ Constructor arguments that reproduce this simulation's setup (excluding terrain and portals).
+
+        Returns:
+            dict: Keyword arguments for the constructor.
+        """
+        return dict(super().init_kwargs(), h_mode=self.h_mode, portal_cache_size=self.portal_cache_size)
+    
+    
+    def jit_supported(self):
+        """ The compiled engine mirrors the sorted portal heuristics, the 'naive' mode always steps in python. """
+        return self.h_mode != 'naive' and super().jit_supported()
+    
+    
+    def jit_portals(self):
+        """ Portal arrays passed to the compiled engine, in portals dict order.
+
+        Returns:
+            (np.ndarray, np.ndarray, np.ndarray, np.ndarray): Portal index entered at each cell (-1 if none), (n, 2) entrances, (n, 2) exits,
+                and (n, n) distances from each exit to each entrance (see portal_distance_table()).
+        """
+        entry_grid, entries, exits, distances = super().jit_portals()
+        if self.portals:
+            entries, exits, distances = self.portal_distance_table()
+            entry_grid[entries[:, 0], entries[:, 1]] = np.arange(len(entries))
+        return entry_grid, entries, exits, distances
     
     
     def distance_heuristic(self, pos1, pos2, **kwargs):
@@ -323,43 +901,127 @@ class A_Star_Portals(A_Star):
         if self.h_mode == 'naive':
             return self.naive_recursive_portal_heuristic(pos1, pos2, portals=self.portals, **kwargs)
         
+        p_heuristics = self.query_portal_heuristics(pos2)
+        
+        # Begin with the heuristic distance between the two cells, considering no portals.
+        distances = [super().distance_heuristic(pos1, pos2, **kwargs)]
+        
+        # With many portals, only visit those that could beat the shortest distance found so far.
+        if len(p_heuristics) >= PORTAL_INDEX_THRESHOLD:
+            return self.indexed_portal_heuristic(pos1, p_heuristics, distances[0], **kwargs)
+        
+        # For each portal, append distance-to-portal + portal-to-target.
+        for portal_entry, portal_h in p_heuristics.items():
+            distances.append(super().distance_heuristic(pos1, portal_entry, **kwargs) + portal_h)
+        
+        # Return the shortest distance found.
+        return min(distances)
+    
+    
+    def indexed_portal_heuristic(self, pos1, p_heuristics, shortest_dist, **kwargs):
+        """ Shortest distance-to-portal + portal-to-target, visiting bucketed portal entrances in rings around pos1.
+                Every entrance in ring r (r > 0) is at least (r - 1) * bucket size + 1 cells away,
+                so the search stops once that distance (plus the lowest portal-to-target distance) cannot beat the shortest found.
+
+        Args:
+            pos1 (int, int): Cell coordinate.
+            p_heuristics (Portal_Heuristics): Heuristic distance from each portal entrance to the target, from query_portal_heuristics().
+            shortest_dist (int): Shortest distance found so far (i.e. without portals).
+            **kwargs: Additional arguments to pass to A_Star.distance_heuristic()
+
+        Returns:
+            int: Heuristic distance between pos1 and the target.
+        """
+        size = self.portal_bucket_size
+        bx, by = pos1[0] // size, pos1[1] // size
+        min_portal_h = p_heuristics.min_h
+        orthogonal_cost = kwargs.get('orthogonal_cost', 10)
+        
+        last_ring = max(bx, by, (self.w - 1) // size - bx, (self.h - 1) // size - by)
+        for ring in range(last_ring + 1):
+            if ring > 0 and orthogonal_cost * ((ring - 1) * size + 1) + min_portal_h >= shortest_dist:
+                break
+            
+            # Buckets on the perimeter of the ring
+            if ring == 0:
+                buckets = [(bx, by)]
+            else:
+                buckets = [(bx + d, by + side) for d in range(-ring, ring + 1) for side in (-ring, ring)] + \
+                          [(bx + side, by + d) for d in range(-ring + 1, ring) for side in (-ring, ring)]
+            
+            for bucket in buckets:
+                for portal_entry in self.portal_buckets.get(bucket, ()):
+                    shortest_dist = min(shortest_dist, super().distance_heuristic(pos1, portal_entry, **kwargs) + p_heuristics[portal_entry])
+        
+        return shortest_dist
+    
+    
+    def query_portal_heuristics(self, target_pos:(int, int)):
+        """ Retrieve the heuristic distance from each portal to the target position, as determined by 'self.h_mode'.
+
+        Args:
+            target_pos (int, int): Target position for heuristics.
+
+        Returns:
+            dict: Dict of (int, int) portal entrance coords to heuristic distances from target point, accounting for shortcuts.
+        """
         # # #
         # The 3 heuristic choices below ALL retrieve or precalculate the heuristic distance from every portal to the target position,
-        #   and then return the lowest combined distance-to-portal + portal-to-target value.
+        #   from which the lowest combined distance-to-portal + portal-to-target value is found.
         # The portal heuristic precalculations are O(n^2), generally much faster than the naive algorithm.
         # The differences are in which portal heuristics are stored and reused.
         # # #
         
         # 'store_none' stores no portal heuristics, and recalculates them for each target position
         if self.h_mode == 'store_none':
-            p_heuristics = self.sort_portal_heuristics(target_pos=pos2)
+            return self.sort_portal_heuristics(target_pos=target_pos)
         
         # 'store_all' stores all calculated portal heuristics, and reuses them if the target position has been queried before.
         # This approach is the only one with scaling memory usage, but also performs the least heuristic calculations.
         elif self.h_mode == 'store_all':
-            p_heuristics = self.get_portal_heuristics(pos2)
+            return self.get_portal_heuristics(target_pos)
         
         # 'standard' stores and reuses the heuristic distances from each portal to the end position.
         # All other target points are calculated as needed.
         else:
-            if pos2 == self.end_pos:
-                p_heuristics = self.get_portal_heuristics(target_pos=pos2)
+            if target_pos == self.end_pos:
+                return self.get_portal_heuristics(target_pos=target_pos)
             else:
-                p_heuristics = self.sort_portal_heuristics(target_pos=pos2)
+                return self.sort_portal_heuristics(target_pos=target_pos)
+    
+    
+    def heuristic_array(self, xs, ys, target_pos):
+        """ Vectorized distance_heuristic from many cells to a single target, considering portal shortcuts.
+                The minimum over each portal (distance-to-entrance + portal-to-target) is reduced in one numpy pass per portal.
+
+        Args:
+            xs (np.ndarray): X coordinates of cells.
+            ys (np.ndarray): Y coordinates of cells, same shape as xs.
+            target_pos (int, int): Target cell coordinate.
+
+        Returns:
+            np.ndarray: Heuristic distance from each cell to target_pos.
+        """
+        # The naive heuristic cannot be vectorized, evaluate it one cell at a time.
+        if self.h_mode == 'naive':
+            return np.array([self.distance_heuristic((x, y), target_pos) for x, y in zip(np.ravel(xs), np.ravel(ys))],
+                            dtype=np.int64).reshape(np.shape(xs))
         
-        # Begin with the heuristic distance between the two cells, considering no portals.
-        distances = [super().distance_heuristic(pos1, pos2, **kwargs)]
+        p_heuristics = self.query_portal_heuristics(target_pos)
         
-        # For each portal, append distance-to-portal + portal-to-target.
-        for portal_entry, portal_h in p_heuristics.items():
-            distances.append(super().distance_heuristic(pos1, portal_entry, **kwargs) + portal_h)
+        # Begin with the heuristic distance to the target, considering no portals.
+        distances = super().heuristic_array(xs, ys, target_pos)
         
-        # Return the shortest distance found.
-        return min(distances)
+        # For each portal, keep distance-to-portal + portal-to-target wherever it is shorter.
+        for portal_entry, portal_h in p_heuristics.items():
+            distances = np.minimum(distances, super().heuristic_array(xs, ys, portal_entry) + portal_h)
+            
+        return distances
     
     
     def get_portal_heuristics(self, target_pos:(int, int)):
         """ If stored heuristics exist for the given target position, return them, otherwise calculate.
+                If portal_cache_size is set, the least recently used targets are evicted to make room (except the end position).
 
         Args:
             target_pos (int, int): Target position for heuristics.
@@ -370,70 +1032,113 @@ class A_Star_Portals(A_Star):
         # Track the number of times each target position is queried.
         self.portal_query_counts[target_pos] = self.portal_query_counts.get(target_pos, 0) + 1
         
-        # If the target position has not been queried before, calculate and store the portal heuristics
-        if target_pos not in self.stored_portal_h:
-            self.stored_portal_h[target_pos] = self.sort_portal_heuristics(target_pos)
+        # Discard stored heuristics if the portals have changed
+        self.portal_distance_table()
+        
+        # If the target position has been queried before, mark it as the most recently used
+        if target_pos in self.stored_portal_h:
+            self.portal_cache_hits += 1
+            self.stored_portal_h.move_to_end(target_pos)
+            return self.stored_portal_h[target_pos]
+        
+        # Otherwise calculate and store the portal heuristics
+        self.portal_cache_misses += 1
+        portal_h = self.sort_portal_heuristics(target_pos)
+        self.store_portal_heuristics(target_pos, portal_h)
             
-        return self.stored_portal_h[target_pos]
+        return portal_h
+    
+    
+    def store_portal_heuristics(self, target_pos:(int, int), portal_h):
+        """ Store the portal heuristics of a target position as the most recently used,
+                evicting the least recently used targets (except the end position) if portal_cache_size is exceeded.
+
+        Args:
+            target_pos (int, int): Target position of the heuristics.
+            portal_h (Portal_Heuristics): Heuristic distance from each portal to target_pos, from sort_portal_heuristics().
+        """
+        self.stored_portal_h[target_pos] = portal_h
+        self.stored_portal_h.move_to_end(target_pos)
+        
+        # Evict the least recently used targets, skipping the end position
+        if self.portal_cache_size is not None:
+            for stored_pos in list(self.stored_portal_h):
+                if len(self.stored_portal_h) <= self.portal_cache_size:
+                    break
+                if stored_pos != self.end_pos:
+                    del self.stored_portal_h[stored_pos]
+                    self.portal_cache_evictions += 1
 
 
     def sort_portal_heuristics(self, target_pos:(int, int)=None):
         """ Precalculate the heuristic distance from each portal to the target position.
         
-                By looking for shortcuts only through portals with exits closer to the target position than the current portal,
-                and updating the heuristic distance of each portal to reflect the new shortest path through other portals,
-                we significantly reduce the number of portal permutations to consider.
-                
-                 > For n portals, we begin with n heuristic calculations (from exit to target), and sort portals by this distance.
-                We then check each portal for shortcuts through portals that exit closer to the target position, updating its heuristic.
-                 > This process makes 0 + 1 + 2 + ... + n-1 = n(n-1)/2 portal heuristic calculations.
-                The total number of portal heuristic calculations is therefore n + n(n-1)/2 = n(n+1)/2. (i.e. O(n^2))
+                Each portal's exit either heads directly to the target position, or walks to the entrance of another portal first.
+                The shortest walk from every exit to every entrance (through any number of portals) is precalculated once
+                in portal_distance_table(), so only the n direct exit-to-target distances are calculated per target,
+                followed by a single vectorized (n, n) minimum.
+                 > The result is exact (the same as the naive recursive heuristic), rather than only considering portals closer to the target.
 
         Args:
             target_pos ((int, int), optional): Target cell coordinate. Defaults to None.
 
         Returns:
-            dict: Dict of heuristic distances from each portal to the target position.
+            Portal_Heuristics: Dict of heuristic distances from each portal to the target position, and the lowest of them.
         """
         self.portal_sort_count += 1
 
         if target_pos is None:
             target_pos = self.end_pos
         
-        # Tracks shortest known distance from each portal exit to the target position
-        portal_target_heuristics = {}
-
-        # Calculate and store the direct heuristic distance from each portal exit to the target position
-        #   This is the value we will try to reduce via portal shortcuts
-        for p_entry, p_exit in self.portals.items():
-                portal_target_heuristics[p_entry] = super().distance_heuristic(p_exit, target_pos)
+        entries, exits, distances = self.portal_distance_table()
         
-        # Sort portals by heuristic distance to the target position, lowest to highest
-        sorted_portals = list(sorted(portal_target_heuristics.items(), key=lambda x: x[1]))
+        # Direct heuristic distance from each portal exit to the target position
+        direct = A_Star.heuristic_array(self, exits[:, 0], exits[:, 1], target_pos)
+        
+        # Distance from exit i to the entrance of portal j, then directly from exit j to the target position
+        if len(direct):
+            direct = np.minimum(direct, (distances + direct[None, :]).min(axis=1))
+            
+        return Portal_Heuristics(zip(self.portals.keys(), direct.tolist()), min_h=int(direct.min()) if len(direct) else self.max_value)
+    
+    
+    def portal_distance_table(self):
+        """ All-pairs heuristic distance from each portal exit to each portal entrance, travelling through any other portals.
+                Built with a vectorized Floyd-Warshall pass over the portals (O(n^3) in numpy, n = number of portals),
+                and only rebuilt when the portals change, which also discards any stored portal heuristics and rebuilds the bucket index.
+
+        Returns:
+            (np.ndarray, np.ndarray, np.ndarray): (n, 2) entrances, (n, 2) exits, and (n, n) distances from exit i to entrance j.
+        """
+        # The version changes with any change to the portals, so they are never compared one by one
+        version = self.portals.version
         
-        # For each portal, calculate whether a shortcut exists ONLY through any portals that are closer to the target position
-        for i, (p_entry, _) in enumerate(sorted_portals):
-            p_exit = self.portals[p_entry]
+        if self.portal_table is None or self.portal_table[0] != version:
+            # Heuristics stored for the previous portals are no longer valid
+            if self.portal_table is not None:
+                self.stored_portal_h.clear()
             
-            # p_heuristic represents (p_exit -> target_pos)
-            p_heuristic = portal_target_heuristics[p_entry]
+            entries = np.array(list(self.portals.keys()), dtype=np.int64).reshape(-1, 2)
+            exits = np.array(list(self.portals.values()), dtype=np.int64).reshape(-1, 2)
             
-            # Iterate over all subportals that exit closer to the target position
-            for subp_entry, _ in sorted_portals[:i]:
-                
-                # subp_heuristic represents (subp_entry -> target_pos), and may include other shortcuts as we update portal_target_heuristics
-                subp_heuristic = portal_target_heuristics[subp_entry] 
-                
-                # Distance from portal exit to subportal entrance
-                dist_to_subportal = super().distance_heuristic(p_exit, subp_entry) 
-                
-                # If (portal_exit -> subp_entry + subp_heuristic) is less than p_heuristic, a shortcut exists.
-                p_heuristic = min(p_heuristic, dist_to_subportal + subp_heuristic) # NOTE: Non-debug version
+            # Direct distance from each exit to each entrance
+            distances = octile_distance(exits[:, None, 0] - entries[None, :, 0], exits[:, None, 1] - entries[None, :, 1]).astype(np.int64)
+            self.heuristic_count += distances.size
+            
+            # Allow travel through portal k: exit i -> entrance k, then exit k -> entrance j
+            for k in range(len(entries)):
+                distances = np.minimum(distances, distances[:, k:k+1] + distances[k:k+1, :])
+            
+            self.portal_table = (version, entries, exits, distances)
             
-            # Update the portal_target_heuristics dict with the new heuristic distance, which may affect later calculations
-            portal_target_heuristics[p_entry] = p_heuristic
+            # Bucket the entrances, sized to hold roughly one portal per bucket
+            self.portal_bucket_size = max(4, int(np.sqrt(self.w * self.h / max(len(entries), 1))))
+            self.portal_buckets = {}
+            for portal_entry in self.portals:
+                bucket = (portal_entry[0] // self.portal_bucket_size, portal_entry[1] // self.portal_bucket_size)
+                self.portal_buckets.setdefault(bucket, []).append(portal_entry)
             
-        return portal_target_heuristics
+        return self.portal_table[1:]
 
 
     # NOTE: No longer used, seemingly accurate but too resource intensive with 10+ portals
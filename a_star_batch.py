@@ -0,0 +1,153 @@
+# Nathaniel Alden Homans Youngren
+# September 13, 2023
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from a_star import A_Star_Portals
+
+# NOTE: INSTRUCTIONS
+#
+# 1. Set up a single simulation with the desired terrain (cost_grid) and portals, as for a normal search.
+# 2. Call solve_batch(sim, queries), where queries is a list of (start_pos, end_pos) pairs.
+# 3. A list of Search_Results is returned, in the same order as the queries.
+#
+# Each worker process builds one simulation and reuses it for all of its queries through solve(),
+#   so grids are allocated once per worker rather than once per query.
+# The cost grid is shared with the workers through shared memory rather than pickled,
+#   and the portal heuristics of each end position are calculated once and handed to every worker.
+#   If the cost grid is memory-mapped read-only from a file (see scenario.py), each worker maps the same file instead.
+# Queries are grouped by end position, so workers may also reuse their h_grid between queries.
+#
+
+
+# Per-process state of a batch worker (avoids individual global variables)
+WORKER_STATE = {'sim': None,    # Simulation reused for every query of this worker
+                'shm': None,    # Shared memory block holding the cost grid, kept open for the lifetime of the worker
+                }
+
+
+def solve_batch(sim, queries, workers:int=None, chunksize:int=16):
+    """ Solve many (start_pos, end_pos) queries against the terrain and portals of a single simulation.
+
+    Args:
+        sim (A_Star): Simulation holding the terrain (and portals) to search, its grids are not modified.
+        queries ([((int, int), (int, int)), ...]): List of (start_pos, end_pos) pairs.
+        workers (int, optional): Number of worker processes. If 1, queries are solved in this process. Defaults to os.cpu_count().
+        chunksize (int, optional): Number of queries sent to a worker at a time. Defaults to 16.
+
+    Returns:
+        [Search_Result, ...]: Result of each query, in the same order as queries.
+    """
+    # Group queries by end position, so heuristics can be reused between consecutive queries
+    order = sorted(range(len(queries)), key=lambda i: tuple(queries[i][1]))
+    sorted_queries = [queries[i] for i in order]
+
+    # Calculate portal heuristics for every end position once, rather than once per worker
+    #   (in the order of sorted_queries, see init_worker())
+    portal_h = {}
+    if isinstance(sim, A_Star_Portals) and sim.portals:
+        for end_pos in sorted({tuple(end_pos) for _, end_pos in queries}):
+            portal_h[end_pos] = sim.sort_portal_heuristics(end_pos)
+
+    settings = (type(sim), sim.init_kwargs(), dict(getattr(sim, 'portals', {})), portal_h)
+
+    if workers == 1:
+        init_worker(sim.cost_grid, *settings)
+        sorted_results = [solve_query(query) for query in sorted_queries]
+        WORKER_STATE['sim'] = None
+
+    elif isinstance(sim.cost_grid, np.memmap) and sim.cost_grid.mode == 'r' and sim.cost_grid.filename is not None \
+            and sim.cost_grid.flags.c_contiguous:
+        # Workers map the same file, so its pages are shared through the OS page cache without any copy
+        #   Only for read-only maps, copy-on-write ('c') and writable maps may hold edits not (yet) in the file
+        cost_info = (sim.cost_grid.filename, sim.cost_grid.offset, sim.cost_grid.shape, sim.cost_grid.dtype.str)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_mapped_worker, initargs=(cost_info, *settings)) as executor:
+            sorted_results = list(executor.map(solve_query, sorted_queries, chunksize=chunksize))
+
+    else:
+        # Share the cost grid with workers, instead of pickling it for each one
+        shm = shared_memory.SharedMemory(create=True, size=max(sim.cost_grid.nbytes, 1))
+        shared_cost = np.ndarray(sim.cost_grid.shape, dtype=sim.cost_grid.dtype, buffer=shm.buf)
+        shared_cost[:] = sim.cost_grid
+        try:
+            cost_info = (shm.name, sim.cost_grid.shape, sim.cost_grid.dtype.str)
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_shared_worker, initargs=(cost_info, *settings)) as executor:
+                sorted_results = list(executor.map(solve_query, sorted_queries, chunksize=chunksize))
+        finally:
+            del shared_cost
+            shm.close()
+            shm.unlink()
+
+    # Return results in the original query order
+    results = [None] * len(queries)
+    for i, result in zip(order, sorted_results):
+        results[i] = result
+    return results
+
+
+def init_shared_worker(cost_info, sim_class, kwargs, portals, portal_h):
+    """ Worker process initializer, attaches to the shared cost grid and builds the reusable simulation.
+
+    Args:
+        cost_info (str, tuple, str): Shared memory name, shape and dtype string of the cost grid.
+        sim_class (type): Class of the simulation to build.
+        kwargs (dict): Constructor arguments of the simulation.
+        portals (dict): Portals of the simulation.
+        portal_h (dict): Precalculated portal heuristics, for each end position.
+    """
+    name, shape, dtype = cost_info
+    WORKER_STATE['shm'] = shared_memory.SharedMemory(name=name)
+    cost_grid = np.ndarray(shape, dtype=np.dtype(dtype), buffer=WORKER_STATE['shm'].buf)
+    init_worker(cost_grid, sim_class, kwargs, portals, portal_h)
+
+
+def init_mapped_worker(cost_info, sim_class, kwargs, portals, portal_h):
+    """ Worker process initializer, maps the cost grid file read-only and builds the reusable simulation.
+
+    Args:
+        cost_info (str, int, tuple, str): File name, byte offset, shape and dtype string of the cost grid.
+        sim_class (type): Class of the simulation to build.
+        kwargs (dict): Constructor arguments of the simulation.
+        portals (dict): Portals of the simulation.
+        portal_h (dict): Precalculated portal heuristics, for each end position.
+    """
+    filename, offset, shape, dtype = cost_info
+    cost_grid = np.memmap(filename, dtype=np.dtype(dtype), mode='r', offset=offset, shape=shape)
+    init_worker(cost_grid, sim_class, kwargs, portals, portal_h)
+
+
+def init_worker(cost_grid, sim_class, kwargs, portals, portal_h):
+    """ Build the simulation reused by this process, around a read-only cost grid.
+
+    Args:
+        cost_grid (np.ndarray): Terrain, used directly without copying.
+        sim_class (type): Class of the simulation to build.
+        kwargs (dict): Constructor arguments of the simulation.
+        portals (dict): Portals of the simulation.
+        portal_h (dict): Precalculated portal heuristics, for each end position.
+    """
+    # Passed to the constructor, so no default grid of the same size is allocated only to be replaced
+    sim = sim_class(cost_grid=cost_grid, **kwargs)
+    if isinstance(sim, A_Star_Portals):
+        sim.portals = portals
+        
+        # Stored through the same bounded insert as queried heuristics, so portal_cache_size still holds
+        #   Inserted last to first, so if the cache is too small, the heuristics of the first queries are kept
+        for end_pos in reversed(list(portal_h)):
+            sim.store_portal_heuristics(end_pos, portal_h[end_pos])
+    WORKER_STATE['sim'] = sim
+
+
+def solve_query(query):
+    """ Solve a single (start_pos, end_pos) query with this process's simulation.
+
+    Args:
+        query ((int, int), (int, int)): Start and end positions.
+
+    Returns:
+        Search_Result: Result of the search.
+    """
+    start_pos, end_pos = query
+    return WORKER_STATE['sim'].solve(tuple(start_pos), tuple(end_pos))
@@ -0,0 +1,303 @@
+# Nathaniel Alden Homans Youngren
+# September 13, 2023
+
+import itertools
+import numpy as np
+from time import time
+from typing import NamedTuple
+from a_star import A_Star_Portals, Search_Result
+
+# NOTE: INSTRUCTIONS
+#
+# 1. Initialize A_Star_Goals as A_Star_Portals, with a list of goals instead of an end position.
+# 2. Set up terrain and portals as usual.
+# 3. Call solve() to find the nearest goal (any goal mode):
+#       > The heuristic of each cell is the lowest heuristic to any goal, and the search stops at the first goal traversed.
+#       > A single search replaces one search per goal, e.g. a unit choosing the nearest of many depots.
+# 4. Or call solve_all() to find the shortest route visiting every goal (all goals mode):
+#       > One search from the start and from each goal finds the distance to every other goal at once,
+#           as a consistent heuristic (the minimum to each remaining goal) leaves every traversed cell with its shortest g.
+#       > The order of visits is then chosen from these distances, exactly for up to EXACT_ORDER_LIMIT goals,
+#           otherwise by nearest neighbor followed by 2-opt improvement.
+# end_pos holds the goal reached by the last solve().
+#
+
+# Largest number of goals whose visiting order is found exactly (Held-Karp, O(2^n * n^2))
+EXACT_ORDER_LIMIT = 12
+
+
+class Tour_Result(NamedTuple):
+    """ Summary of a route visiting every goal, from A_Star_Goals.solve_all(). """
+    order: list             # Goals in the order visited, reachable goals only
+    path: list              # Cells from start through every goal in order, empty if no goal was reachable
+    cost: int               # Total cost of the path, None if no goal was reachable
+    unreachable: list       # Goals that could not be reached from the start, or from other goals
+    expansions: int         # Number of cells traversed, over all searches
+    heuristic_count: int    # Number of distance heuristics calculated, over all searches
+    time: float             # Wall time of all searches and ordering in seconds
+
+    @property
+    def found(self):
+        return self.cost is not None
+
+
+class A_Star_Goals(A_Star_Portals):
+
+    def __init__(self, *args, goals:list=None, **kwargs) -> None:
+        """ Initialize A* with portals and multiple goals.
+                Arguments are the same as A_Star_Portals, the compiled engine is not used.
+
+        Args:
+            goals ([(int, int), ...], optional): Goal positions. Defaults to [end_pos].
+        """
+        super().__init__(*args, **kwargs)
+
+        self.goals = []                                         # All goal positions
+        self.targets = []                                       # Goals of the current search
+        self.target_grid = np.zeros((self.w, self.h), dtype=bool) # True where a cell is a goal of the current search
+        self.stop_at_first = True                               # If True, the search ends at the first target traversed, otherwise all of them
+        self.reached_targets = []                               # Targets traversed by the current search, in order
+
+        self.set_targets(goals if goals is not None else [self.end_pos] if self.end_pos is not None else [])
+        self.goals = list(self.targets)
+
+
+    @property
+    def finished(self):
+        # True once the first target (or every target) has been traversed.
+        if self.stop_at_first:
+            return len(self.reached_targets) > 0
+        return len(self.reached_targets) == len(self.targets)
+
+
+    def jit_supported(self):
+        """ The compiled engine stops at a single end position. """
+        return False
+
+
+    def set_targets(self, targets, stop_at_first:bool=True):
+        """ Set the goals of the next search, clearing the h_grid as it depends on them.
+
+        Args:
+            targets ([(int, int), ...]): Goal positions.
+            stop_at_first (bool, optional): If True, the search ends at the first target traversed. Defaults to True.
+        """
+        self.targets = [tuple(target) for target in targets]
+        self.stop_at_first = stop_at_first
+        self.target_grid.fill(False)
+        for target in self.targets:
+            self.target_grid[target] = True
+        self.h_grid.fill(self.max_value)
+
+
+    def reset_search(self, clear_h:bool=True):
+        """ As A_Star.reset_search(), also clearing the targets reached. """
+        super().reset_search(clear_h)
+        self.reached_targets = []
+
+
+    # # # # # # # # # # # # #
+    # Searching
+
+    def traverse_next(self):
+        """ As A_Star.traverse_next(), recording each target traversed. """
+        pos = super().traverse_next()
+        if self.target_grid[pos]:
+            self.reached_targets.append(pos)
+        return pos
+
+
+    def end_heuristic(self, pos):
+        """ Lowest heuristic distance from a cell to any target. """
+        return min(self.distance_heuristic(pos, target) for target in self.targets) if self.targets else 0
+
+
+    def end_heuristic_array(self, xs, ys):
+        """ Vectorized end_heuristic(), reduced with one numpy pass per target. """
+        distances = np.zeros(np.shape(xs), dtype=np.int64)
+        for i, target in enumerate(self.targets):
+            target_h = self.heuristic_array(xs, ys, target)
+            distances = target_h if i == 0 else np.minimum(distances, target_h)
+        return distances
+
+
+    def query_portal_heuristics(self, target_pos:(int, int)):
+        """ As A_Star_Portals.query_portal_heuristics(), the portal heuristics of targets are stored as for the end position. """
+        if self.h_mode not in ('store_none', 'naive') and self.target_grid[target_pos]:
+            return self.get_portal_heuristics(target_pos)
+        return super().query_portal_heuristics(target_pos)
+
+
+    def solve(self, start_pos:(int, int)=None, goals:list=None):
+        """ Find the shortest path to the nearest goal, with a single search.
+
+        Args:
+            start_pos (int, int, optional): Start position, defaults to the current start_pos.
+            goals ([(int, int), ...], optional): Goal positions, defaults to the current goals.
+
+        Returns:
+            Search_Result: Path to the nearest goal (also stored as end_pos), cost, expansions, heuristic count and wall time.
+        """
+        st = time()
+        if goals is not None:
+            self.goals = [tuple(goal) for goal in goals]
+        self.start_pos = self.start_pos if start_pos is None else start_pos
+
+        found = self.search_from(self.start_pos, self.goals, stop_at_first=True)
+        self.end_pos = self.reached_targets[0] if found else self.end_pos
+
+        return Search_Result(path=self.reconstruct_path(self.end_pos) if found else [],
+                             cost=int(self.g_grid[self.end_pos]) if found else None,
+                             expansions=self.step_count,
+                             heuristic_count=self.heuristic_count,
+                             time=time() - st,
+                             source=tuple(self.start_pos) if found else None)
+
+
+    def search_from(self, source, targets, stop_at_first:bool=True):
+        """ Run a fresh search from source towards the given targets.
+
+        Args:
+            source (int, int): Start of the search.
+            targets ([(int, int), ...]): Goal positions.
+            stop_at_first (bool, optional): If True, stop at the first target traversed, otherwise traverse all of them.
+
+        Returns:
+            bool: True if the search finished (reached the first, or every, target).
+        """
+        self.reset_search()
+        self.set_targets(targets, stop_at_first)
+        if not self.targets:
+            return False
+
+        self.search_cell(tuple(source))
+        return self.run()
+
+
+    # # # # # # # # # # # # #
+    # Visiting every goal
+
+    def solve_all(self, start_pos:(int, int)=None, goals:list=None):
+        """ Find a short route from the start visiting every goal, in any order.
+
+        Args:
+            start_pos (int, int, optional): Start position, defaults to the current start_pos.
+            goals ([(int, int), ...], optional): Goal positions, defaults to the current goals.
+
+        Returns:
+            Tour_Result: Visiting order, full path, total cost, unreachable goals, expansions, heuristic count and wall time.
+        """
+        st = time()
+        if goals is not None:
+            self.goals = [tuple(goal) for goal in goals]
+        self.start_pos = self.start_pos if start_pos is None else start_pos
+        start = tuple(self.start_pos)
+
+        # One search from the start and from each goal, recording the cost and path to every other goal
+        legs = {}
+        expansions, heuristic_count = 0, 0
+        goals = list(dict.fromkeys(self.goals))
+        for source in [start] + [goal for goal in goals if goal != start]:
+            self.search_from(source, [goal for goal in goals if goal != source], stop_at_first=False)
+            expansions += self.step_count
+            heuristic_count += self.heuristic_count
+            for target in self.reached_targets:
+                legs[(source, target)] = (int(self.g_grid[target]), self.reconstruct_path(target))
+
+        # Goals that cannot be reached from the start, or that cannot reach every other reachable goal, are left out.
+        reachable = [goal for goal in goals if goal == start or (start, goal) in legs]
+        reachable = [goal for goal in reachable if all(goal == other or ((goal, other) in legs and (other, goal) in legs)
+                                                       for other in reachable if other != start)]
+        unreachable = [goal for goal in goals if goal not in reachable]
+        visits = [goal for goal in reachable if goal != start]
+
+        if not reachable:
+            return Tour_Result([], [], None, unreachable, expansions, heuristic_count, time() - st)
+
+        order = self.order_visits(start, visits, {key: leg[0] for key, leg in legs.items()})
+
+        # Join the legs into a single path
+        path, cost = [start], 0
+        for source, target in zip([start] + order, order):
+            leg_cost, leg_path = legs[(source, target)]
+            path += leg_path[1:]
+            cost += leg_cost
+
+        order = ([start] if start in reachable else []) + order
+        self.end_pos = order[-1]
+        return Tour_Result(order, path, cost, unreachable, expansions, heuristic_count, time() - st)
+
+
+    def order_visits(self, start, goals, distances):
+        """ Order goals to minimize the total distance of visiting them all from the start (without returning).
+
+        Args:
+            start (int, int): Start position.
+            goals ([(int, int), ...]): Goals to visit.
+            distances (dict): {(source, target): distance} between the start and each goal, and between each pair of goals.
+
+        Returns:
+            [(int, int), ...]: Goals in the order visited.
+        """
+        if len(goals) <= 1:
+            return list(goals)
+        if len(goals) <= EXACT_ORDER_LIMIT:
+            return self.exact_order(start, goals, distances)
+
+        # Nearest neighbor
+        order, remaining = [], set(goals)
+        current = start
+        while remaining:
+            current = min(remaining, key=lambda goal: (distances[(current, goal)], goal))
+            order.append(current)
+            remaining.remove(current)
+
+        # 2-opt, reversing segments while the total distance improves (distances may be one-way, so the whole route is compared)
+        def route_cost(route):
+            return sum(distances[(a, b)] for a, b in zip([start] + route, route))
+
+        best_cost = route_cost(order)
+        improved = True
+        while improved:
+            improved = False
+            for i, j in itertools.combinations(range(len(order)), 2):
+                route = order[:i] + order[i:j+1][::-1] + order[j+1:]
+                cost = route_cost(route)
+                if cost < best_cost:
+                    order, best_cost, improved = route, cost, True
+
+        return order
+
+
+    def exact_order(self, start, goals, distances):
+        """ Shortest visiting order, by dynamic programming over subsets of goals (Held-Karp).
+
+        Args:
+            start (int, int): Start position.
+            goals ([(int, int), ...]): Goals to visit.
+            distances (dict): {(source, target): distance} between the start and each goal, and between each pair of goals.
+
+        Returns:
+            [(int, int), ...]: Goals in the order visited.
+        """
+        n = len(goals)
+
+        # best[(subset, last)] = (cost of visiting the subset of goals and ending at goal last, previous goal)
+        best = {(1 << i, i): (distances[(start, goals[i])], None) for i in range(n)}
+        for size in range(2, n + 1):
+            for subset_goals in itertools.combinations(range(n), size):
+                subset = sum(1 << i for i in subset_goals)
+                for last in subset_goals:
+                    prev_subset = subset & ~(1 << last)
+                    best[(subset, last)] = min((best[(prev_subset, prev)][0] + distances[(goals[prev], goals[last])], prev)
+                                               for prev in subset_goals if prev != last)
+
+        # Walk back from the cheapest complete route
+        subset = (1 << n) - 1
+        last = min(range(n), key=lambda i: best[(subset, i)][0])
+        order = []
+        while last is not None:
+            order.append(goals[last])
+            subset, last = subset & ~(1 << last), best[(subset, last)][1]
+
+        return order[::-1]
@@ -0,0 +1,263 @@
+# Nathaniel Alden Homans Youngren
+# September 13, 2023
+
+import numpy as np
+from time import time
+from a_star import Search_Result, NEIGHBOR_OFFSETS, NEIGHBOR_DISTANCES, octile_distance
+from a_star_jit import graph_search
+
+# NOTE: INSTRUCTIONS
+#
+# 1. Describe the graph in CSR form (compressed sparse rows, as used by scipy.sparse):
+#       > indptr (n + 1 int64): the edges leaving node i are edges indptr[i] to indptr[i+1] - 1.
+#       > indices (int32): the node each edge leads to.
+#       > weights (int32): the cost of each edge, at least 0.
+#    Or convert a grid simulation (A_Star or A_Star_Portals) with A_Star_Graph.from_grid(sim), portals becoming ordinary edges.
+# 2. Optionally give each node coordinates, and a heuristic computed from them (see HEURISTICS).
+#       The heuristic must never overestimate the remaining cost, in the same units as the weights.
+# 3. Call solve(start, end) or solve_sources(sources, end), which run in the compiled graph_search kernel (a_star_jit.py).
+#       Paths are lists of node indices.
+#
+# Memory is fixed when the graph is created, no array grows during a search:
+#   8 bytes per edge (indices, weights) and 45 bytes per node (indptr, coordinates, g, h, parent, state and the open heap).
+#   e.g. a road network of 10 million nodes and 25 million edges needs roughly 650 MB.
+#
+
+
+def zero_heuristic(coords, target):
+    """ No heuristic, the search becomes Dijkstra's algorithm. Coordinates are not needed, 0 is broadcast to every node. """
+    return 0
+
+def manhattan_heuristic(coords, target):
+    """ Manhattan distance, for graphs moving along axes with a cost of at least 1 per unit of distance. """
+    return np.abs(coords - coords[target]).sum(axis=1).astype(np.int64)
+
+def euclidean_heuristic(coords, target):
+    """ Straight line distance (rounded down), for graphs with a cost of at least 1 per unit of distance (e.g. navmeshes, roads). """
+    return np.floor(np.sqrt(((coords - coords[target]).astype(np.float64) ** 2).sum(axis=1))).astype(np.int64)
+
+def octile_heuristic(coords, target):
+    """ Octile distance (10 per orthogonal step, 14 per diagonal), as A_Star.distance_heuristic(), for grid graphs without portals. """
+    dx, dy = np.abs(coords - coords[target]).T.astype(np.int64)
+    return 10 * np.abs(dx - dy) + 14 * np.minimum(dx, dy)
+
+# Heuristics selected by name, any function taking (coords, target node) and returning an int64 distance per node may be used instead.
+#   The returned distances are copied into h_values, so a scalar is broadcast to every node.
+HEURISTICS = {'zero': zero_heuristic,
+              'manhattan': manhattan_heuristic,
+              'euclidean': euclidean_heuristic,
+              'octile': octile_heuristic}
+
+
+def grid_to_csr(sim):
+    """ Convert the terrain (and portals) of a grid simulation into CSR arrays.
+            Node x * h + y is cell (x, y), matching the flat indices of p_grid.
+            Edges have the same costs as the simulation's steps, including the portal-aware step distances of A_Star_Portals,
+            and each portal becomes an edge of cost 0 from its entrance to its exit (replacing the step to an adjacent exit).
+
+    Args:
+        sim (A_Star): Simulation holding the terrain (and portals).
+
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray): indptr, indices and weights.
+    """
+    w, h = sim.w, sim.h
+    cost_grid = sim.cost_grid
+    portals = getattr(sim, 'portals', {})
+    passable = cost_grid >= 0
+
+    # Cells whose steps are changed by portals, see A_Star_Portals.step_distances()
+    near_portal = np.zeros((w, h), dtype=bool)
+    for x, y in portals:
+        for nx, ny in ((x, y), (x-1, y), (x+1, y), (x, y-1), (x, y+1)):
+            if 0 <= nx < w and 0 <= ny < h:
+                near_portal[nx, ny] = True
+
+    # Steps in each direction between passable cells, vectorized over the whole grid
+    sources, targets, weights = [], [], []
+    xs, ys = np.nonzero(passable & ~near_portal)
+    for (dx, dy), distance in zip(NEIGHBOR_OFFSETS.tolist(), NEIGHBOR_DISTANCES.tolist()):
+        nx, ny = xs + dx, ys + dy
+        valid = (nx >= 0) & (nx < w) & (ny >= 0) & (ny < h)
+        sx, sy, nx, ny = xs[valid], ys[valid], nx[valid], ny[valid]
+        valid = passable[nx, ny]
+        sx, sy, nx, ny = sx[valid], sy[valid], nx[valid], ny[valid]
+        sources.append(sx * h + sy)
+        targets.append(nx * h + ny)
+        weights.append(distance * cost_grid[nx, ny].astype(np.int64))
+
+    # Cells near portals take their step distances from the simulation, and portal entrances gain their portal edge
+    for x, y in zip(*np.nonzero(passable & near_portal)):
+        pos = (int(x), int(y))
+        nxs, nys = pos[0] + NEIGHBOR_OFFSETS[:, 0], pos[1] + NEIGHBOR_OFFSETS[:, 1]
+        distances = sim.step_distances(pos, nxs, nys)
+        p_exit = portals.get(pos)
+        for nx, ny, distance in zip(nxs.tolist(), nys.tolist(), np.broadcast_to(distances, nxs.shape).tolist()):
+            if 0 <= nx < w and 0 <= ny < h and passable[nx, ny] and (nx, ny) != p_exit:
+                sources.append(np.array([pos[0] * h + pos[1]]))
+                targets.append(np.array([nx * h + ny]))
+                weights.append(np.array([distance * int(cost_grid[nx, ny])]))
+        if p_exit is not None and passable[p_exit]:
+            sources.append(np.array([pos[0] * h + pos[1]]))
+            targets.append(np.array([p_exit[0] * h + p_exit[1]]))
+            weights.append(np.array([0]))
+
+    return edges_to_csr(w * h, np.concatenate(sources), np.concatenate(targets), np.concatenate(weights))
+
+
+def edges_to_csr(n, sources, targets, weights):
+    """ Build CSR arrays from a list of edges.
+
+    Args:
+        n (int): Number of nodes.
+        sources, targets, weights (np.ndarray): Start node, end node and cost of each edge.
+
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray): indptr, indices and weights, edges of each node kept in their given order.
+    """
+    order = np.argsort(sources, kind='stable')
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+    return indptr, targets[order].astype(np.int32), weights[order].astype(np.int32)
+
+
+class A_Star_Graph():
+
+    def __init__(self, indptr, indices, weights, coords=None, heuristic='zero') -> None:
+        """ A* over an arbitrary graph, stored as CSR arrays.
+
+        Args:
+            indptr (np.ndarray): (n + 1) offsets into indices and weights.
+            indices (np.ndarray): Node each edge leads to.
+            weights (np.ndarray): Cost of each edge, at least 0.
+            coords (np.ndarray, optional): (n, d) coordinates of each node, used by the heuristic. Defaults to None.
+            heuristic (str or function, optional): Key of HEURISTICS, or a function of (coords, target node) returning
+                        the heuristic distance from every node to the target. Defaults to 'zero'.
+        """
+        self.indptr = np.ascontiguousarray(indptr, dtype=np.int64)
+        self.indices = np.ascontiguousarray(indices, dtype=np.int32)
+        self.weights = np.ascontiguousarray(weights, dtype=np.int32)
+        self.n = len(self.indptr) - 1       # Number of nodes
+        self.coords = coords
+        self.heuristic = HEURISTICS[heuristic] if isinstance(heuristic, str) else heuristic
+
+        # Node arrays, allocated once
+        self.max_value = np.iinfo(np.int64).max
+        self.h_values = np.zeros(self.n, dtype=np.int64)                  # Heuristic distance from each node to h_target
+        self.g = np.full(self.n, self.max_value, dtype=np.int64)          # Distance from the nearest source to each node
+        self.parent = np.full(self.n, -1, dtype=np.int32)                 # Parent of each node, -1 for sources and unsearched nodes
+        self.state = np.zeros(self.n, dtype=np.int8)                      # 0 = unsearched, 1 = searched, -1 = traversed
+        self.heap = np.zeros(self.n, dtype=np.int32)                      # Open heap of the search
+        self.heap_pos = np.zeros(self.n, dtype=np.int32)                  # Index of each open node in the heap
+        self.h_target = None                # Target of h_values, they are reused while it is unchanged
+
+        # Stats of the last search
+        self.step_count = 0                 # Number of nodes traversed
+        self.heuristic_count = 0            # Number of heuristic values calculated
+
+
+    @classmethod
+    def from_grid(cls, sim):
+        """ Build a graph from a grid simulation, searching it exactly as the simulation would (same expansion order and paths).
+                Node x * h + y is cell (x, y), with the same heuristic as the simulation (portal-aware for A_Star_Portals).
+
+        Args:
+            sim (A_Star): Simulation holding the terrain (and portals), which is copied.
+                        The heuristic keeps its own copy of the portal distance table, so later edits to sim do not affect the graph.
+
+        Returns:
+            A_Star_Graph: Graph with coordinates of each cell.
+        """
+        xs, ys = np.indices((sim.w, sim.h))
+        coords = np.stack((xs.ravel(), ys.ravel()), axis=1).astype(np.int32)
+
+        # Snapshot of the portals, as (n, 2) entrances, (n, 2) exits and (n, n) distances from exit i to entrance j
+        if getattr(sim, 'portals', None):
+            entries, exits, distances = (np.array(table) for table in sim.portal_distance_table())
+        else:
+            entries = exits = np.zeros((0, 2), dtype=np.int64)
+            distances = np.zeros((0, 0), dtype=np.int64)
+
+        def grid_heuristic(coords, target):
+            # As A_Star_Portals.heuristic_array(), with the portal heuristics of sort_portal_heuristics()
+            tx, ty = coords[target].tolist()
+            cxs, cys = coords[:, 0].astype(np.int64), coords[:, 1].astype(np.int64)
+            h_values = octile_distance(cxs - tx, cys - ty)
+            if len(entries):
+                portal_h = octile_distance(exits[:, 0] - tx, exits[:, 1] - ty)
+                portal_h = np.minimum(portal_h, (distances + portal_h[None, :]).min(axis=1))
+                for (ex, ey), entry_h in zip(entries.tolist(), portal_h.tolist()):
+                    h_values = np.minimum(h_values, octile_distance(cxs - ex, cys - ey) + entry_h)
+            return h_values.astype(np.int64)
+
+        return cls(*grid_to_csr(sim), coords=coords, heuristic=grid_heuristic)
+
+
+    def solve(self, start:int, end:int):
+        """ Find the shortest path from start to end.
+
+        Args:
+            start (int): Start node.
+            end (int): End node.
+
+        Returns:
+            Search_Result: Path of nodes, cost, expansions, heuristic count and wall time of the search.
+        """
+        return self.solve_sources({start: 0}, end)
+
+
+    def solve_sources(self, sources, end:int):
+        """ Find the shortest path to end from any of many sources, as A_Star.solve_sources().
+
+        Args:
+            sources ([int, ...] or {int: int}): Start nodes, or a dict of start nodes to initial g offsets.
+            end (int): End node.
+
+        Returns:
+            Search_Result: Path of nodes from the best source, cost, expansions, heuristic count, wall time and the source.
+        """
+        st = time()
+        if not isinstance(sources, dict):
+            sources = {node: 0 for node in sources}
+
+        # Heuristics are only recalculated for a new target
+        self.heuristic_count = 0
+        if end != self.h_target:
+            self.h_values[:] = self.heuristic(self.coords, end)
+            self.h_target = end
+            self.heuristic_count = self.n
+
+        self.g.fill(self.max_value)
+        self.parent.fill(-1)
+        self.state.fill(0)
+
+        source_nodes = np.array(list(sources.keys()), dtype=np.int64)
+        source_g = np.array(list(sources.values()), dtype=np.int64)
+        self.step_count = graph_search(self.indptr, self.indices, self.weights, self.h_values, self.g, self.parent, self.state,
+                                       self.heap, self.heap_pos, source_nodes, source_g, end)
+
+        found = self.state[end] == -1
+        path = self.reconstruct_path(end) if found else []
+        return Search_Result(path=path,
+                             cost=int(self.g[end]) if found else None,
+                             expansions=self.step_count,
+                             heuristic_count=self.heuristic_count,
+                             time=time() - st,
+                             source=path[0] if found else None)
+
+
+    def reconstruct_path(self, node:int):
+        """ Generates the list of parent nodes leading up to node.
+
+        Args:
+            node (int): Node index.
+
+        Returns:
+            [int, ...]: A list of node indices, from the source to node.
+        """
+        path = [int(node)]
+        parent = self.parent[node]
+        while parent != -1:
+            path.append(int(parent))
+            parent = self.parent[parent]
+        return path[::-1]
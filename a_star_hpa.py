@@ -0,0 +1,435 @@
+# Nathaniel Alden Homans Youngren
+# September 13, 2023
+
+import numpy as np
+from time import time
+from a_star import Search_Result, octile_distance
+from a_star_jit import cluster_dijkstra, trace_directions, graph_search
+
+# NOTE: INSTRUCTIONS
+#
+# 1. Set up a simulation (A_Star_Portals) with the desired terrain and portals.
+# 2. Build an HPA_Star from it, which splits the grid into square clusters and caches an abstract graph:
+#       > Transitions are placed along the border between each pair of adjacent clusters, where both sides are passable.
+#       > Transition cells and portal cells are the nodes of the graph, portals are free one-way edges between them.
+#       > The distance between each pair of nodes within a cluster is precomputed, confined to that cluster,
+#           along with the paths themselves (the direction each cell of the cluster was reached from, by the search from each node).
+#       > The nodes and edges are packed into CSR arrays, searched by the compiled graph_search() of a_star_jit.py.
+# 3. Call solve(start_pos, end_pos), which searches only the start and end clusters, then the abstract graph,
+#       and refines the abstract route by tracing the cached paths.
+# 4. After modifying cost_grid cells, call update_cells() with the modified cells, only the affected clusters are rebuilt.
+#       After modifying portals, call update_portals().
+#       The CSR arrays are reassembled from the clusters (in a few vectorized passes) before the next query,
+#       which takes about 0.5s on the map below.
+#
+# Paths are not guaranteed to be optimal, as they must cross cluster borders at transition cells (see HPA_Star).
+#
+# On a 2048x2048 map with 20% walls, costs 1-3 and 16 cell clusters, the build takes 15.6s,
+#   and 40 random queries took 55ms at the median (174ms at worst), mostly in graph_search() over 330k nodes and 7M edges.
+#   The cached paths take 1 byte per cell of a cluster for each of its nodes (about 80MB on that map).
+#
+
+
+class HPA_Star():
+
+    def __init__(self, sim, cluster_size:int=16) -> None:
+        """ Hierarchical pathfinding over the terrain and portals of a simulation.
+                Paths are optimal within each cluster, but must cross every border at a transition cell,
+                so they may detour to reach one (the middle or ends of each open run of the border).
+                On random maps (16 cell clusters), path costs measured about 1.1x the optimal cost on average,
+                and up to about 2x for short paths crossing a border far from its transitions.
+                Use A_Star_Portals where optimal paths are required.
+
+        Args:
+            sim (A_Star_Portals): Simulation holding the terrain (and portals).
+            cluster_size (int, optional): Width and height of each cluster in cells. Defaults to 16.
+        """
+        self.sim = sim
+        self.cluster_size = cluster_size
+        self.cw = -(-sim.w // cluster_size)     # Number of clusters horizontally
+        self.ch = -(-sim.h // cluster_size)     # Number of clusters vertically
+
+        self.borders = {}           # {(cluster_a, cluster_b): [(cell_a, cell_b), ...]} transitions between each pair of adjacent clusters
+        self.cluster_nodes = {}     # {cluster: [cell, ...]} abstract nodes within each cluster
+        self.intra_distances = {}   # {cluster: (k, k) array} distance from node i to node j of each cluster, max value if unreachable
+        self.intra_edges = {}       # {cluster: (i, j, distance)} arrays of the connected pairs of nodes of each cluster
+        self.cluster_cells = {}     # {cluster: (k, 2) array} cells of the nodes of each cluster
+        self.intra_dirs = {}        # {cluster: (k, w, h) int8 array} cached paths, the directions of the search from each node (see cluster_dijkstra())
+        self.portals = {}           # Portals at the time of the last update
+
+        # Abstract graph in CSR form, assembled by update_graph(), None while outdated
+        #   Node ids are assigned cluster by cluster, node_offsets[cluster] + index in cluster_nodes[cluster].
+        #   The last edge of each node is its end slot, a self-loop redirected to the end (node id n) during a query.
+        #   Node n (the end) has no edges.
+        self.graph = None
+        self.node_offsets = {}      # {cluster: id of its first node}
+        self.node_cells = None      # (n, 2) cell of each node
+
+        self.h_scale = 0            # Lowest cost of any passable cell, scales the octile heuristic
+        self.dirty = set()          # Clusters waiting to be rebuilt
+        self.rebuild_count = 0      # Number of times a cluster has been rebuilt
+
+        self.build()
+
+
+    # # # # # # # # # # # # #
+    # Abstraction
+
+    def build(self):
+        """ Build the whole abstraction from scratch. """
+        self.borders, self.cluster_nodes, self.intra_distances, self.intra_dirs = {}, {}, {}, {}
+        self.intra_edges, self.cluster_cells = {}, {}
+        self.portals = dict(getattr(self.sim, 'portals', {}))
+
+        cost = self.sim.cost_grid
+        passable = cost[cost >= 0]
+        self.h_scale = int(passable.min()) if passable.size else 0
+
+        for cluster in self.clusters():
+            for other in self.adjacent_clusters(cluster):
+                if cluster < other:
+                    self.update_border(cluster, other)
+
+        self.dirty = set(self.clusters())
+        self.flush()
+        self.update_graph()
+
+
+    def update_cells(self, cells):
+        """ Rebuild the clusters affected by changes to the cost of the given cells.
+                Clusters sharing a border with a changed cell are rebuilt only if that border's transitions change.
+
+        Args:
+            cells ([(int, int), ...]): Cells whose cost has been modified.
+        """
+        # Only the modified cells can lower the cheapest cost, so the whole grid is never rescanned.
+        costs = [int(self.sim.cost_grid[cell[0], cell[1]]) for cell in cells]
+        self.h_scale = min([cost for cost in costs if cost >= 0] + [self.h_scale])
+
+        changed = {self.cluster_of(cell) for cell in cells}
+        for cluster in changed:
+            for other in self.adjacent_clusters(cluster):
+                if self.update_border(min(cluster, other), max(cluster, other)):
+                    self.dirty.add(other)
+        self.dirty |= changed
+
+
+    def update_portals(self):
+        """ Rebuild the clusters containing added or removed portal entrances and exits. """
+        portals = dict(getattr(self.sim, 'portals', {}))
+        changed = set(self.portals.items()) ^ set(portals.items())
+        self.dirty |= {self.cluster_of(cell) for portal in changed for cell in portal}
+        self.portals = portals
+
+
+    def flush(self):
+        """ Rebuild the nodes and cached paths of all dirty clusters, the abstract graph is reassembled before the next query. """
+        for cluster in self.dirty:
+            self.update_cluster(cluster)
+        if self.dirty:
+            self.graph = None
+        self.dirty = set()
+
+
+    def update_border(self, cluster_a, cluster_b):
+        """ Place transitions along the border between two neighboring clusters.
+                Each run of facing cells that are passable on both sides gets a transition at its middle,
+                runs of 6 or more cells get a transition at each end instead.
+                Diagonal steps across the border are only added where no run connects either of their cells,
+                and diagonal clusters are connected through their touching corner cells.
+
+        Args:
+            cluster_a (int, int): Cluster with the lower coordinate.
+            cluster_b (int, int): Neighboring cluster with the higher coordinate.
+
+        Returns:
+            bool: True if the transitions changed.
+        """
+        (x0, y0, x1, y1) = self.bounds(cluster_a)
+        cost = self.sim.cost_grid
+        dx, dy = cluster_b[0] - cluster_a[0], cluster_b[1] - cluster_a[1]
+
+        # Pairs of facing cells along the border, with the costs of both sides read in a single slice each
+        if dx and dy:
+            pairs = [((x1-1, y1-1), (x1, y1))] if dy == 1 else [((x1-1, y0), (x1, y0-1))]
+            costs_a, costs_b = [int(cost[pairs[0][0]])], [int(cost[pairs[0][1]])]
+        elif dx:
+            pairs = [((x1-1, y), (x1, y)) for y in range(y0, y1)]
+            costs_a, costs_b = cost[x1-1, y0:y1].tolist(), cost[x1, y0:y1].tolist()
+        else:
+            pairs = [((x, y1-1), (x, y1)) for x in range(x0, x1)]
+            costs_a, costs_b = cost[x0:x1, y1-1].tolist(), cost[x0:x1, y1].tolist()
+
+        passable = [cost_a >= 0 and cost_b >= 0 for cost_a, cost_b in zip(costs_a, costs_b)]
+
+        # Split the border into runs of pairs where both cells are passable
+        transitions, run = [], []
+        for pair, open_pair in zip(pairs + [None], passable + [False]):
+            if open_pair:
+                run.append(pair)
+                continue
+            if run:
+                transitions += [run[0], run[-1]] if len(run) >= 6 else [run[len(run)//2]]
+                run = []
+
+        # Diagonal steps between two blocked pairs
+        for i in range(len(pairs) - 1):
+            if not passable[i] and not passable[i+1]:
+                if costs_a[i] >= 0 and costs_b[i+1] >= 0:
+                    transitions.append((pairs[i][0], pairs[i+1][1]))
+                if costs_a[i+1] >= 0 and costs_b[i] >= 0:
+                    transitions.append((pairs[i+1][0], pairs[i][1]))
+
+        old = self.borders.pop((cluster_a, cluster_b), [])
+        if transitions:
+            self.borders[(cluster_a, cluster_b)] = transitions
+        return transitions != old
+
+
+    def update_cluster(self, cluster):
+        """ Collect the nodes of a cluster, and cache the distances and paths between them.
+
+        Args:
+            cluster (int, int): Cluster coordinate.
+        """
+        self.rebuild_count += 1
+
+        nodes = set()
+        for other in self.adjacent_clusters(cluster):
+            key = (min(cluster, other), max(cluster, other))
+            side = 0 if cluster == key[0] else 1
+            nodes |= {pair[side] for pair in self.borders.get(key, [])}
+        nodes |= {cell for portal in self.portals.items() for cell in portal
+                  if self.cluster_of(cell) == cluster and self.sim.cost_grid[cell] >= 0}
+        self.cluster_nodes[cluster] = sorted(nodes)
+
+        # A single compiled call searches from every node of the cluster
+        x0, y0, x1, y1 = self.bounds(cluster)
+        xs = np.array([node[0] for node in self.cluster_nodes[cluster]], dtype=np.int64)
+        ys = np.array([node[1] for node in self.cluster_nodes[cluster]], dtype=np.int64)
+        dist = np.full((len(xs), x1-x0, y1-y0), np.iinfo(np.int64).max, dtype=np.int64)
+        dirs = np.full((len(xs), x1-x0, y1-y0), -1, dtype=np.int8)
+        cluster_dijkstra(self.sim.cost_grid, x0, y0, xs, ys, xs, ys, dist, dirs)
+
+        distances = dist[:, xs-x0, ys-y0]
+        connected = distances != np.iinfo(np.int64).max
+        np.fill_diagonal(connected, False)
+        i, j = np.nonzero(connected)
+
+        self.intra_distances[cluster] = distances
+        self.intra_dirs[cluster] = dirs
+        self.intra_edges[cluster] = (i, j, distances[i, j])
+        self.cluster_cells[cluster] = np.stack((xs, ys), axis=1)
+
+
+    def update_graph(self):
+        """ Assemble the CSR arrays of the abstract graph from the clusters, borders and portals. """
+        clusters = self.clusters()
+        counts = np.array([len(self.cluster_nodes[cluster]) for cluster in clusters], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        n = int(offsets[-1])
+        self.node_offsets = dict(zip(clusters, offsets[:-1].tolist()))
+        self.node_cells = np.concatenate([self.cluster_cells[cluster] for cluster in clusters])
+
+        node_grid = np.full((self.sim.w, self.sim.h), -1, dtype=np.int64)
+        node_grid[self.node_cells[:, 0], self.node_cells[:, 1]] = np.arange(n)
+        max_value = np.iinfo(np.int64).max
+
+        # Intra-cluster edges between every pair of connected nodes
+        sources, targets, weights = [], [], []
+        for cluster, offset in self.node_offsets.items():
+            i, j, distances = self.intra_edges[cluster]
+            sources.append(offset + i)
+            targets.append(offset + j)
+            weights.append(distances)
+
+        # Steps across borders, in both directions
+        pairs = np.array([pair for transitions in self.borders.values() for pair in transitions], dtype=np.int64).reshape(-1, 2, 2)
+        cells_a, cells_b = pairs[:, 0], pairs[:, 1]
+        distance = np.where((cells_a[:, 0] != cells_b[:, 0]) & (cells_a[:, 1] != cells_b[:, 1]), 14, 10)
+        ids_a, ids_b = node_grid[cells_a[:, 0], cells_a[:, 1]], node_grid[cells_b[:, 0], cells_b[:, 1]]
+        cost = self.sim.cost_grid
+        sources += [ids_a, ids_b]
+        targets += [ids_b, ids_a]
+        weights += [distance * cost[cells_b[:, 0], cells_b[:, 1]], distance * cost[cells_a[:, 0], cells_a[:, 1]]]
+
+        # Free portal edges, between passable entrances and exits
+        portal_ids = [(node_grid[entry], node_grid[p_exit]) for entry, p_exit in self.portals.items()]
+        portal_ids = np.array([ids for ids in portal_ids if ids[0] >= 0 and ids[1] >= 0], dtype=np.int64).reshape(-1, 2)
+        sources.append(portal_ids[:, 0])
+        targets.append(portal_ids[:, 1])
+        weights.append(np.zeros(len(portal_ids), dtype=np.int64))
+
+        # End slots, added last so the stable sort keeps them after every other edge of their node
+        #   The intra-cluster edges are already in order, which the merge sort (timsort) takes advantage of.
+        sources, targets = np.concatenate(sources + [np.arange(n)]), np.concatenate(targets + [np.arange(n)])
+        weights = np.concatenate(weights + [np.zeros(n, dtype=np.int64)])
+        order = np.argsort(sources, kind='stable')
+
+        indptr = np.zeros(n + 2, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:n+1])
+        indptr[n+1] = indptr[n]
+        weight_dtype = np.int32 if weights.max(initial=0) <= np.iinfo(np.int32).max else np.int64
+
+        self.graph = {'indptr': indptr,
+                      'indices': targets[order].astype(np.int32),
+                      'weights': weights[order].astype(weight_dtype),
+                      'end_slots': indptr[1:n+1] - 1,
+                      # Search arrays, allocated once, including the end node
+                      'h_values': np.zeros(n + 1, dtype=np.int64),
+                      'g': np.full(n + 1, max_value, dtype=np.int64),
+                      'parent': np.full(n + 1, -1, dtype=np.int32),
+                      'state': np.zeros(n + 1, dtype=np.int8),
+                      'heap': np.zeros(n + 1, dtype=np.int32),
+                      'heap_pos': np.zeros(n + 1, dtype=np.int32)}
+
+
+    def cluster_search(self, source, targets, reverse:bool=False):
+        """ Run a Dijkstra search from a cell, confined to its cluster, until all the targets are settled.
+
+        Args:
+            source (int, int): Source cell.
+            targets ([(int, int), ...]): Cells of the same cluster.
+            reverse (bool, optional): If True, search the distances to the source instead. Defaults to False.
+
+        Returns:
+            (np.ndarray, np.ndarray): Distance and direction (see cluster_dijkstra()) of each cell of the cluster, final for the targets.
+        """
+        x0, y0, x1, y1 = self.bounds(self.cluster_of(source))
+        dist = np.full((1, x1-x0, y1-y0), np.iinfo(np.int64).max, dtype=np.int64)
+        dirs = np.full((1, x1-x0, y1-y0), -1, dtype=np.int8)
+        targets_x = np.array([target[0] for target in targets], dtype=np.int64)
+        targets_y = np.array([target[1] for target in targets], dtype=np.int64)
+        cluster_dijkstra(self.sim.cost_grid, x0, y0, np.array([source[0]]), np.array([source[1]]), targets_x, targets_y, dist, dirs, reverse)
+        return dist[0], dirs[0]
+
+
+    # # # # # # # # # # # # #
+    # Queries
+
+    def solve(self, start_pos, end_pos):
+        """ Find a path by searching the abstract graph, then refining the abstract route with the cached paths.
+                Only the start and end clusters are searched, to connect the start and end to the nodes of their clusters:
+                > The nodes of the start cluster seed the abstract search, with their distance from the start.
+                > The end slot of each node of the end cluster leads to the end, with its distance to the end.
+
+        Args:
+            start_pos (int, int): Start position.
+            end_pos (int, int): End position.
+
+        Returns:
+            Search_Result: Path, cost, abstract nodes expanded, heuristic count and wall time.
+        """
+        st = time()
+        self.flush()
+        if self.graph is None:
+            self.update_graph()
+        start_pos, end_pos = tuple(start_pos), tuple(end_pos)
+        cost = self.sim.cost_grid
+
+        if cost[start_pos] < 0 or cost[end_pos] < 0:
+            return Search_Result([], None, 0, 0, time() - st)
+
+        graph = self.graph
+        n = len(self.node_cells)
+        max_value = np.iinfo(np.int64).max
+        start_cluster, end_cluster = self.cluster_of(start_pos), self.cluster_of(end_pos)
+        start_dist, start_dirs = self.cluster_search(start_pos, self.cluster_nodes[start_cluster] + ([end_pos] if start_cluster == end_cluster else []))
+        end_dist, end_dirs = self.cluster_search(end_pos, self.cluster_nodes[end_cluster], reverse=True)
+        (sx0, sy0), (ex0, ey0) = self.bounds(start_cluster)[:2], self.bounds(end_cluster)[:2]
+
+        # Seed the nodes of the start cluster (and the end itself, if it shares the cluster)
+        start_offset, end_offset = self.node_offsets[start_cluster], self.node_offsets[end_cluster]
+        start_cells = self.node_cells[start_offset:start_offset + len(self.cluster_nodes[start_cluster])]
+        source_g = start_dist[start_cells[:, 0] - sx0, start_cells[:, 1] - sy0]
+        sources = start_offset + np.nonzero(source_g != max_value)[0]
+        source_g = source_g[source_g != max_value]
+        if start_cluster == end_cluster and start_dist[end_pos[0] - sx0, end_pos[1] - sy0] != max_value:
+            sources = np.append(sources, n)
+            source_g = np.append(source_g, start_dist[end_pos[0] - sx0, end_pos[1] - sy0])
+
+        # Point the end slots of the nodes of the end cluster to the end
+        end_cells = self.node_cells[end_offset:end_offset + len(self.cluster_nodes[end_cluster])]
+        end_g = end_dist[end_cells[:, 0] - ex0, end_cells[:, 1] - ey0]
+        end_nodes = end_offset + np.nonzero(end_g != max_value)[0]
+        slots = graph['end_slots'][end_nodes]
+        graph['indices'][slots] = n
+        graph['weights'][slots] = end_g[end_g != max_value]
+
+        # The heuristic is the octile distance scaled by the lowest cell cost, unless portals allow shortcuts.
+        h_values = graph['h_values']
+        if self.portals:
+            h_values.fill(0)
+        else:
+            h_values[:n] = self.h_scale * octile_distance(self.node_cells[:, 0] - end_pos[0], self.node_cells[:, 1] - end_pos[1])
+
+        g, parent, state = graph['g'], graph['parent'], graph['state']
+        g.fill(max_value)
+        parent.fill(-1)
+        state.fill(0)
+        try:
+            expansions = graph_search(graph['indptr'], graph['indices'], graph['weights'], h_values, g, parent, state,
+                                      graph['heap'], graph['heap_pos'], sources.astype(np.int64), source_g.astype(np.int64), n)
+        finally:
+            # Restore the end slots to self-loops, which are never followed
+            graph['indices'][slots] = end_nodes
+            graph['weights'][slots] = 0
+
+        if state[n] != -1:
+            return Search_Result([], None, expansions, n, time() - st)
+
+        # Walk back through the abstract route
+        route = [n]
+        while parent[route[-1]] != -1:
+            route.append(int(parent[route[-1]]))
+        route = route[::-1]
+
+        # Refine each edge of the route into cells, by tracing the cached paths (and those of the start and end searches)
+        first = self.node_cells[route[0]] if route[0] != n else np.array(end_pos)
+        pieces = [np.array([start_pos]), trace_directions(start_dirs, first[0] - sx0, first[1] - sy0)[::-1] + (sx0, sy0)]
+        for node, next_node in zip(route, route[1:]):
+            cell = tuple(self.node_cells[node].tolist())
+
+            if next_node == n:
+                # Along the reverse search from the end, excluding the node itself
+                if cell != end_pos:
+                    pieces += [trace_directions(end_dirs, cell[0] - ex0, cell[1] - ey0)[1:] + (ex0, ey0), np.array([end_pos])]
+                continue
+
+            next_cell = tuple(self.node_cells[next_node].tolist())
+            cluster = self.cluster_of(cell)
+            if (self.portals.get(cell) == next_cell and g[next_node] == g[node]) or self.cluster_of(next_cell) != cluster:
+                pieces.append(np.array([next_cell])) # Portal or step across a border
+            else:
+                x0, y0 = self.bounds(cluster)[:2]
+                dirs = self.intra_dirs[cluster][node - self.node_offsets[cluster]]
+                pieces.append(trace_directions(dirs, next_cell[0] - x0, next_cell[1] - y0)[::-1] + (x0, y0))
+
+        path = np.concatenate([piece.reshape(-1, 2) for piece in pieces])
+        return Search_Result(list(zip(path[:, 0].tolist(), path[:, 1].tolist())), int(g[n]), expansions, n, time() - st)
+
+
+    # # # # # # # # # # # # #
+    # Cluster helpers
+
+    def clusters(self):
+        """ All cluster coordinates. """
+        return [(cx, cy) for cx in range(self.cw) for cy in range(self.ch)]
+
+
+    def cluster_of(self, cell):
+        """ Coordinate of the cluster containing a cell. """
+        return (int(cell[0]) // self.cluster_size, int(cell[1]) // self.cluster_size)
+
+
+    def adjacent_clusters(self, cluster):
+        """ Clusters sharing a border or a corner with the given cluster. """
+        cx, cy = cluster
+        return [(cx+dx, cy+dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                if (dx or dy) and 0 <= cx+dx < self.cw and 0 <= cy+dy < self.ch]
+
+
+    def bounds(self, cluster):
+        """ Cell bounds of a cluster, as (x0, y0, x1, y1) with exclusive upper bounds. """
+        x0, y0 = cluster[0] * self.cluster_size, cluster[1] * self.cluster_size
+        return x0, y0, min(x0 + self.cluster_size, self.sim.w), min(y0 + self.cluster_size, self.sim.h)
@@ -0,0 +1,516 @@
+# Nathaniel Alden Homans Youngren
+# September 13, 2023
+
+import heapq
+import numpy as np
+
+# NOTE: Compiled search engine for A_Star and A_Star_Portals, along with other whole-grid kernels (e.g. flow fields)
+#   and the graph search core of A_Star_Graph (a_star_graph.py).
+#
+# The kernels below run the entire search loop (open list, neighbor expansion, portal edges)
+#   over the same numpy grids used by the python implementation, updating them in place.
+# Selection order, step distances and portal heuristics exactly mirror the python implementation,
+#   so paths, path_length and step_count are identical.
+#   heuristic_count is the number of distances the compiled engine actually calculates. With portals, it differs from the python engine,
+#   which reuses stored portal heuristics and visits portals through the bucket index, where the compiled engine skips portals that cannot win.
+#
+# To benchmark the compiled engine against the python implementation, run python benchmark.py jit.
+#
+# Numba is optional, if it is not installed JIT_AVAILABLE is False and A_Star.run() steps in python instead.
+#   Other kernels still run without numba, uncompiled.
+#
+
+try:
+    from numba import njit
+    JIT_AVAILABLE = True
+
+except ImportError:
+    JIT_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        # Stand-in decorator, leaves functions uncompiled so this module can still be imported.
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+# (dx, dy) offsets of the 8 direct neighbors of a cell, in the same order as a_star.NEIGHBOR_OFFSETS, and their step distances.
+OFFSETS_X = np.array([-1, -1, -1, 0, 0, 1, 1, 1], dtype=np.int64)
+OFFSETS_Y = np.array([-1, 0, 1, -1, 1, -1, 0, 1], dtype=np.int64)
+OFFSETS_D = np.array([14, 10, 14, 10, 10, 14, 10, 14], dtype=np.int64)
+
+
+@njit(cache=True)
+def octile(x1, y1, x2, y2):
+    """ Octile distance between 2 cells, as in A_Star.distance_heuristic(). """
+    dx, dy = abs(x1 - x2), abs(y1 - y2)
+    return 10 * abs(dx - dy) + 14 * min(dx, dy)
+
+
+@njit(cache=True)
+def sort_portal_heuristics(exits, portal_distances, tx, ty):
+    """ Compiled version of A_Star_Portals.sort_portal_heuristics().
+
+    Args:
+        exits (np.ndarray): (n, 2) array of portal exits, in portals dict order.
+        portal_distances (np.ndarray): (n, n) distances from each exit to each entrance, from A_Star_Portals.portal_distance_table().
+        tx, ty (int): Target cell coordinate.
+
+    Returns:
+        np.ndarray: Heuristic distance from each portal entrance to the target, accounting for shortcuts.
+    """
+    n = len(exits)
+    direct = np.empty(n, dtype=np.int64)
+    for i in range(n):
+        direct[i] = octile(exits[i, 0], exits[i, 1], tx, ty)
+
+    heuristics = direct.copy()
+    for i in range(n):
+        for j in range(n):
+            heuristics[i] = min(heuristics[i], portal_distances[i, j] + direct[j])
+
+    return heuristics
+
+
+@njit(cache=True)
+def portal_distance(x1, y1, x2, y2, entries, exits, portal_distances):
+    """ Compiled version of A_Star_Portals.distance_heuristic(), for the non-naive heuristic modes.
+            Portals whose portal-to-target distance alone cannot beat the shortest distance found are skipped.
+
+    Returns:
+        (int, int): Heuristic distance, and the number of octile distances calculated.
+    """
+    p_heuristics = sort_portal_heuristics(exits, portal_distances, x2, y2)
+    count = len(exits) + 1
+    distance = octile(x1, y1, x2, y2)
+    for i in range(len(entries)):
+        if p_heuristics[i] >= distance:
+            continue
+        distance = min(distance, octile(x1, y1, entries[i, 0], entries[i, 1]) + p_heuristics[i])
+        count += 1
+    return distance, count
+
+
+@njit(cache=True)
+def search(cost_grid, h_grid, g_grid, p_grid, state_grid, entry_grid, entries, exits, portal_distances,
+           end_x, end_y, heap_f, heap_h, heap_i, open_count, closed_count):
+    """ Traverse cells until end_pos is traversed or no searched cells remain.
+            All grids are updated in place, exactly as repeated calls to A_Star.step() would.
+            h_grid must be fully precomputed.
+
+    Args:
+        cost_grid, h_grid, g_grid, p_grid, state_grid (np.ndarray): Cell grids of the simulation.
+        entry_grid (np.ndarray): Index of the portal entered at each cell, -1 where there is none.
+        entries, exits (np.ndarray): (n, 2) arrays of portal entrances and exits.
+        portal_distances (np.ndarray): (n, n) distances from each exit to each entrance, through any other portals.
+        end_x, end_y (int): End position.
+        heap_f, heap_h, heap_i (np.ndarray): Current open_heap entries, as f, h and flat cell index.
+        open_count, closed_count (int): Current open and closed cell counts.
+
+    Returns:
+        tuple: step count, highest g traversed, last flat index traversed, open count, closed count,
+                heuristic count, and the remaining open_heap entries as (f, h, flat index) arrays.
+    """
+    w, h = cost_grid.shape
+    n_portals = len(entries)
+
+    heap = [(np.int64(0), np.int64(0), np.int64(0))]
+    heap.pop()
+    for k in range(len(heap_f)):
+        heap.append((np.int64(heap_f[k]), np.int64(heap_h[k]), np.int64(heap_i[k])))
+    heapq.heapify(heap)
+
+    steps = 0
+    max_g = 0
+    last_i = -1
+    heuristic_count = 0
+
+    while open_count > 0 and state_grid[end_x, end_y] != -1:
+
+        # Select next cell, skipping outdated entries
+        _, _, i = heapq.heappop(heap)
+        x, y = i // h, i % h
+        if state_grid[x, y] != 1:
+            continue
+
+        g_prev = np.int64(g_grid[x, y])
+
+        # A portal can only shorten a step if its entrance is on or orthogonally adjacent to this cell
+        near_portal = False
+        if n_portals > 0:
+            for nx, ny in ((x, y), (x-1, y), (x+1, y), (x, y-1), (x, y+1)):
+                if 0 <= nx < w and 0 <= ny < h and entry_grid[nx, ny] != -1:
+                    near_portal = True
+
+        portal = entry_grid[x, y] if n_portals > 0 else -1
+
+        for k in range(9):
+            if k < 8:
+                nx, ny = x + OFFSETS_X[k], y + OFFSETS_Y[k]
+
+                # An exit adjacent to the portal replaces that neighbor
+                if portal != -1 and nx == exits[portal, 0] and ny == exits[portal, 1]:
+                    continue
+            elif portal != -1:
+                nx, ny = exits[portal, 0], exits[portal, 1]
+            else:
+                break
+
+            if nx < 0 or nx >= w or ny < 0 or ny >= h:
+                continue
+            if cost_grid[nx, ny] < 0 or state_grid[nx, ny] == -1:
+                continue
+
+            if k == 8:
+                distance = 0
+            elif near_portal:
+                distance, count = portal_distance(x, y, nx, ny, entries, exits, portal_distances)
+                heuristic_count += count
+            else:
+                distance = octile(x, y, nx, ny)
+
+            g = g_prev + distance * np.int64(cost_grid[nx, ny])
+            if g < g_grid[nx, ny]:
+                g_grid[nx, ny] = g
+                p_grid[nx, ny] = i
+                h_val = np.int64(h_grid[nx, ny])
+                heapq.heappush(heap, (g + h_val, h_val, np.int64(nx * h + ny)))
+
+            if state_grid[nx, ny] == 0:
+                open_count += 1
+            state_grid[nx, ny] = 1
+
+        # Mark cell as traversed
+        state_grid[x, y] = -1
+        open_count -= 1
+        closed_count += 1
+
+        steps += 1
+        max_g = max(max_g, g_prev)
+        last_i = i
+
+    # Return the remaining open set, so stepping may continue in python
+    remaining = len(heap)
+    out_f = np.empty(remaining, dtype=np.int64)
+    out_h = np.empty(remaining, dtype=np.int64)
+    out_i = np.empty(remaining, dtype=np.int64)
+    for k in range(remaining):
+        out_f[k], out_h[k], out_i[k] = heap[k]
+
+    return steps, max_g, last_i, open_count, closed_count, heuristic_count, out_f, out_h, out_i
+
+
+@njit(cache=True)
+def flow_field(cost_grid, dist_grid, dir_grid, entries, exits, end_x, end_y):
+    """ Reverse Dijkstra from the end position over the whole grid, filling dist_grid and dir_grid in place.
+            A step from a cell into a neighbor costs its step distance (10 or 14) multiplied by the cost of the neighbor.
+            Portals are one-way and free, so they are followed backwards from exit to entrance.
+
+    Args:
+        cost_grid (np.ndarray): Cost to travel through each cell, negative cells are impassable.
+        dist_grid (np.ndarray): Filled with the distance from each cell to the end, must start at its max value.
+        dir_grid (np.ndarray): Filled with the index of the neighbor offset to step to (0-7), 8 to take the portal, -1 for none.
+        entries, exits (np.ndarray): (n, 2) arrays of portal entrances and exits.
+        end_x, end_y (int): End position.
+
+    Returns:
+        int: Number of cells settled.
+    """
+    w, h = cost_grid.shape
+
+    is_exit = np.zeros((w, h), dtype=np.bool_)
+    for p in range(len(exits)):
+        is_exit[exits[p, 0], exits[p, 1]] = True
+
+    dist_grid[end_x, end_y] = 0
+    heap = [(np.int64(0), np.int64(end_x * h + end_y))]
+    settled = 0
+
+    while heap:
+        d, i = heapq.heappop(heap)
+        x, y = i // h, i % h
+        if d > dist_grid[x, y]:
+            continue
+        settled += 1
+
+        # Relax each neighbor that could step into this cell
+        step_cost = np.int64(cost_grid[x, y])
+        for k in range(8):
+            px, py = x - OFFSETS_X[k], y - OFFSETS_Y[k]
+            if px < 0 or px >= w or py < 0 or py >= h or cost_grid[px, py] < 0:
+                continue
+
+            nd = d + OFFSETS_D[k] * step_cost
+            if nd < dist_grid[px, py]:
+                dist_grid[px, py] = nd
+                dir_grid[px, py] = k
+                heapq.heappush(heap, (nd, np.int64(px * h + py)))
+
+        # Relax each portal entrance leading to this cell
+        if is_exit[x, y]:
+            for p in range(len(exits)):
+                if exits[p, 0] == x and exits[p, 1] == y:
+                    px, py = entries[p, 0], entries[p, 1]
+                    if cost_grid[px, py] >= 0 and d < dist_grid[px, py]:
+                        dist_grid[px, py] = d
+                        dir_grid[px, py] = 8
+                        heapq.heappush(heap, (d, np.int64(px * h + py)))
+
+    return settled
+
+
+@njit(cache=True)
+def heap_push(heap, size, key):
+    """ Add a key to a binary min heap holding size keys. """
+    k = size
+    while k > 0:
+        parent_k = (k - 1) >> 1
+        if heap[parent_k] <= key:
+            break
+        heap[k] = heap[parent_k]
+        k = parent_k
+    heap[k] = key
+
+
+@njit(cache=True)
+def heap_pop(heap, size):
+    """ Remove the lowest key of a binary min heap, size being the number of keys left afterwards. """
+    key = heap[size]
+    k = 0
+    while True:
+        child_k = 2 * k + 1
+        if child_k >= size:
+            break
+        if child_k + 1 < size and heap[child_k + 1] < heap[child_k]:
+            child_k += 1
+        if key <= heap[child_k]:
+            break
+        heap[k] = heap[child_k]
+        k = child_k
+    heap[k] = key
+
+
+@njit(cache=True)
+def cluster_dijkstra(cost_grid, x0, y0, sources_x, sources_y, targets_x, targets_y, dist, dirs, reverse=False):
+    """ Dijkstra from each of several cells in turn, confined to the rectangle of cells starting at (x0, y0) with the shape of dist[0].
+            Steps cost 10 or 14 multiplied by the cost of the cell entered, portals are not followed.
+            Each search stops once all the targets are settled, only the distances and directions of the targets
+            (and of the cells along their paths) are final.
+
+    Args:
+        cost_grid (np.ndarray): Cost to travel through each cell, negative cells are impassable.
+        x0, y0 (int): Lowest corner of the rectangle.
+        sources_x, sources_y (np.ndarray): Source cells, in grid coordinates.
+        targets_x, targets_y (np.ndarray): Target cells, in grid coordinates.
+        dist (np.ndarray): (sources, w, h) filled with the distance from each source to each cell of the rectangle, must start at its max value.
+        dirs (np.ndarray): (sources, w, h) int8, filled with the index of the neighbor offset by which each cell was reached,
+                        so its parent is the cell minus that offset, -1 for the source and unreached cells. Must start at -1.
+        reverse (bool, optional): If True, dist is the distance from each cell to the source instead,
+                        and stepping back along dirs leads towards the source. Defaults to False.
+
+    Returns:
+        int: Number of cells settled.
+    """
+    _, w, h = dist.shape
+    settled = 0
+
+    # Binary heap of keys packing the distance, x and y of a cell into bit fields, in an array with room for every push
+    bits = 1
+    while (1 << bits) < max(w, h):
+        bits += 1
+    mask = (1 << bits) - 1
+    heap = np.empty(8 * w * h + 1, dtype=np.int64)
+
+    is_target = np.zeros((w, h), dtype=np.bool_)
+    target_count = 0
+    for t in range(len(targets_x)):
+        if not is_target[targets_x[t] - x0, targets_y[t] - y0]:
+            is_target[targets_x[t] - x0, targets_y[t] - y0] = True
+            target_count += 1
+
+    for s in range(len(sources_x)):
+        lx, ly = sources_x[s] - x0, sources_y[s] - y0
+        dist[s, lx, ly] = 0
+        heap[0] = (lx << bits) | ly
+        size = 1
+        remaining = target_count
+
+        while size > 0 and remaining > 0:
+            key = heap[0]
+            size -= 1
+            heap_pop(heap, size)
+            d, x, y = key >> (2 * bits), (key >> bits) & mask, key & mask
+            if d > dist[s, x, y]:
+                continue
+            settled += 1
+            if is_target[x, y]:
+                remaining -= 1
+
+            for k in range(8):
+                nx, ny = x + OFFSETS_X[k], y + OFFSETS_Y[k]
+                if nx < 0 or nx >= w or ny < 0 or ny >= h:
+                    continue
+                cost = cost_grid[x0 + nx, y0 + ny]
+                if cost < 0:
+                    continue
+
+                # Stepping backwards from (x, y) to (nx, ny) is a step forwards into (x, y)
+                if reverse:
+                    cost = cost_grid[x0 + x, y0 + y]
+
+                nd = d + OFFSETS_D[k] * np.int64(cost)
+                if nd < dist[s, nx, ny]:
+                    dist[s, nx, ny] = nd
+                    dirs[s, nx, ny] = k
+                    heap_push(heap, size, (nd << (2 * bits)) | (nx << bits) | ny)
+                    size += 1
+
+    return settled
+
+
+@njit(cache=True)
+def trace_directions(dirs, x, y):
+    """ Follow the directions of cluster_dijkstra() back from a cell, towards the source of a forward search
+            (or, for a reverse search, towards the target).
+
+    Args:
+        dirs (np.ndarray): (w, h) directions of a single source.
+        x, y (int): Local cell to start from.
+
+    Returns:
+        np.ndarray: (n, 2) local cells, starting with (x, y) and ending before the source.
+    """
+    n = 0
+    cx, cy = x, y
+    while dirs[cx, cy] != -1:
+        k = dirs[cx, cy]
+        cx, cy = cx - OFFSETS_X[k], cy - OFFSETS_Y[k]
+        n += 1
+
+    cells = np.empty((n, 2), dtype=np.int64)
+    cx, cy = x, y
+    for m in range(n):
+        cells[m, 0], cells[m, 1] = cx, cy
+        k = dirs[cx, cy]
+        cx, cy = cx - OFFSETS_X[k], cy - OFFSETS_Y[k]
+    return cells
+
+
+@njit(cache=True)
+def node_before(a, b, g, h_values):
+    """ True if node a is expanded before node b, ordered by (f, h, node) as in A_Star.select_next_pos(). """
+    fa, fb = g[a] + h_values[a], g[b] + h_values[b]
+    if fa != fb:
+        return fa < fb
+    if h_values[a] != h_values[b]:
+        return h_values[a] < h_values[b]
+    return a < b
+
+
+@njit(cache=True)
+def sift_up(heap, heap_pos, k, g, h_values):
+    """ Move the node at heap index k up until its parent is expanded before it. """
+    node = heap[k]
+    while k > 0:
+        parent_k = (k - 1) >> 1
+        parent = heap[parent_k]
+        if not node_before(node, parent, g, h_values):
+            break
+        heap[k] = parent
+        heap_pos[parent] = k
+        k = parent_k
+    heap[k] = node
+    heap_pos[node] = k
+
+
+@njit(cache=True)
+def sift_down(heap, heap_pos, size, k, g, h_values):
+    """ Move the node at heap index k down until both children are expanded after it. """
+    node = heap[k]
+    while True:
+        child_k = 2 * k + 1
+        if child_k >= size:
+            break
+        if child_k + 1 < size and node_before(heap[child_k + 1], heap[child_k], g, h_values):
+            child_k += 1
+        child = heap[child_k]
+        if not node_before(child, node, g, h_values):
+            break
+        heap[k] = child
+        heap_pos[child] = k
+        k = child_k
+    heap[k] = node
+    heap_pos[node] = k
+
+
+@njit(cache=True)
+def graph_search(indptr, indices, weights, h_values, g, parent, state, heap, heap_pos, sources, source_g, target):
+    """ A* over a graph in CSR form (the edges leaving node i are indices/weights[indptr[i]:indptr[i+1]]).
+            Open nodes are held in an indexed binary heap, whose entries are updated in place when g improves,
+            so no array grows beyond the number of nodes.
+            Nodes are expanded in (f, h, node) order, as in A_Star.select_next_pos(),
+            so a grid converted with a_star_graph.grid_to_csr() is searched in the same order as by A_Star.
+
+    Args:
+        indptr (np.ndarray): (n + 1) offsets into indices and weights.
+        indices (np.ndarray): Target node of each edge.
+        weights (np.ndarray): Cost of each edge, at least 0.
+        h_values (np.ndarray): Heuristic distance from each node to the target, fully precomputed.
+        g (np.ndarray): Filled with the distance from the nearest source to each node, must start at its max value.
+        parent (np.ndarray): Filled with the parent of each node, must start at -1.
+        state (np.ndarray): Filled with 0 = unsearched, 1 = searched, -1 = traversed, must start at 0.
+        heap, heap_pos (np.ndarray): Scratch arrays of n nodes, the open heap and the heap index of each node.
+        sources (np.ndarray): Source nodes.
+        source_g (np.ndarray): Initial g of each source.
+        target (int): Target node, the search stops once it is traversed.
+
+    Returns:
+        int: Number of nodes traversed.
+    """
+    size = 0
+    for k in range(len(sources)):
+        node = sources[k]
+        if source_g[k] >= g[node]:
+            continue
+        g[node] = source_g[k]
+        parent[node] = -1
+        if state[node] == 0:
+            state[node] = 1
+            heap[size] = node
+            size += 1
+            sift_up(heap, heap_pos, size - 1, g, h_values)
+        else:
+            sift_up(heap, heap_pos, heap_pos[node], g, h_values)
+
+    steps = 0
+    while size > 0 and state[target] != -1:
+
+        # Pop the node with the lowest f
+        node = heap[0]
+        size -= 1
+        if size > 0:
+            heap[0] = heap[size]
+            heap_pos[heap[0]] = 0
+            sift_down(heap, heap_pos, size, 0, g, h_values)
+        state[node] = -1
+        steps += 1
+
+        g_node = g[node]
+        for e in range(indptr[node], indptr[node + 1]):
+            succ = indices[e]
+            if state[succ] == -1:
+                continue
+
+            new_g = g_node + weights[e]
+            if new_g < g[succ]:
+                g[succ] = new_g
+                parent[succ] = node
+                if state[succ] == 0:
+                    state[succ] = 1
+                    heap[size] = succ
+                    size += 1
+                    sift_up(heap, heap_pos, size - 1, g, h_values)
+                else:
+                    sift_up(heap, heap_pos, heap_pos[succ], g, h_values)
+
+    return steps
@@ -0,0 +1,307 @@
+# Nathaniel Alden Homans Youngren
+# September 13, 2023
+
+import numpy as np
+from a_star import A_Star_Portals, NEIGHBOR_OFFSETS
+
+# NOTE: Jump Point Search (JPS) variant of A* with portals.
+#
+# In regions where every cell shares the same cost, many paths of equal length exist between two cells,
+#   and normal A* searches all of them. JPS prunes these symmetric paths by "jumping" in straight and diagonal lines,
+#   only adding cells where the path may need to change direction (jump points).
+#
+# A cell is considered uniform if it is passable, and each of its 8 neighbors is either a wall (or off the grid)
+#   or passable with the same cost, with no portal entrances or exits among them.
+#   > Uniform cells are expanded with JPS pruning (natural and forced neighbors), and jumped through.
+#   > Jumps stop at walls, at cells with forced neighbors, at the end, and at the first non-uniform cell,
+#       which falls back to normal expansion. Cost boundaries and portals are therefore always expanded normally.
+# Step costs match A_Star_Portals exactly (10 or 14 multiplied by the cost of each cell entered).
+#
+# The uniform grid and the straight jump distances from every cell in each of the 4 straight directions are built
+#   in vectorized passes when a fresh search is seeded, and only if the terrain or portals changed since they were last built.
+#   Straight jumps are then a single lookup, and diagonal jumps check both straight lines at each cell in constant time,
+#   so jumping never walks cell by cell in python beyond the diagonal itself.
+#
+
+
+class A_Star_JPS(A_Star_Portals):
+
+    def __init__(self, *args, **kwargs) -> None:
+        """ Initialize A* with portals and jump point search.
+                Arguments are the same as A_Star_Portals, the compiled engine is not used.
+        """
+        super().__init__(*args, **kwargs)
+
+        self.uniform_grid = None # True where a cell may be jumped through, built when the search is seeded
+        self.wall_grid = None    # True where a cell is impassable, padded by 1 wall cell on each side so off-grid cells count as walls
+        self.jump_grids = {}     # {(dx, dy): grid} cells from each cell to the next straight jump point in that direction (negative if a wall comes first)
+        self.jump_terrain = None # (padded cost grid, portals version) the grids were built from, to skip rebuilding them while unchanged
+        self.jump_count = 0      # Number of cells stepped over while jumping
+
+
+    def jit_supported(self):
+        """ The compiled engine does not implement jumping. """
+        return False
+
+
+    def terrain_changed(self):
+        """ True if the terrain or portals differ from those the uniform and jump grids were built from. """
+        if self.jump_terrain is None:
+            return True
+        padded, version = self.jump_terrain
+        return version != self.portals.version or not np.array_equal(padded[1:-1, 1:-1], self.cost_grid)
+
+
+    def update_uniform_grid(self):
+        """ Mark each cell that can be jumped through, in a single vectorized pass, then build the straight jump grids.
+                Must be called again if the terrain or portals change during a search.
+        """
+        w, h = self.w, self.h
+
+        # Pad the grid with walls, so cells on the grid edge compare against off-grid walls.
+        padded = np.full((w+2, h+2), -1, dtype=self.cost_grid.dtype)
+        padded[1:-1, 1:-1] = self.cost_grid
+        self.wall_grid = padded < 0
+        self.jump_terrain = (padded, self.portals.version)
+
+        # Compare every cell to each of its neighbors at once.
+        center = padded[1:-1, 1:-1]
+        uniform = center >= 0
+        for dx, dy in NEIGHBOR_OFFSETS:
+            neighbor = padded[1+dx:w+1+dx, 1+dy:h+1+dy]
+            uniform &= (neighbor < 0) | (neighbor == center)
+        self.uniform_grid = uniform
+
+        # Portals change the expansion of their entrances and the step costs near them, so cells around them are not uniform.
+        for portal_cell in list(self.portals.keys()) + list(self.portals.values()):
+            x, y = portal_cell
+            self.uniform_grid[max(x-1, 0):x+2, max(y-1, 0):y+2] = False
+
+        self.update_jump_grids()
+
+
+    def update_jump_grids(self):
+        """ Distance from every cell to the jump point reached by a straight jump in each of the 4 straight directions.
+                Each direction is the +x direction of the grids flipped and/or transposed, then solved in one pass along the rows.
+                The end position is not included, so the grids hold for any end (see straight_jump()).
+        """
+        # Cells where any straight jump stops (forced neighbors depend on the direction, and are added below)
+        stops = ~self.uniform_grid
+
+        views = {(1, 0): lambda grid: grid,
+                 (-1, 0): lambda grid: grid[::-1],
+                 (0, 1): lambda grid: grid.T,
+                 (0, -1): lambda grid: grid.T[::-1]}
+
+        # Each view is its own inverse up to a transpose, so results are mapped back with the inverse view
+        inverses = {(1, 0): lambda grid: grid,
+                    (-1, 0): lambda grid: grid[::-1],
+                    (0, 1): lambda grid: grid.T,
+                    (0, -1): lambda grid: grid[::-1].T}
+
+        self.jump_grids = {}
+        for direction, view in views.items():
+            walls = np.ascontiguousarray(view(self.wall_grid))
+            self.jump_grids[direction] = np.ascontiguousarray(inverses[direction](self.forward_jumps(walls, np.ascontiguousarray(view(stops)))))
+
+
+    @staticmethod
+    def forward_jumps(walls, stops):
+        """ Straight jumps in the +x direction.
+
+        Args:
+            walls (np.ndarray): (w+2, h+2) walls, padded as wall_grid.
+            stops (np.ndarray): (w, h) cells where jumps stop regardless of direction (non-uniform cells).
+
+        Returns:
+            np.ndarray: (w, h) number of cells from each cell to the first jump point in the +x direction,
+                        or minus the number of cells to the first wall if it comes first.
+        """
+        w, h = stops.shape
+
+        # Travelling +x through a cell, forced neighbors appear where a wall beside it ends
+        forced = (walls[1:-1, 2:] & ~walls[2:, 2:]) | (walls[1:-1, :-2] & ~walls[2:, :-2])
+
+        # Each wall or jump point is encoded as 2 * index (+1 for walls), the padding ensures every row ends in a wall
+        events = np.full((w+2, h), 2 * (w+2), dtype=np.int32)
+        indices = 2 * np.arange(w+2, dtype=np.int32)[:, None]
+        events[1:-1] = np.where((stops | forced) & ~walls[1:-1, 1:-1], indices[1:-1], events[1:-1])
+        events = np.where(walls[:, 1:-1], indices + 1, events)
+
+        # First event at or after each index, jumps from cell x start at x + 1
+        first = np.minimum.accumulate(events[::-1], axis=0)[::-1][2:]
+        distance = (first >> 1) - np.arange(1, w+1, dtype=np.int32)[:, None]
+        return np.where(first & 1, -distance, distance)
+
+
+    def is_wall(self, x, y):
+        """ True if (x, y) is impassable or off the grid. """
+        return self.wall_grid[x+1, y+1]
+
+
+    def search_cell(self, pos, prev_pos=None, start_g:int=0):
+        """ As A_Star.search_cell(), the uniform grid is rebuilt when the first cell of a fresh search is seeded,
+                if the terrain or portals changed. Seeding many sources (e.g. solve_sources()) builds it at most once.
+        """
+        if prev_pos is None and self.open_count + self.closed_count == 0 and self.terrain_changed():
+            self.update_uniform_grid()
+        super().search_cell(pos, prev_pos, start_g)
+
+
+    def search_neighbors(self, pos):
+        """ Expand a cell, jumping in the directions left by JPS pruning if the cell is uniform.
+                > Straight travel continues straight, diagonal travel continues diagonally or along either of its components.
+                > Forced neighbors, made necessary by adjacent walls, are also jumped towards.
+                > The start cell (no parent) jumps in all 8 directions.
+
+        Args:
+            pos (int, int): Origin cell.
+        """
+        # Non-uniform cells fall back to normal expansion.
+        if not self.uniform_grid[pos]:
+            return super().search_neighbors(pos)
+
+        x, y = pos
+        parent = self.p_grid[pos]
+
+        if parent == -1:
+            directions = NEIGHBOR_OFFSETS.tolist()
+        else:
+            px, py = divmod(int(parent), self.h)
+            directions = self.pruned_directions(x, y, int(np.sign(x - px)), int(np.sign(y - py)))
+
+        # Jump in each direction, collecting jump points and the cost of reaching them.
+        jump_points = [jump for dx, dy in directions if (jump := self.jump(x, y, dx, dy)) is not None]
+        if not jump_points:
+            return
+
+        xs, ys, step_costs = (np.array(values, dtype=np.int64) for values in zip(*jump_points))
+        self.search_cells(xs, ys, pos, None, step_costs=step_costs)
+
+
+    def pruned_directions(self, x, y, dx, dy):
+        """ Natural and forced neighbor directions of a cell reached by travelling in direction (dx, dy).
+
+        Args:
+            x, y (int): Cell coordinate.
+            dx, dy (int): Direction of travel into the cell, each -1, 0 or 1.
+
+        Returns:
+            [(int, int), ...]: Directions to jump in.
+        """
+        if dx and dy:
+            directions = [(dx, 0), (0, dy), (dx, dy)]
+            if self.is_wall(x-dx, y) and not self.is_wall(x-dx, y+dy):
+                directions.append((-dx, dy))
+            if self.is_wall(x, y-dy) and not self.is_wall(x+dx, y-dy):
+                directions.append((dx, -dy))
+
+        elif dx:
+            directions = [(dx, 0)]
+            for s in (-1, 1):
+                if self.is_wall(x, y+s) and not self.is_wall(x+dx, y+s):
+                    directions.append((dx, s))
+        else:
+            directions = [(0, dy)]
+            for s in (-1, 1):
+                if self.is_wall(x+s, y) and not self.is_wall(x+s, y+dy):
+                    directions.append((s, dy))
+
+        return directions
+
+
+    def has_forced_neighbor(self, x, y, dx, dy):
+        """ True if travelling through (x, y) in direction (dx, dy) creates a forced neighbor, making it a jump point. """
+        if dx and dy:
+            return (self.is_wall(x-dx, y) and not self.is_wall(x-dx, y+dy)) or \
+                   (self.is_wall(x, y-dy) and not self.is_wall(x+dx, y-dy))
+        if dx:
+            return (self.is_wall(x, y+1) and not self.is_wall(x+dx, y+1)) or \
+                   (self.is_wall(x, y-1) and not self.is_wall(x+dx, y-1))
+        return (self.is_wall(x+1, y) and not self.is_wall(x+1, y+dy)) or \
+               (self.is_wall(x-1, y) and not self.is_wall(x-1, y+dy))
+
+
+    def jump(self, x, y, dx, dy):
+        """ Travel from (x, y) in direction (dx, dy) until reaching a jump point.
+                Diagonal jumps also stop wherever a straight jump along either component would find a jump point.
+
+        Args:
+            x, y (int): Origin cell.
+            dx, dy (int): Direction of travel, each -1, 0 or 1.
+
+        Returns:
+            (int, int, int): Jump point coordinate and the cost of reaching it from (x, y). None if a wall or the grid edge is reached.
+        """
+        # Straight jumps are looked up. Jumps only pass through uniform cells, so every cell entered costs the same as the last.
+        if not (dx and dy):
+            cells = self.straight_jump(x, y, dx, dy)
+            if cells < 0:
+                return None
+            x, y = x + dx * cells, y + dy * cells
+            self.jump_count += cells
+            return x, y, cells * 10 * int(self.cost_grid[x, y])
+
+        cost = 0
+
+        while True:
+            x += dx
+            y += dy
+            if self.is_wall(x, y):
+                return None
+
+            cost += 14 * int(self.cost_grid[x, y])
+            self.jump_count += 1
+
+            if (x, y) == self.end_pos or not self.uniform_grid[x, y] or self.has_forced_neighbor(x, y, dx, dy):
+                return x, y, cost
+
+            # A straight jump along either component would find a jump point
+            if self.straight_jump(x, y, dx, 0) >= 0 or self.straight_jump(x, y, 0, dy) >= 0:
+                return x, y, cost
+
+
+    def straight_jump(self, x, y, dx, dy):
+        """ Number of cells from (x, y) to the jump point of a straight jump in direction (dx, dy), stopping at the end if it comes first.
+
+        Returns:
+            int: Number of cells, -1 if a wall or the grid edge is reached first.
+        """
+        cells = int(self.jump_grids[dx, dy][x, y])
+
+        # The end lies ahead on the same line, before the first wall or jump point
+        if self.end_pos is not None:
+            ex, ey = self.end_pos
+            ahead = (ex - x) * dx if dy == 0 and ey == y else (ey - y) * dy if dx == 0 and ex == x else 0
+            if 0 < ahead < abs(cells):
+                return ahead
+
+        return cells if cells > 0 else -1
+
+
+    def reconstruct_path(self, pos):
+        """ As A_Star.reconstruct_path(), filling in the cells jumped over between each pair of jump points.
+
+        Args:
+            pos (int, int): Cell coordinate.
+
+        Returns:
+            [(int, int), ...]: A list of cell coordinates, from the original parent of pos to pos.
+        """
+        jump_points = super().reconstruct_path(pos)
+        path = jump_points[:1]
+
+        for (px, py), (x, y) in zip(jump_points, jump_points[1:]):
+
+            # Portal travel is a single step.
+            if self.portals.get((px, py)) == (x, y):
+                path.append((x, y))
+                continue
+
+            # Jumps travel in straight or diagonal lines.
+            dx, dy = int(np.sign(x - px)), int(np.sign(y - py))
+            while (px, py) != (x, y):
+                px, py = px + dx, py + dy
+                path.append((px, py))
+
+        return path
@@ -0,0 +1,386 @@
+# Nathaniel Alden Homans Youngren
+# September 13, 2023
+
+import argparse
+import csv
+import itertools
+import json
+import sys
+import tracemalloc
+import numpy as np
+from time import perf_counter
+from a_star import A_Star_Portals
+from a_star_bidirectional import A_Star_Bidirectional
+from a_star_jps import A_Star_JPS
+
+# NOTE: INSTRUCTIONS
+#
+# Headless benchmark of the heuristic modes and solver variants, over seeded random maps (no pygame required).
+#
+# 1. Run the benchmark, writing JSON or CSV (chosen by the extension of --out):
+#       > python benchmark.py run --out baseline.json
+#       > python benchmark.py run --sizes 64 256 --walls 0.1 0.3 --costs 1 9 --portals 0 8 32 --seeds 3 --out results.csv
+#    Every combination of size, wall density, cost range, portal count and seed is one map,
+#       searched once by each solver in each heuristic mode (see SOLVERS and H_MODES).
+# 2. Compare a later run against the saved baseline, flagging regressions:
+#       > python benchmark.py compare baseline.json results.json --tolerance 0.2
+#    Steps, heuristic_count and portal_sort_count are deterministic, so any increase is a regression (as is any change of path cost).
+#    Time and peak memory are flagged when they grow by more than the tolerance, ignoring changes below the noise floors.
+#    The exit status is 1 if any regression was found, so the comparison can gate a commit or CI job.
+# 3. Compare the number of cells expanded by solver variants over the same maps, in the standard heuristic mode:
+#       > python benchmark.py expansions --solvers portals bidirectional
+#    Totals of expansions and wall time are printed for each wall density and cost range, and the exit status is 1 if any solver
+#       expands more cells in total than the first (or finds a different path cost).
+#       > python benchmark.py expansions --solvers portals jps --sizes 256 1000 --portals 0
+# 4. Compare the compiled engine (a_star_jit.py, requires numba) against the python implementation on larger maps:
+#       > python benchmark.py jit --sizes 256 1024
+#    The exit status is 1 if the engines find different paths or step counts.
+#
+# Peak memory is measured with tracemalloc in a separate run of each search, so it does not slow the timed runs.
+#
+
+# Solver variants, as {name: (class, constructor arguments)}
+SOLVERS = {'portals': (A_Star_Portals, {}),
+           'jit': (A_Star_Portals, {'jit': True}),
+           'jps': (A_Star_JPS, {}),
+           'bidirectional': (A_Star_Bidirectional, {})}
+
+H_MODES = ['standard', 'store_all', 'store_none', 'naive']
+
+NAIVE_PORTAL_LIMIT = 6      # The naive heuristic is O(n!) in the number of portals, so larger maps skip it
+
+# Metrics compared between runs, as {metric: (kind, noise floor)}
+#   'count' metrics regress on any increase, 'measure' metrics on a relative increase beyond the tolerance and the floor.
+METRICS = {'steps': ('count', 0),
+           'heuristic_count': ('count', 0),
+           'portal_sort_count': ('count', 0),
+           'time': ('measure', 0.02),           # Seconds, timings of shorter searches are dominated by noise
+           'peak_memory': ('measure', 65536)}   # Bytes
+
+# Columns identifying a single search, shared by every result
+KEY_COLUMNS = ['size', 'walls', 'max_cost', 'portals', 'seed', 'solver', 'h_mode']
+COLUMNS = KEY_COLUMNS + ['found', 'cost', 'steps', 'heuristic_count', 'portal_sort_count', 'time', 'peak_memory']
+
+
+# # # # # # # # # # # # #
+# Maps
+
+def generate_map(size:int, walls:float, max_cost:int, portals:int, seed:int):
+    """ Generate a seeded random map.
+
+    Args:
+        size (int): Width and height of the grid.
+        walls (float): Fraction of cells that are walls.
+        max_cost (int): Cell costs are drawn uniformly from 1 to max_cost.
+        portals (int): Number of portals, between random passable cells.
+        seed (int): Random seed, the same arguments always give the same map.
+
+    Returns:
+        dict: Map with 'cost_grid', 'portals', 'start_pos' and 'end_pos'.
+    """
+    rng = np.random.default_rng([size, int(walls * 1000), max_cost, portals, seed])
+    cost_grid = rng.integers(1, max_cost + 1, size=(size, size))
+    cost_grid[rng.random((size, size)) < walls] = -1
+
+    # Start and end are near opposite corners, so searches cross most of the map
+    start_pos, end_pos = (0, 0), (size - 1, size - 1)
+    cost_grid[start_pos] = cost_grid[end_pos] = 1
+
+    passable = np.argwhere(cost_grid >= 0)
+    map_portals = {}
+    while len(map_portals) < min(portals, len(passable) // 2):
+        entry, p_exit = (tuple(int(v) for v in passable[i]) for i in rng.choice(len(passable), size=2, replace=False))
+        map_portals.setdefault(entry, p_exit)
+
+    return {'cost_grid': cost_grid, 'portals': map_portals, 'start_pos': start_pos, 'end_pos': end_pos}
+
+
+def build_sim(game_map, solver:str, h_mode:str):
+    """ Build a simulation of the given solver variant and heuristic mode for a map. """
+    sim_class, kwargs = SOLVERS[solver]
+    size = game_map['cost_grid'].shape[0]
+    sim = sim_class(size, size, game_map['start_pos'], game_map['end_pos'], h_mode=h_mode, **kwargs)
+    sim.cost_grid[:] = game_map['cost_grid']
+    sim.portals = dict(game_map['portals'])
+    return sim
+
+
+# # # # # # # # # # # # #
+# Running
+
+def run_case(game_map, solver:str, h_mode:str, repeat:int=3):
+    """ Search a map with one solver and heuristic mode.
+
+    Args:
+        game_map (dict): Map from generate_map().
+        solver (str): Key of SOLVERS.
+        h_mode (str): Heuristic mode of A_Star_Portals.
+        repeat (int, optional): Number of timed searches, the fastest is kept. Defaults to 3.
+
+    Returns:
+        dict: Metrics of the search (see COLUMNS).
+    """
+    # Timed runs, each on a fresh simulation so no stored heuristics carry over
+    best_time = None
+    for _ in range(max(repeat, 1)):
+        sim = build_sim(game_map, solver, h_mode)
+        st = perf_counter()
+        result = sim.solve()
+        elapsed = perf_counter() - st
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+
+    # Memory run, including the grids allocated by the simulation
+    tracemalloc.start()
+    memory_sim = build_sim(game_map, solver, h_mode)
+    memory_sim.solve()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'found': result.found,
+            'cost': result.cost,
+            'steps': sim.step_count,
+            'heuristic_count': sim.heuristic_count,
+            'portal_sort_count': sim.portal_sort_count,
+            'time': best_time,
+            'peak_memory': peak_memory}
+
+
+def run_benchmark(sizes, walls, costs, portals, seeds:int, solvers, h_modes, repeat:int=3, verbose:bool=True):
+    """ Run every combination of map settings, solvers and heuristic modes.
+
+    Args:
+        sizes, walls, costs, portals ([...]): Values of each map setting (size, wall density, max cost, portal count).
+        seeds (int): Number of maps generated for each combination of settings.
+        solvers ([str, ...]): Keys of SOLVERS.
+        h_modes ([str, ...]): Heuristic modes.
+        repeat (int, optional): Number of timed searches of each case, the fastest is kept. Defaults to 3.
+        verbose (bool, optional): If True, print each result as it finishes. Defaults to True.
+
+    Returns:
+        [dict, ...]: One row per search (see COLUMNS).
+    """
+    # Compile the engine before any timing
+    if 'jit' in solvers:
+        build_sim(generate_map(8, 0, 1, 2, 0), 'jit', 'standard').solve()
+
+    rows = []
+    for size, wall, max_cost, portal_count, seed in itertools.product(sizes, walls, costs, portals, range(seeds)):
+        game_map = generate_map(size, wall, max_cost, portal_count, seed)
+        for solver, h_mode in itertools.product(solvers, h_modes):
+            if h_mode == 'naive' and portal_count > NAIVE_PORTAL_LIMIT:
+                continue
+
+            row = {'size': size, 'walls': wall, 'max_cost': max_cost, 'portals': portal_count, 'seed': seed,
+                   'solver': solver, 'h_mode': h_mode}
+            row.update(run_case(game_map, solver, h_mode, repeat))
+            rows.append(row)
+
+            if verbose:
+                print(f'{size}x{size} walls {wall} cost 1-{max_cost} portals {portal_count} seed {seed} | {solver:13} {h_mode:10} | '
+                      f'steps {row["steps"]:7} heuristics {row["heuristic_count"]:9} sorts {row["portal_sort_count"]:5} '
+                      f'time {row["time"]:.4f}s memory {row["peak_memory"] / 1024:.0f} KiB')
+    return rows
+
+
+def compare_expansions(rows, solvers):
+    """ Total the cells expanded by each solver and their wall time, per wall density and cost range, relative to the first solver.
+            Times are printed alongside, as fewer expansions do not always mean a faster search.
+
+    Args:
+        rows ([dict, ...]): Results of run_benchmark() in a single heuristic mode.
+        solvers ([str, ...]): Keys of SOLVERS, the first is the reference.
+
+    Returns:
+        ([str, ...], bool): Lines of the summary, and True if every solver expanded no more cells in total than the first,
+                            and found the same path cost on every map.
+    """
+    totals, times, costs = {}, {}, {}
+    for row in rows:
+        group = f'walls {row["walls"]} cost 1-{row["max_cost"]}'
+        for key in (group, 'total'):
+            totals.setdefault(key, dict.fromkeys(solvers, 0))[row['solver']] += row['steps']
+            times.setdefault(key, dict.fromkeys(solvers, 0.0))[row['solver']] += row['time']
+        costs.setdefault(tuple(row[key] for key in KEY_COLUMNS if key not in ('solver', 'h_mode')), set()).add(row['cost'])
+
+    lines = []
+    for key, steps in sorted(totals.items(), key=lambda item: item[0] == 'total'):
+        reference, time_reference = steps[solvers[0]] or 1, times[key][solvers[0]] or 1
+        lines.append(f'{key:22} | ' + ' | '.join(f'{solver} {steps[solver]:8} ({steps[solver] / reference - 1:+.0%}) '
+                                                 f'{times[key][solver]:7.3f}s ({times[key][solver] / time_reference - 1:+.0%})'
+                                                 for solver in solvers))
+
+    mismatches = sum(len(found) > 1 for found in costs.values())
+    if mismatches:
+        lines.append(f'{mismatches} maps with differing path costs')
+    fewer = all(totals['total'][solver] <= totals['total'][solvers[0]] for solver in solvers)
+    return lines, fewer and not mismatches
+
+
+# # # # # # # # # # # # #
+# Results
+
+def write_results(path:str, rows):
+    """ Write results as CSV if path ends with .csv, otherwise as JSON. """
+    with open(path, 'w', newline='') as f:
+        if path.endswith('.csv'):
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump(rows, f, indent=1)
+
+
+def read_results(path:str):
+    """ Read results written by write_results(), converting CSV fields back to numbers. """
+    with open(path, newline='') as f:
+        if not path.endswith('.csv'):
+            return json.load(f)
+        rows = list(csv.DictReader(f))
+
+    for row in rows:
+        for key in ('size', 'max_cost', 'portals', 'seed', 'steps', 'heuristic_count', 'portal_sort_count', 'peak_memory'):
+            row[key] = int(row[key])
+        row['walls'], row['time'] = float(row['walls']), float(row['time'])
+        row['found'] = row['found'] == 'True'
+        row['cost'] = int(row['cost']) if row['cost'] else None
+    return rows
+
+
+def compare_results(baseline, current, tolerance:float=0.2):
+    """ Find regressions of the current results against a baseline.
+
+    Args:
+        baseline ([dict, ...]): Baseline results.
+        current ([dict, ...]): Current results, searches missing from the baseline are ignored.
+        tolerance (float, optional): Allowed relative increase of time and peak memory. Defaults to 0.2.
+
+    Returns:
+        [str, ...]: Description of each regression.
+    """
+    baseline_rows = {tuple(row[key] for key in KEY_COLUMNS): row for row in baseline}
+    regressions = []
+
+    for row in current:
+        key = tuple(row[key] for key in KEY_COLUMNS)
+        base = baseline_rows.get(key)
+        if base is None:
+            continue
+        name = ' '.join(f'{column}={value}' for column, value in zip(KEY_COLUMNS, key))
+
+        if row['cost'] != base['cost']:
+            regressions.append(f'{name}: cost changed {base["cost"]} -> {row["cost"]}')
+
+        for metric, (kind, floor) in METRICS.items():
+            old, new = base[metric], row[metric]
+            if kind == 'count':
+                regressed = new > old
+            else:
+                regressed = new > old * (1 + tolerance) and new - old > floor
+            if regressed:
+                change = f' ({(new - old) / old:+.0%})' if old else ''
+                regressions.append(f'{name}: {metric} {old} -> {new}{change}')
+
+    return regressions
+
+
+# # # # # # # # # # # # #
+# Command line
+
+def compare_engines(sizes, walls:float=0.25, max_cost:int=5, portals:int=8, seed:int=0):
+    """ Time the python and compiled engines of A_Star_Portals on the same maps.
+
+    Args:
+        sizes ([int, ...]): Grid sizes (width = height).
+        walls (float, optional): Fraction of cells that are walls. Defaults to 0.25.
+        max_cost (int, optional): Cell costs are drawn uniformly from 1 to max_cost. Defaults to 5.
+        portals (int, optional): Number of portals. Defaults to 8.
+        seed (int, optional): Random seed of the maps. Defaults to 0.
+
+    Returns:
+        ([str, ...], bool): Lines of the comparison, and True if both engines found the same paths in the same steps.
+    """
+    build_sim(generate_map(16, walls, max_cost, portals, seed), 'jit', 'standard').run() # Compile before timing
+
+    lines, identical = [], True
+    for size in sizes:
+        game_map = generate_map(size, walls, max_cost, portals, seed)
+        results = {}
+        for solver in ('portals', 'jit'):
+            sim = build_sim(game_map, solver, 'standard')
+            st = perf_counter()
+            sim.run()
+            results[solver] = (perf_counter() - st, sim.step_count, sim.heuristic_count, sim.last_path)
+
+        (py_time, py_steps, py_count, py_path), (jit_time, jit_steps, jit_count, jit_path) = results['portals'], results['jit']
+        identical = identical and py_steps == jit_steps and py_path == jit_path
+        lines.append(f'{size}x{size}: python {py_time:.3f}s, jit {jit_time:.3f}s, speedup {py_time / jit_time:.1f}x')
+        lines.append(f' > steps: {py_steps} / {jit_steps}, heuristics: {py_count} / {jit_count}, identical paths: {py_path == jit_path}')
+
+    return lines, identical
+
+
+def add_map_arguments(parser):
+    """ Add the map settings shared by the run and expansions commands. """
+    parser.add_argument('--sizes', type=int, nargs='+', default=[32, 64, 128], help='Grid sizes (width = height).')
+    parser.add_argument('--walls', type=float, nargs='+', default=[0.0, 0.2], help='Fractions of wall cells.')
+    parser.add_argument('--costs', type=int, nargs='+', default=[1, 5], help='Highest cell costs, costs are drawn from 1 to each.')
+    parser.add_argument('--portals', type=int, nargs='+', default=[0, 4, 16], help='Portal counts.')
+    parser.add_argument('--seeds', type=int, default=2, help='Maps generated for each combination of settings.')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless benchmark of the A* heuristic modes and solver variants.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Benchmark seeded random maps, writing JSON or CSV.')
+    add_map_arguments(run_parser)
+    run_parser.add_argument('--solvers', nargs='+', default=['portals'], choices=list(SOLVERS), help='Solver variants.')
+    run_parser.add_argument('--h-modes', nargs='+', default=H_MODES, choices=H_MODES, help='Heuristic modes.')
+    run_parser.add_argument('--repeat', type=int, default=3, help='Timed searches of each case, the fastest is kept.')
+    run_parser.add_argument('--out', default='benchmark.json', help='Output file, CSV if it ends with .csv, otherwise JSON.')
+    run_parser.add_argument('--quiet', action='store_true', help='Do not print each result.')
+
+    compare_parser = commands.add_parser('compare', help='Flag regressions of a run against a saved baseline.')
+    compare_parser.add_argument('baseline', help='Baseline results (JSON or CSV).')
+    compare_parser.add_argument('current', help='Current results (JSON or CSV).')
+    compare_parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative increase of time and peak memory.')
+
+    expansions_parser = commands.add_parser('expansions', help='Compare the cells expanded by solver variants over the same maps.')
+    add_map_arguments(expansions_parser)
+    expansions_parser.add_argument('--solvers', nargs='+', default=['portals', 'bidirectional'], choices=list(SOLVERS),
+                                   help='Solver variants, the first is the reference.')
+
+    jit_parser = commands.add_parser('jit', help='Time the compiled engine against the python implementation.')
+    jit_parser.add_argument('--sizes', type=int, nargs='+', default=[256, 1024], help='Grid sizes (width = height).')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        rows = run_benchmark(args.sizes, args.walls, args.costs, args.portals, args.seeds, args.solvers, args.h_modes,
+                             repeat=args.repeat, verbose=not args.quiet)
+        write_results(args.out, rows)
+        print(f'{len(rows)} results written to {args.out}')
+        return 0
+
+    if args.command == 'expansions':
+        rows = run_benchmark(args.sizes, args.walls, args.costs, args.portals, args.seeds, args.solvers, ['standard'],
+                             repeat=1, verbose=False)
+        lines, fewer = compare_expansions(rows, args.solvers)
+        print('\n'.join(lines))
+        return 0 if fewer else 1
+
+    if args.command == 'jit':
+        lines, identical = compare_engines(args.sizes)
+        print('\n'.join(lines))
+        return 0 if identical else 1
+
+    baseline, current = read_results(args.baseline), read_results(args.current)
+    regressions = compare_results(baseline, current, args.tolerance)
+    for regression in regressions:
+        print('REGRESSION', regression)
+    print(f'{len(regressions)} regressions in {len(current)} results')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,335 @@
+# Nathaniel Alden Homans Youngren
+# September 13, 2023
+
+import heapq
+import numpy as np
+from time import time
+from a_star import Search_Result, NEIGHBOR_OFFSETS, NEIGHBOR_DISTANCES, octile_distance
+
+# NOTE: INSTRUCTIONS
+#
+# 1. Set up a simulation (A_Star or A_Star_Portals) with the desired terrain, portals, start and end positions.
+# 2. Build a D_Star_Lite planner from it, and call solve() for the initial path.
+# 3. As the terrain changes at runtime, modify the simulation's cost_grid and portals as usual, then report the change:
+#       > update_cells(cells) after modifying the cost of some cells.
+#       > update_portals() after adding, moving or removing portals.
+# 4. As the unit moves, call move_start(pos).
+# 5. Call solve() again, which repairs the previous search instead of starting over.
+#       Only cells whose distance to the end is affected by the changes are expanded again.
+#
+# The search runs backwards from the end position, so the start may move freely without invalidating it.
+# Steps use the same cost model as Flow_Field: 10 (orthogonal) or 14 (diagonal) multiplied by the cost of the cell entered,
+#   portals are one-way and free to travel through.
+#
+
+
+class D_Star_Lite():
+
+    def __init__(self, sim, start_pos:(int, int)=None, end_pos:(int, int)=None) -> None:
+        """ Incremental planner (D* Lite) over the terrain and portals of a simulation.
+
+        Args:
+            sim (A_Star): Simulation holding the terrain (and portals), its grids are not modified.
+            start_pos (int, int, optional): Initial start position. Defaults to sim.start_pos.
+            end_pos (int, int, optional): End position, fixed for the lifetime of the planner. Defaults to sim.end_pos.
+        """
+        self.sim = sim
+        self.w, self.h = sim.w, sim.h
+        self.start_pos = tuple(sim.start_pos if start_pos is None else start_pos)
+        self.end_pos = tuple(sim.end_pos if end_pos is None else end_pos)
+
+        self.max_value = np.iinfo(np.int64).max                                 # Distance of cells that cannot reach the end
+        self.g_grid = np.full((self.w, self.h), self.max_value, dtype=np.int64)   # Distance from each cell to the end, as of its last expansion
+        self.rhs_grid = np.full((self.w, self.h), self.max_value, dtype=np.int64) # One-step lookahead of g, from the g of each cell's successors
+                                                                                #   Cells where g != rhs are inconsistent, and wait in the open heap
+
+        self.open_heap = []         # Priority queue of inconsistent cells, stored as (k1, k2, (x, y)) tuples.
+                                    #   Outdated entries are skipped or re-keyed when popped.
+        self.key_modifier = 0       # Accumulated heuristic change from start moves, keeps old keys valid without re-keying the heap
+        self.last_start = self.start_pos # Start position at the last key modifier update
+
+        self.portals = {}           # Portals at the time of the last update
+        self.portal_sources = {}    # {exit: [entry, ...]} reverse lookup of portals
+        self.h_scale = 0            # Lowest cost multiplier of any step, scales the octile heuristic
+
+        # Stats
+        self.expansion_count = 0    # Number of cells expanded, in total
+        self.heuristic_count = 0    # Number of times a heuristic has been calculated
+
+        self.snapshot_portals()
+        self.h_scale = self.lowest_cost()
+
+        # The search begins from the end
+        self.rhs_grid[self.end_pos] = 0
+        self.push(self.end_pos)
+
+
+    # # # # # # # # # # # # #
+    # Runtime changes
+
+    def update_cells(self, cells):
+        """ Report cells whose cost has been modified in the simulation's cost_grid.
+                Each cell and the cells stepping into it are updated, the repair happens on the next solve().
+
+        Args:
+            cells ([(int, int), ...]): Modified cells.
+        """
+        cells = [(int(cell[0]), int(cell[1])) for cell in cells]
+
+        # Only the modified cells can lower the cheapest cost, so the whole grid is never rescanned.
+        costs = [int(self.sim.cost_grid[cell]) for cell in cells]
+        lowest = min([cost for cost in costs if cost >= 0], default=self.h_scale)
+        if lowest < self.h_scale:
+            # Cheaper terrain would make the heuristic overestimate, so scale it down and re-key the heap.
+            self.h_scale = lowest
+            self.rekey_heap()
+
+        for cell in cells:
+            self.update_vertex(cell)
+            for pred, _ in self.predecessors(cell, include_walls=True):
+                self.update_vertex(pred)
+
+
+    def update_portals(self):
+        """ Report portals that have been added, moved or removed in the simulation. """
+        old_portals = self.portals
+        self.snapshot_portals()
+
+        if self.portals and not old_portals and self.h_scale:
+            # Portals make any distance possible, so the heuristic is disabled.
+            self.h_scale = 0
+            self.rekey_heap()
+
+        changed = set(old_portals.items()) ^ set(self.portals.items())
+        for entry in {entry for entry, _ in changed}:
+            self.update_vertex(entry)
+
+
+    def move_start(self, pos):
+        """ Move the start position, usually along the last path found.
+
+        Args:
+            pos (int, int): New start position.
+        """
+        pos = (int(pos[0]), int(pos[1]))
+        self.key_modifier += self.heuristic(self.last_start, pos)
+        self.last_start = pos
+        self.start_pos = pos
+
+
+    def snapshot_portals(self):
+        """ Copy the simulation's portals, and build their reverse lookup. """
+        self.portals = dict(getattr(self.sim, 'portals', {}))
+        self.portal_sources = {}
+        for entry, exit in self.portals.items():
+            self.portal_sources.setdefault(exit, []).append(entry)
+
+
+    def lowest_cost(self):
+        """ Lowest cost multiplier of any step, 0 if there are portals (which allow free travel).
+                Scans the whole grid, so it is only used when building the planner, update_cells() lowers it from the modified cells.
+        """
+        if self.portals:
+            return 0
+        passable = self.sim.cost_grid[self.sim.cost_grid >= 0]
+        return int(passable.min()) if passable.size else 0
+
+
+    def rekey_heap(self):
+        """ Rebuild the open heap with the current key of each inconsistent cell. """
+        cells = {pos for _, _, pos in self.open_heap if self.g_grid[pos] != self.rhs_grid[pos]}
+        self.open_heap = []
+        for pos in cells:
+            self.push(pos)
+
+
+    # # # # # # # # # # # # #
+    # Search
+
+    def solve(self):
+        """ Repair the search after any reported changes, and find the path from the current start.
+
+        Returns:
+            Search_Result: Path, cost, cells expanded by this call, heuristic count and wall time.
+        """
+        st = time()
+        expansions = self.expansion_count
+        self.compute_shortest_path()
+
+        cost = self.distance(self.start_pos)
+        path = self.path() if cost is not None else []
+        return Search_Result(path, cost, self.expansion_count - expansions, self.heuristic_count, time() - st)
+
+
+    def compute_shortest_path(self):
+        """ Expand inconsistent cells until the start is consistent and every open cell is more expensive than it. """
+        start = self.start_pos
+
+        while self.open_heap:
+            k1, k2, pos = self.open_heap[0]
+            # Ties with the start are still expanded, as free steps (portals or cost 0 cells) can hide an outdated path behind them.
+            if (k1, k2) > self.calculate_key(start) and self.g_grid[start] == self.rhs_grid[start]:
+                break
+            heapq.heappop(self.open_heap)
+
+            g, rhs = int(self.g_grid[pos]), int(self.rhs_grid[pos])
+
+            # Consistent cells are outdated entries
+            if g == rhs:
+                continue
+
+            # Entries keyed before the start moved are pushed again with their current key
+            if (k1, k2) < self.calculate_key(pos):
+                self.push(pos)
+                continue
+
+            self.expansion_count += 1
+
+            if g > rhs:
+                # Overconsistent, a shorter path was found, so it is settled.
+                self.g_grid[pos] = rhs
+            else:
+                # Underconsistent, its path got longer or was cut, so it is re-evaluated along with its predecessors.
+                self.g_grid[pos] = self.max_value
+                self.update_vertex(pos)
+
+            for pred, _ in self.predecessors(pos):
+                self.update_vertex(pred)
+
+
+    def update_vertex(self, pos):
+        """ Recalculate the rhs of a cell from its successors, and queue it if it is inconsistent.
+
+        Args:
+            pos (int, int): Cell coordinate.
+        """
+        if pos != self.end_pos:
+            rhs = self.max_value
+            for succ, step_cost in self.successors(pos):
+                g = int(self.g_grid[succ])
+                if g != self.max_value:
+                    rhs = min(rhs, g + step_cost)
+            self.rhs_grid[pos] = rhs
+
+        if self.g_grid[pos] != self.rhs_grid[pos]:
+            self.push(pos)
+
+
+    def push(self, pos):
+        """ Queue a cell with its current key. """
+        k1, k2 = self.calculate_key(pos)
+        heapq.heappush(self.open_heap, (k1, k2, pos))
+
+
+    def calculate_key(self, pos):
+        """ Priority of a cell in the open heap, lower keys are expanded first.
+
+        Args:
+            pos (int, int): Cell coordinate.
+
+        Returns:
+            (int, int): Sort key, (min(g, rhs) + h + key modifier, min(g, rhs))
+        """
+        g = min(int(self.g_grid[pos]), int(self.rhs_grid[pos]))
+        if g == self.max_value:
+            return (self.max_value, self.max_value)
+        return (g + self.heuristic(self.start_pos, pos) + self.key_modifier, g)
+
+
+    def heuristic(self, pos1, pos2):
+        """ Octile distance between two cells, scaled by the lowest step cost so it never overestimates. """
+        self.heuristic_count += 1
+        return self.h_scale * int(octile_distance(abs(pos1[0] - pos2[0]), abs(pos1[1] - pos2[1])))
+
+
+    # # # # # # # # # # # # #
+    # Graph
+
+    def successors(self, pos):
+        """ Cells reachable in one step from a cell, with the cost of that step.
+
+        Args:
+            pos (int, int): Cell coordinate.
+
+        Returns:
+            [((int, int), int), ...]: (cell, cost) of each successor.
+        """
+        cost_grid = self.sim.cost_grid
+        if cost_grid[pos] < 0:
+            return []
+
+        result = []
+        for (dx, dy), distance in zip(NEIGHBOR_OFFSETS.tolist(), NEIGHBOR_DISTANCES.tolist()):
+            x, y = pos[0] + dx, pos[1] + dy
+            if 0 <= x < self.w and 0 <= y < self.h and cost_grid[x, y] >= 0:
+                result.append(((x, y), distance * int(cost_grid[x, y])))
+
+        exit = self.portals.get(pos)
+        if exit is not None and cost_grid[exit] >= 0:
+            result.append((exit, 0))
+        return result
+
+
+    def predecessors(self, pos, include_walls=False):
+        """ Cells that reach a cell in one step, with the cost of that step.
+
+        Args:
+            pos (int, int): Cell coordinate.
+            include_walls (bool, optional): If True, all adjacent cells and portal entries are returned, even if they are impassable
+                (or pos is), for when the cost of pos has just changed. Costs are then meaningless. Defaults to False.
+
+        Returns:
+            [((int, int), int), ...]: (cell, cost) of each predecessor.
+        """
+        cost_grid = self.sim.cost_grid
+        if cost_grid[pos] < 0 and not include_walls:
+            return []
+
+        result = []
+        for (dx, dy), distance in zip(NEIGHBOR_OFFSETS.tolist(), NEIGHBOR_DISTANCES.tolist()):
+            x, y = pos[0] + dx, pos[1] + dy
+            if 0 <= x < self.w and 0 <= y < self.h and (include_walls or cost_grid[x, y] >= 0):
+                result.append(((x, y), distance * int(cost_grid[pos])))
+
+        for entry in self.portal_sources.get(pos, []):
+            if include_walls or cost_grid[entry] >= 0:
+                result.append((entry, 0))
+        return result
+
+
+    # # # # # # # # # # # # #
+    # Results
+
+    def distance(self, pos):
+        """ Distance from a cell to the end, as of the last solve().
+
+        Args:
+            pos (int, int): Cell coordinate.
+
+        Returns:
+            int: Cost of the shortest path to the end, None if the end cannot be reached.
+        """
+        g = self.g_grid[pos]
+        return None if g == self.max_value else int(g)
+
+
+    def path(self):
+        """ Follow the cheapest successors from the start to the end.
+
+        Returns:
+            [(int, int), ...]: A list of cell coordinates from the start to the end, empty if the end cannot be reached.
+        """
+        if self.distance(self.start_pos) is None:
+            return []
+
+        path = [self.start_pos]
+        visited = {self.start_pos}
+        while path[-1] != self.end_pos:
+            # Among equally cheap successors, cells already on the path are skipped, so free steps cannot loop.
+            options = [(step_cost + int(self.g_grid[succ]), succ) for succ, step_cost in self.successors(path[-1])
+                       if succ not in visited and self.g_grid[succ] != self.max_value]
+            if not options:
+                return []
+            path.append(min(options)[1])
+            visited.add(path[-1])
+        return path
@@ -0,0 +1,96 @@
+# Nathaniel Alden Homans Youngren
+# September 13, 2023
+
+import numpy as np
+from a_star import NEIGHBOR_OFFSETS
+from a_star_jit import flow_field
+
+# NOTE: INSTRUCTIONS
+#
+# 1. Set up a simulation (A_Star or A_Star_Portals) with the desired terrain, portals and end position.
+# 2. Build a Flow_Field from it, which searches the whole grid backwards from the end position once.
+# 3. Read the distance, next step or full path to the end from any cell, without any further searching.
+# 4. Call build() again after modifying the terrain or portals.
+#
+
+
+class Flow_Field():
+
+    def __init__(self, sim, end_pos:(int, int)=None) -> None:
+        """ Distance-to-goal and next-step direction fields, covering every cell of a simulation's grid.
+                Steps use the same cost model as the simulation: 10 (orthogonal) or 14 (diagonal) multiplied by the cost of the cell entered.
+                Portals are one-way and free to travel through.
+
+        Args:
+            sim (A_Star): Simulation holding the terrain (and portals), the grid dtypes of the simulation are reused.
+            end_pos (int, int, optional): Goal of the field. Defaults to sim.end_pos.
+        """
+        self.sim = sim
+        self.end_pos = sim.end_pos if end_pos is None else end_pos
+
+        self.max_value = sim.max_value                                      # Distance of cells that cannot reach the end
+        self.dist_grid = np.full((sim.w, sim.h), self.max_value, dtype=sim.g_grid.dtype)    # Distance from each cell to the end
+        self.dir_grid = np.full((sim.w, sim.h), -1, dtype=np.int8)          # Index into NEIGHBOR_OFFSETS of the next step (0-7), 8 = take portal, -1 = none
+        self.portals = {}                                                   # Portals at the time the field was built
+
+        self.settled_count = 0 # Number of cells that can reach the end
+        self.build()
+
+
+    def build(self):
+        """ (Re)build both fields from the current terrain and portals of the simulation. """
+        self.portals = dict(getattr(self.sim, 'portals', {}))
+        entries = np.array(list(self.portals.keys()), dtype=np.int64).reshape(-1, 2)
+        exits = np.array(list(self.portals.values()), dtype=np.int64).reshape(-1, 2)
+
+        self.dist_grid.fill(self.max_value)
+        self.dir_grid.fill(-1)
+        self.settled_count = flow_field(self.sim.cost_grid, self.dist_grid, self.dir_grid, entries, exits, self.end_pos[0], self.end_pos[1])
+
+
+    def distance(self, pos):
+        """ Distance from a cell to the end.
+
+        Args:
+            pos (int, int): Cell coordinate.
+
+        Returns:
+            int: Cost of the shortest path to the end, None if the end cannot be reached.
+        """
+        d = self.dist_grid[pos]
+        return None if d == self.max_value else int(d)
+
+
+    def next_pos(self, pos):
+        """ The next cell on a shortest path from pos to the end.
+
+        Args:
+            pos (int, int): Cell coordinate.
+
+        Returns:
+            (int, int): Next cell coordinate, None if pos is the end or cannot reach it.
+        """
+        direction = self.dir_grid[pos]
+        if direction == -1:
+            return None
+        if direction == 8:
+            return self.portals[pos]
+        return (pos[0] + int(NEIGHBOR_OFFSETS[direction, 0]), pos[1] + int(NEIGHBOR_OFFSETS[direction, 1]))
+
+
+    def path(self, pos):
+        """ Follow the direction field from pos to the end, in O(path length).
+
+        Args:
+            pos (int, int): Cell coordinate.
+
+        Returns:
+            [(int, int), ...]: A list of cell coordinates from pos to the end, empty if the end cannot be reached.
+        """
+        if self.distance(pos) is None:
+            return []
+
+        path = [tuple(pos)]
+        while path[-1] != self.end_pos:
+            path.append(self.next_pos(path[-1]))
+        return path
@@ -0,0 +1,255 @@
+# Nathaniel Alden Homans Youngren
+# September 13, 2023
+
+import numpy as np
+import pygame as pg
+import display_vars as dv
+
+# NOTE: INSTRUCTIONS
+#
+# 1. Build a renderer once for the grid size and cell scale: renderer = Grid_Renderer(grid_w, grid_h, cell_w, cell_h)
+# 2. Each frame, call renderer.draw(surf, origin, sim, last_path, show_search, show_path), as in main.draw_state().
+# 3. Or, if only a few cells changed since the last frame (see Change_Log in solver_hooks.py),
+#       call renderer.draw_cells(surf, origin, sim, last_path, cells, ...) to repaint only those cells,
+#       and pass the returned rects to pg.display.update(), as in main.draw_changes().
+#
+# Each frame, the color of every cell is chosen in one vectorized pass over the simulation's grids,
+#   as an index into a palette (PALETTE) rather than an RGB color.
+# Cell indices are expanded to pixels through a pixel map built once (the cell under each pixel, or the border),
+#   written into an 8-bit palette surface with surfarray, and blitted to the screen in a single call.
+# Frame cost therefore depends on the number of pixels, rather than on the number of cells or the length of the path.
+# The palette surface always holds the whole grid as last drawn, so partial updates repaint their cells into it too,
+#   and any area of the screen can be restored from it (see restore()).
+#
+
+# Palette indices of each cell feature, costs 1-9 take the 9 indices from COST_INDEX.
+BG_INDEX = 0
+CELL_INDEX = 1
+COST_INDEX = 2
+WALL_INDEX = COST_INDEX + dv.COST_COUNT
+SEARCHED_INDEX = WALL_INDEX + 1
+TRAVERSED_INDEX = WALL_INDEX + 2
+PATH_INDEX = WALL_INDEX + 3         # Followed by the index of path tips
+START_INDEX = WALL_INDEX + 5
+END_INDEX = WALL_INDEX + 6
+
+PALETTE = [dv.BG_COLOR, dv.CELL_COLOR] + [tuple(color) for color in dv.COST_COLORS.tolist()] + \
+          [dv.WALL_COLOR, dv.SEARCHED_COLOR, dv.TRAVERSED_COLOR, dv.PATH_COLORS[0], dv.PATH_COLORS[1], dv.START_COLOR, dv.END_COLOR]
+
+
+class Grid_Renderer():
+
+    def __init__(self, grid_w:int, grid_h:int, cell_w:float, cell_h:float, border_px:int=dv.BORDER_PX) -> None:
+        """ Renderer of a grid of cells, drawn at a fixed position and scale.
+
+        Args:
+            grid_w, grid_h (int): Size of the cell grid.
+            cell_w, cell_h (float): Size of each cell in pixels, may be fractional.
+            border_px (int, optional): Width of the grid lines around each cell, dropped if cells are too small to show them.
+                        Defaults to dv.BORDER_PX.
+        """
+        self.grid_w, self.grid_h = grid_w, grid_h
+        self.cell_w, self.cell_h = cell_w, cell_h
+
+        # Pixel size of the whole grid
+        self.pixel_w, self.pixel_h = max(int(round(cell_w * grid_w)), 1), max(int(round(cell_h * grid_h)), 1)
+
+        # Cell under each pixel column and row, and whether it falls on the grid lines
+        x_cells, x_border = self.pixel_axis(self.pixel_w, cell_w, grid_w, border_px)
+        y_cells, y_border = self.pixel_axis(self.pixel_h, cell_h, grid_h, border_px)
+
+        # Flat cell index of each pixel, border pixels index one past the last cell, which always holds BG_INDEX
+        self.pixel_map = (x_cells[:, None] * grid_h + y_cells[None, :]).astype(np.int32)
+        self.pixel_map[x_border[:, None] | y_border[None, :]] = grid_w * grid_h
+
+        # Pixel range of the inside of each cell (excluding the grid lines), as [start, stop) along each axis
+        self.x_start, self.x_stop = self.cell_extents(x_cells, x_border, grid_w)
+        self.y_start, self.y_stop = self.cell_extents(y_cells, y_border, grid_h)
+
+        self.cell_index = np.full(grid_w * grid_h + 1, BG_INDEX, dtype=np.uint8)  # Palette index of each cell, plus the border
+        self.cost_lookup = np.full(dv.COST_COUNT + 2, CELL_INDEX, dtype=np.uint8)  # Palette index of each cell cost from -1 to COST_COUNT
+        self.cost_lookup[2:] = COST_INDEX + np.arange(dv.COST_COUNT)
+
+        self.surface = pg.Surface((self.pixel_w, self.pixel_h), 0, 8)
+        self.surface.set_palette(PALETTE)
+
+
+    @staticmethod
+    def pixel_axis(pixels:int, cell_size:float, cells:int, border_px:int):
+        """ Cell index and border flag of each pixel along one axis.
+
+        Returns:
+            (np.ndarray, np.ndarray): Cell of each pixel, and True where the pixel falls on the grid lines.
+        """
+        positions = np.arange(pixels)
+        cell = np.minimum((positions / cell_size).astype(np.int64), cells - 1)
+        if cell_size < 2 * border_px + 2:
+            return cell, np.zeros(pixels, dtype=bool)
+        offset = positions - cell * cell_size
+        return cell, (offset < border_px) | (offset >= cell_size - border_px)
+
+
+    @staticmethod
+    def cell_extents(cells, border, count:int):
+        """ First and one past the last pixel inside each cell along one axis, equal if the cell covers no pixels.
+
+        Returns:
+            (np.ndarray, np.ndarray): Start and stop pixel of each cell.
+        """
+        positions = np.arange(len(cells))[~border]
+        start, stop = np.zeros(count, dtype=np.int64), np.zeros(count, dtype=np.int64)
+        np.maximum.at(stop, cells[~border], positions + 1)
+        start[:] = stop
+        np.minimum.at(start, cells[~border], positions)
+        return start, stop
+
+
+    def cell_colors(self, sim, last_path, show_search:bool=True, show_path:bool=True):
+        """ Palette index of every cell, in one vectorized pass.
+                Priority (highest first): start, end, path, walls, searched, traversed, cost.
+
+        Args:
+            sim (A_Star): Simulation to draw.
+            last_path ([(int, int), ...]): Path to draw.
+            show_search (bool, optional): If True, searched and traversed cells are drawn. Defaults to True.
+            show_path (bool, optional): If True, the path is drawn. Defaults to True.
+
+        Returns:
+            np.ndarray: (grid_w, grid_h) view of the palette index of each cell.
+        """
+        cells = self.cell_index[:-1].reshape(self.grid_w, self.grid_h)
+
+        # Costs outside of the range of cost colors (e.g. 0) are drawn as empty cells
+        cost_grid = sim.cost_grid
+        in_range = (cost_grid >= -1) & (cost_grid <= dv.COST_COUNT)
+        np.copyto(cells, self.cost_lookup[np.where(in_range, cost_grid, -1) + 1])
+
+        if show_search:
+            cells[sim.state_grid == -1] = TRAVERSED_INDEX
+            cells[sim.state_grid == 1] = SEARCHED_INDEX
+        cells[cost_grid < 0] = WALL_INDEX
+
+        if show_path and last_path:
+            path = np.array(last_path)
+            cells[path[:, 0], path[:, 1]] = PATH_INDEX
+            cells[path[[0, -1], 0], path[[0, -1], 1]] = PATH_INDEX + 1
+
+        if sim.end_pos is not None:
+            cells[sim.end_pos] = END_INDEX
+        if sim.start_pos is not None:
+            cells[sim.start_pos] = START_INDEX
+        return cells
+
+
+    def draw(self, surf, origin, sim, last_path, show_search:bool=True, show_path:bool=True):
+        """ Draw the cell grid of a simulation with a single blit.
+
+        Args:
+            surf (pygame.Surface): Surface to draw to.
+            origin (float, float): Pixel position of the top left corner of the grid.
+            sim (A_Star): Simulation to draw.
+            last_path ([(int, int), ...]): Path to draw.
+            show_search (bool, optional): If True, searched and traversed cells are drawn. Defaults to True.
+            show_path (bool, optional): If True, the path is drawn. Defaults to True.
+        """
+        self.cell_colors(sim, last_path, show_search, show_path)
+        pg.surfarray.blit_array(self.surface, self.cell_index[self.pixel_map])
+        surf.blit(self.surface, (int(origin[0]), int(origin[1])))
+
+
+    def cell_colors_at(self, sim, cells, last_path, show_search:bool=True, show_path:bool=True):
+        """ Palette index of some cells, with the same priority as cell_colors().
+
+        Args:
+            sim (A_Star): Simulation to draw.
+            cells (np.ndarray): Flat indices (x * grid_h + y) of the cells.
+            last_path ([(int, int), ...]): Path to draw.
+            show_search (bool, optional): If True, searched and traversed cells are drawn. Defaults to True.
+            show_path (bool, optional): If True, the path is drawn. Defaults to True.
+
+        Returns:
+            np.ndarray: Palette index of each cell.
+        """
+        xs, ys = np.divmod(cells, self.grid_h)
+
+        cost = sim.cost_grid[xs, ys]
+        in_range = (cost >= -1) & (cost <= dv.COST_COUNT)
+        colors = self.cost_lookup[np.where(in_range, cost, -1) + 1]
+
+        if show_search:
+            state = sim.state_grid[xs, ys]
+            colors[state == -1] = TRAVERSED_INDEX
+            colors[state == 1] = SEARCHED_INDEX
+        colors[cost < 0] = WALL_INDEX
+
+        if show_path and last_path:
+            path = np.array(last_path)
+            path_cells = path[:, 0] * self.grid_h + path[:, 1]
+            colors[np.isin(cells, path_cells)] = PATH_INDEX
+            colors[np.isin(cells, path_cells[[0, -1]])] = PATH_INDEX + 1
+
+        for pos, index in ((sim.end_pos, END_INDEX), (sim.start_pos, START_INDEX)):
+            if pos is not None:
+                colors[cells == pos[0] * self.grid_h + pos[1]] = index
+        return colors
+
+
+    def cell_rect(self, pos, origin):
+        """ Screen rect of the inside of a cell (excluding the grid lines).
+
+        Args:
+            pos (int, int): Cell coordinates.
+            origin (float, float): Pixel position of the top left corner of the grid.
+
+        Returns:
+            pygame.Rect: Rect of the cell, with no area if the cell covers no pixels.
+        """
+        x, y = pos
+        return pg.Rect(int(origin[0]) + self.x_start[x], int(origin[1]) + self.y_start[y],
+                       self.x_stop[x] - self.x_start[x], self.y_stop[y] - self.y_start[y])
+
+
+    def draw_cells(self, surf, origin, sim, last_path, cells, show_search:bool=True, show_path:bool=True):
+        """ Repaint only the given cells, leaving the rest of the last frame in place.
+
+        Args:
+            surf (pygame.Surface): Surface to draw to, holding the last frame drawn.
+            origin (float, float): Pixel position of the top left corner of the grid.
+            sim (A_Star): Simulation to draw.
+            last_path ([(int, int), ...]): Path to draw.
+            cells (np.ndarray): Flat indices (x * grid_h + y) of the cells that may have changed.
+            show_search (bool, optional): If True, searched and traversed cells are drawn. Defaults to True.
+            show_path (bool, optional): If True, the path is drawn. Defaults to True.
+
+        Returns:
+            [pygame.Rect, ...]: Screen rects of the cells repainted, to pass to pg.display.update().
+        """
+        if len(cells) == 0:
+            return []
+        colors = self.cell_colors_at(sim, cells, last_path, show_search, show_path)
+
+        # Only cells whose color changed are repainted
+        changed = colors != self.cell_index[cells]
+        cells, colors = cells[changed], colors[changed]
+        self.cell_index[cells] = colors
+
+        rects = []
+        for x, y, color in zip(*np.divmod(cells, self.grid_h), colors.tolist()):
+            area = pg.Rect(self.x_start[x], self.y_start[y], self.x_stop[x] - self.x_start[x], self.y_stop[y] - self.y_start[y])
+            if area.w > 0 and area.h > 0:
+                self.surface.fill(color, area)  # Integer colors are palette indices
+                rects.append(surf.blit(self.surface, (int(origin[0]) + area.x, int(origin[1]) + area.y), area))
+        return rects
+
+
+    def restore(self, surf, origin, rect):
+        """ Redraw the part of the grid under a screen rect, from the last frame drawn (e.g. to erase text drawn over it).
+
+        Args:
+            surf (pygame.Surface): Surface to draw to.
+            origin (float, float): Pixel position of the top left corner of the grid.
+            rect (pygame.Rect): Screen rect to restore, areas outside the grid are left untouched.
+        """
+        area = pg.Rect(rect).move(-int(origin[0]), -int(origin[1])).clip(self.surface.get_rect())
+        if area.w > 0 and area.h > 0:
+            surf.blit(self.surface, (int(origin[0]) + area.x, int(origin[1]) + area.y), area)
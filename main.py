@@ -4,7 +4,10 @@
 import numpy as np
 import pygame as pg
 from a_star import A_Star_Portals
+from scenario import save_scenario, load_scenario, read_sidecar
 import display_vars as dv
+from grid_renderer import Grid_Renderer
+from solver_hooks import Change_Log
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 #                   # INSTRUCTIONS: #                     #
@@ -19,6 +22,8 @@ import display_vars as dv
 #       (Continue to step with spacebar if manual control is enabled, toggle to manual with 'm' key)
 
 # 5. Press 'r' to reset the pathfinding, or escape to quit. (Shift+'r' to reset fully)
+
+# 6. Press 's' to save the map as a scenario, and 'l' to load it again. (See scenario.py)
 #       (Additional controls are listed below)
 
 
@@ -46,6 +51,8 @@ import display_vars as dv
 # ' ' -> Start simulation, or step if manual control is enabled
 # 'r' -> Reset pathfinding
 # 'R' -> Reset completely
+# 's' -> Save terrain, portals, start and end to SCENARIO_PATH
+# 'l' -> Load the scenario at SCENARIO_PATH
 # ESC -> Quit
 
 
@@ -67,6 +74,9 @@ COST_DICT = {pg.K_0: -1,    # Dict mapping keypress to cell cost
              pg.K_8: 8,
              pg.K_9: 9}
 
+# SCENARIO VARS
+SCENARIO_PATH = 'scenario'  # Path of the saved scenario, without extension (writes scenario.npy and scenario.json)
+
 # STEP SPEED VARS
 STEPS_PER_SECOND = 200       # Number of steps per second (if manual control is disabled)
 STEPS_PER_FRAME = 0         # Maximum steps per frame update (if < 1, no limit)
@@ -89,16 +99,21 @@ STATE_DICT =   {'manual_control': False,    # If true, manual control is enabled
                 'running': True,            # Main loop control
                 'searching': False,         # Pathfinding loop control
                 'resetting': 2,             # Reset pathfinding flag (1 = pathfinding reset, 2 = full reset)
+                'loading': False,           # Load scenario flag
+                'redraw': True,             # Redraw the whole frame, rather than only the cells changed by the search
+                'change_log': None,         # Change_Log of the current simulation, collecting cells changed between frames
+                'text_rect': None,          # Screen rect of the text drawn last frame, erased before the next
                 
                 'temp_portal': None,        # Temp var to store portal start position during portal creation
                 }
 
 
-# TESTING VARS
+# TESTING VARS (benchmark.py compares the heuristic modes headlessly, over many seeded maps)
 HEURISTIC_MODE_TEST_ARGS = ['standard', 'store_all', 'store_none', 'naive']
 
 # DISPLAY VARS
 SQUARE_CELLS = True         # If true, cells will always be square
+DIRTY_CELL_LIMIT = 2000     # While searching, only changed cells are redrawn, unless more than this many changed in one frame
 
 # DISPLAY CONSTANTS
 CELL_W, CELL_H = dv.SCREEN_W / GRID_W, dv.SCREEN_H / GRID_H
@@ -106,6 +121,8 @@ if SQUARE_CELLS: CELL_W = CELL_H = min(CELL_W, CELL_H)
 ORIGIN_X = (dv.SCREEN_W - CELL_W * GRID_W) / 2
 ORIGIN_Y = (dv.SCREEN_H - CELL_H * GRID_H) / 2
 
+RENDERER = Grid_Renderer(GRID_W, GRID_H, CELL_W, CELL_H) # Draws the whole cell grid with a single blit per frame
+
 PORTAL_COLORS = [] # Used to store randomly generated portal colors
 def add_portal_color():
     PORTAL_COLORS.append(list(np.random.random(size=3) * 256)) # Randomly generate a color for the portal
@@ -134,21 +151,45 @@ def main():
             sim = reset_sim(sim, STATE_DICT['resetting'])
             STATE_DICT['resetting'] = 0
         
+        # Load the saved scenario if flagged
+        if STATE_DICT['loading']:
+            sim = load_sim(sim)
+            STATE_DICT['loading'] = False
+        
         # Update window title
         pg.display.set_caption(f'A* Pathfinding [{sim.h_mode}]: steps: {sim.step_count} ~ heuristic count: {sim.heuristic_count} ~ length: {sim.path_length}')
         
+        # Log the cells changed by the search of a new simulation (after a reset or load), starting from a full redraw
+        if STATE_DICT['change_log'] is None or STATE_DICT['change_log'].sim is not sim:
+            if STATE_DICT['change_log'] is not None:
+                STATE_DICT['change_log'].detach()
+            STATE_DICT['change_log'] = Change_Log(sim)
+            STATE_DICT['redraw'] = True
+        
         # Handle input events
         parse_events(sim)
         
         # Draw current state of pathfinding sim
-        draw_state(screen, sim)
+        #   While searching, only cells changed since the last frame are redrawn (cells can only be edited before searching).
+        full_redraw = STATE_DICT['redraw'] or not STATE_DICT['searching']
+        if full_redraw:
+            draw_state(screen, sim)
+            STATE_DICT['change_log'].clear(sim.last_path)
+            STATE_DICT['redraw'] = False
+        else:
+            dirty_rects = draw_changes(screen, sim)
 
         # Draw text at mouse position
+        STATE_DICT['text_rect'] = None
         if STATE_DICT['show_text']:
-            draw_mouse_text(screen, font, sim)
+            STATE_DICT['text_rect'] = draw_mouse_text(screen, font, sim)
         
-        # Update display
-        pg.display.flip()
+        # Update display, only the changed areas if the frame was not fully redrawn
+        if full_redraw:
+            pg.display.flip()
+        else:
+            if STATE_DICT['text_rect'] is not None: dirty_rects.append(STATE_DICT['text_rect'])
+            pg.display.update(dirty_rects)
         
         # If heuristic testing is enabled, cycle through heuristic modes when the simulation finishes
         if STATE_DICT['searching'] and \
@@ -208,6 +249,15 @@ def parse_events(sim: A_Star_Portals):
                 STATE_DICT['resetting'] = 1
                 if event.unicode == 'R': STATE_DICT['resetting'] = 2
             
+            # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
+            # S key saves the scenario, L key loads it at the beginning of the next main loop
+            elif event.key == pg.K_s:
+                grid_path, sidecar_path = save_scenario(SCENARIO_PATH, sim)
+                print('Scenario saved to', grid_path, 'and', sidecar_path)
+            
+            elif event.key == pg.K_l:
+                STATE_DICT['loading'] = True
+            
             # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
             # M key toggles manual control
             elif event.key == pg.K_m:
@@ -242,12 +292,14 @@ def parse_events(sim: A_Star_Portals):
             # 'g' Key toggles path display
             elif event.key == pg.K_g:
                 STATE_DICT['show_path'] = not STATE_DICT['show_path']
+                STATE_DICT['redraw'] = True
                 print('Show path:', STATE_DICT['show_path'])
                 
             # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
             # 'f' Key toggles search display
             elif event.key == pg.K_f:
                 STATE_DICT['show_search'] = not STATE_DICT['show_search']
+                STATE_DICT['redraw'] = True
                 print('Show search:', STATE_DICT['show_search'])
                 
             # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
@@ -330,68 +382,77 @@ def parse_events(sim: A_Star_Portals):
 
 def draw_state(surf, sim):
     """ Draw the current state of the pathfinding simulation to the given surface.
-            Renders the contents of each cell, minimizing draw calls at the expense of readability and checks-per-cell.
+            Renders the contents of each cell with a single blit (see Grid_Renderer), then portals on top.
             Portals are drawn as paired triangles, with direction indicating entrance/exit.
 
     Args:
         surf (pygame.Surface): Surface to draw to (presumably the screen).
         sim (A_Star_Portals): Simulation from which to get state information.
     """
-    surf.fill(dv.BG_COLOR) # Used for grid lines between cells and empty border space.
-
+    surf.fill(dv.BG_COLOR) # Used for empty border space, grid lines are drawn by the renderer.
+    
     # # #
     # Draw cell grid
+    #   The highest priority feature of every cell is drawn in one vectorized pass, see grid_renderer.py.
+    RENDERER.draw(surf, (ORIGIN_X, ORIGIN_Y), sim, sim.last_path, STATE_DICT['show_search'], STATE_DICT['show_path'])
     
-    # Width and height of each cell, minus the border width
-    width  = CELL_W - dv.BORDER_PX*2    
-    height = CELL_H - dv.BORDER_PX*2
+    # # #
+    # Draw portals
+    draw_portals(surf, sim)
+
+
+def draw_changes(surf, sim):
+    """ Redraw only the cells changed since the last frame (see Change_Log), leaving the rest of the surface in place.
+            Portals over repainted cells are drawn again, and the text drawn last frame is erased.
+
+    Args:
+        surf (pygame.Surface): Surface to draw to, holding the last frame drawn.
+        sim (A_Star_Portals): Simulation from which to get state information.
+
+    Returns:
+        [pygame.Rect, ...]: Rects of the surface that changed, to pass to pg.display.update().
+    """
+    origin = (ORIGIN_X, ORIGIN_Y)
+    last_path = sim.last_path
+    cells = STATE_DICT['change_log'].take(last_path)
     
-    # Draw the highest priority cell feature at each cell coordinate.
-    for w in range(GRID_W):
-        for h in range(GRID_H):
-
-            x = ORIGIN_X + CELL_W * w           # Top left corner of the cell
-            y = ORIGIN_Y + CELL_H * h   
-            _x = x + dv.BORDER_PX               # Offset corner by border width
-            _y = y + dv.BORDER_PX       
-            rect_vars = (_x, _y, width, height) # Rect vars for pg.draw.rect
-            
-            # Draw the start position.
-            if (w, h) == sim.start_pos:
-                pg.draw.rect(surf, dv.START_COLOR, rect_vars)
-            
-            # Draw the end position.
-            elif (w, h) == sim.end_pos:
-                pg.draw.rect(surf, dv.END_COLOR, rect_vars)
-                
-            # Draw the last traversed path.
-            elif STATE_DICT['show_path'] and (w, h) in sim.last_path:
-                i = int(sim.last_path.index((w, h)) in (0, len(sim.last_path)-1))
-                pg.draw.rect(surf, dv.PATH_COLORS[i], rect_vars)
-                
-            # Draw walls.
-            elif sim.cost_grid[w, h] < 0:
-                pg.draw.rect(surf, dv.WALL_COLOR, rect_vars)
-           
-           # Draw searched cells.
-            elif STATE_DICT['show_search'] and sim.state_grid[w, h] == 1:
-                pg.draw.rect(surf, dv.SEARCHED_COLOR, rect_vars)
-            
-            # Draw traversed cells.
-            elif STATE_DICT['show_search'] and sim.state_grid[w, h] == -1:
-                pg.draw.rect(surf, dv.TRAVERSED_COLOR, rect_vars)
-                
-            # Draw empty/unsearched cells.
-            else:
-                c = dv.CELL_COLOR # Default color
-                if sim.cost_grid[w, h] in list(COST_DICT.values()): # Override color based on cell cost.
-                    c = dv.COST_COLORS[list(COST_DICT.values()).index(sim.cost_grid[w, h]) - 1]
-                
-                pg.draw.rect(surf, c, rect_vars)
+    # Past a point, a single full redraw is cheaper than many small ones
+    if len(cells) > DIRTY_CELL_LIMIT:
+        draw_state(surf, sim)
+        return [surf.get_rect()]
     
     # # #
-    # Draw portals
+    # Draw changed cells
+    dirty_rects = RENDERER.draw_cells(surf, origin, sim, last_path, cells, STATE_DICT['show_search'], STATE_DICT['show_path'])
+    
+    # Portals are drawn over cells, so redraw any portal on a repainted cell
+    changed = set(cells.tolist())
+    redraw_rects = [RENDERER.cell_rect(pos, origin) for portal in sim.portals.items() for pos in portal if pos[0] * GRID_H + pos[1] in changed]
     
+    # # #
+    # Erase last frame's text, restoring the background, cells and portals under it
+    if STATE_DICT['text_rect'] is not None:
+        surf.fill(dv.BG_COLOR, STATE_DICT['text_rect'])
+        RENDERER.restore(surf, origin, STATE_DICT['text_rect'])
+        redraw_rects.append(STATE_DICT['text_rect'])
+        dirty_rects.append(STATE_DICT['text_rect'])
+    
+    # Portals may span several cells, so clip them to each area redrawn
+    for rect in redraw_rects:
+        surf.set_clip(rect)
+        draw_portals(surf, sim)
+    surf.set_clip(None)
+    
+    return dirty_rects
+
+
+def draw_portals(surf, sim):
+    """ Draw portals as paired triangles, with direction indicating entrance/exit, and the portal being placed.
+
+    Args:
+        surf (pygame.Surface): Surface to draw to.
+        sim (A_Star_Portals): Simulation from which to get portals.
+    """
     # Width and height of the portal triangle inset
     triangle_inset_w, triangle_inset_h = CELL_W / 4, CELL_H / 4
     
@@ -428,6 +489,9 @@ def draw_mouse_text(surf, font, sim):
         surf (pygame.Surface): Surface to draw text to.
         font (pygame.font.Font): Font to use for text.
         sim (A_Star_Portals): Pathfinding simulation to get heuristics from.
+
+    Returns:
+        pygame.Rect: Area of the surface covered by the text.
     """
     mouse_pos = pg.mouse.get_pos()
     clicked_cell = get_cell(mouse_pos)
@@ -446,14 +510,14 @@ def draw_mouse_text(surf, font, sim):
         g_val = sim.g_grid[clicked_cell]
         h_val = sim.h_grid[clicked_cell]
         
-        if g_val != np.iinfo(int).max:
+        if g_val != sim.max_value:
             text += f'G({g_val})  '
-        if h_val != np.iinfo(int).max:
+        if h_val != sim.max_value:
             text += f'H({h_val})  '
-        if g_val != np.iinfo(int).max and h_val != np.iinfo(int).max:
+        if g_val != sim.max_value and h_val != sim.max_value:
             text += f'F({g_val + h_val})'
             
-    draw_text(surf, text, text_pos, font, dv.TEXT_COLOR, dv.TEXT_ALPHA)
+    return draw_text(surf, text, text_pos, font, dv.TEXT_COLOR, dv.TEXT_ALPHA)
 
 
 def draw_text(surf, text, pos, font, color, alpha):
@@ -466,12 +530,15 @@ def draw_text(surf, text, pos, font, color, alpha):
         font (pygame.font.Font): Font to use for text.
         color (int, int, int): RGB color of text.
         alpha (int): Alpha value of text from 0 to 255.
+
+    Returns:
+        pygame.Rect: Area of the surface covered by the text.
     """
     text_surface = font.render(text, True, color)
     text_surface.set_alpha(alpha)
     rect = text_surface.get_rect()
     rect.center = pos
-    surf.blit(text_surface, rect)
+    return surf.blit(text_surface, rect)
 
 
 def get_cell(pos):
@@ -502,8 +569,8 @@ def print_results(sim: A_Star_Portals):
     print(f' > Step Count: {sim.step_count}')
     print(f' > Path Length: {sim.path_length}')
     print(f' > Heuristic count: {sim.heuristic_count}')
-    print(f' > Traversed cells: {np.count_nonzero(sim.state_grid == -1)}')
-    print(f' > Searched cells: {np.count_nonzero(sim.state_grid != 0)}')
+    print(f' > Traversed cells: {sim.closed_count}')
+    print(f' > Searched cells: {sim.open_count + sim.closed_count}')
     print(f' > Step time: {sim.step_time:.4f}')
     print(f' > Average time per step: {(sim.step_time) / sim.step_count:.4f}\n')
 
@@ -556,6 +623,39 @@ def reset_sim(sim: A_Star_Portals, reset_type=2):
     elif STATE_DICT['resetting'] == 2: # Retain nothing from the previous sim
         return A_Star_Portals(w=GRID_W, h=GRID_H, default_cost=DEFAULT_COST, h_mode=HEURISTIC_MODE_TEST_ARGS[STATE_DICT['heuristic_test_index']])
     
+
+
+def load_sim(sim: A_Star_Portals):
+    """ Return a new simulation built from the scenario saved at SCENARIO_PATH.
+            The cost grid is mapped copy-on-write, so painting cells never modifies the saved file.
+
+    Args:
+        sim (A_Star_Portals): Current simulation, kept if the scenario cannot be loaded.
+
+    Returns:
+        A_Star_Portals: The loaded simulation.
+    """
+    try:
+        sidecar = read_sidecar(SCENARIO_PATH)
+    except FileNotFoundError:
+        print(f'\nNo scenario saved at {SCENARIO_PATH}. Press "s" to save one.\n')
+        return sim
+    
+    # The display is laid out for a fixed grid size
+    if sidecar['shape'] != (GRID_W, GRID_H):
+        print(f'\nScenario is {sidecar["shape"][0]}x{sidecar["shape"][1]}, but the grid is {GRID_W}x{GRID_H}. Skipping load.\n')
+        return sim
+    
+    print('\nLoading scenario...\n')
+    STATE_DICT['heuristic_test_index'] = 0
+    STATE_DICT['searching'] = False
+    STATE_DICT['temp_portal'] = None
+    
+    sim = load_scenario(SCENARIO_PATH, mmap_mode='c', h_mode=HEURISTIC_MODE_TEST_ARGS[STATE_DICT['heuristic_test_index']])
+    
+    PORTAL_COLORS.clear() # New colors are generated as the loaded portals are drawn
+    return sim
+    
     
 if __name__ == '__main__':
     main()
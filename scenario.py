@@ -0,0 +1,160 @@
+# Nathaniel Alden Homans Youngren
+# September 13, 2023
+
+import json
+import os
+import numpy as np
+from a_star import A_Star_Portals, GRID_DTYPES
+
+# NOTE: INSTRUCTIONS
+#
+# 1. Build a simulation (in main.py, or in code) with the desired terrain, portals, start and end positions.
+# 2. Call save_scenario(path, sim), which writes two files:
+#       > path.npy holds the cost grid, in numpy's .npy format (or path.raw holding only the raw cells, if raw=True).
+#       > path.json is the sidecar, holding the grid's shape and dtype, default cost, start and end positions and portals.
+# 3. Call load_scenario(path) to build an A_Star_Portals around the saved terrain.
+#       The cost grid is memory-mapped rather than read, so even multi-gigabyte maps open in milliseconds,
+#       and pages of the file are only read as the search touches them.
+#       > mmap_mode='r' (default) maps the grid read-only, so any number of processes can share the same pages.
+#           solve_batch() in a_star_batch.py maps the file in each worker rather than copying the grid to shared memory.
+#       > mmap_mode='c' maps the grid copy-on-write, so it may be edited without modifying the file.
+#       > mmap_mode='r+' writes edits back to the file.
+#       > mmap_mode=None reads the whole grid into memory.
+#
+# Cost grids are (w, h) arrays indexed [x, y], as cost_grid in A_Star. The search grids (state, g, h, parents)
+#   are still allocated by the simulation, with the grid_dtypes saved in the sidecar.
+#
+
+# Version of the sidecar format, increased whenever its keys change
+SCENARIO_VERSION = 1
+
+# Bytes of the cost grid written at a time by save_scenario()
+SAVE_CHUNK_BYTES = 1 << 26
+
+
+def save_scenario(path:str, sim, raw:bool=False):
+    """ Save the terrain, portals, start and end positions of a simulation.
+
+    Args:
+        path (str): Path of the scenario, without extension.
+        sim (A_Star): Simulation to save, its search state is not saved.
+        raw (bool, optional): If True, write the cost grid as raw cells (C order) rather than .npy. Defaults to False.
+
+    Returns:
+        (str, str): Paths of the cost grid and sidecar files written.
+    """
+    path = os.fspath(path)
+    grid_path = path + ('.raw' if raw else '.npy')
+
+    cost_grid = sim.cost_grid
+
+    # Write to a temporary file beside the target, then replace it, so a failed save leaves the old scenario intact
+    #   (and a grid memory-mapped from the very file being replaced, e.g. after load_scenario(), is read to the end first)
+    temp_path = grid_path + '.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            if not raw:
+                header = {'descr': np.lib.format.dtype_to_descr(cost_grid.dtype), 'fortran_order': False, 'shape': cost_grid.shape}
+                np.lib.format.write_array_header_1_0(f, header)
+
+            # Written a chunk of rows at a time in C order, so the grid is never copied as a whole
+            rows = max(1, SAVE_CHUNK_BYTES // max(cost_grid[:1].nbytes, 1))
+            for x in range(0, cost_grid.shape[0], rows):
+                np.ascontiguousarray(cost_grid[x:x + rows]).tofile(f)
+        os.replace(temp_path, grid_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    sidecar = {'version': SCENARIO_VERSION,
+               'cost_file': os.path.basename(grid_path),    # Relative to the sidecar, so scenarios can be moved
+               'shape': [sim.w, sim.h],
+               'dtype': cost_grid.dtype.str,
+               'grid_dtypes': sim.grid_dtypes,
+               'default_cost': int(sim.default_cost),
+               'start_pos': None if sim.start_pos is None else [int(v) for v in sim.start_pos],
+               'end_pos': None if sim.end_pos is None else [int(v) for v in sim.end_pos],
+               'portals': [[[int(v) for v in entry], [int(v) for v in p_exit]] for entry, p_exit in getattr(sim, 'portals', {}).items()]}
+
+    sidecar_path = path + '.json'
+    with open(sidecar_path + '.tmp', 'w') as f:
+        json.dump(sidecar, f, indent=1)
+    os.replace(sidecar_path + '.tmp', sidecar_path)
+
+    return grid_path, sidecar_path
+
+
+def read_sidecar(path:str):
+    """ Read the sidecar of a scenario, with positions and portals converted back to tuples.
+
+    Args:
+        path (str): Path of the scenario, with or without the .json extension.
+
+    Returns:
+        dict: Sidecar contents, with 'cost_path' holding the full path of the cost grid file.
+    """
+    path = os.fspath(path)
+    sidecar_path = path if path.endswith('.json') else path + '.json'
+    with open(sidecar_path) as f:
+        sidecar = json.load(f)
+
+    sidecar['cost_path'] = os.path.join(os.path.dirname(sidecar_path), sidecar['cost_file'])
+    sidecar['shape'] = tuple(sidecar['shape'])
+    for key in ('start_pos', 'end_pos'):
+        sidecar[key] = None if sidecar[key] is None else tuple(sidecar[key])
+    sidecar['portals'] = {tuple(entry): tuple(p_exit) for entry, p_exit in sidecar['portals']}
+    return sidecar
+
+
+def open_cost_grid(path:str, mmap_mode:str='r'):
+    """ Open the cost grid of a scenario, memory-mapped unless mmap_mode is None.
+
+    Args:
+        path (str): Path of the scenario, with or without the .json extension.
+        mmap_mode (str, optional): 'r', 'c', 'r+' (see np.memmap) or None to read it into memory. Defaults to 'r'.
+
+    Returns:
+        np.ndarray: (w, h) cost grid, an np.memmap unless mmap_mode is None.
+    """
+    sidecar = read_sidecar(path)
+    dtype = np.dtype(sidecar['dtype'])
+
+    if sidecar['cost_file'].endswith('.npy'):
+        cost_grid = np.load(sidecar['cost_path'], mmap_mode=mmap_mode)
+    elif mmap_mode is None:
+        cost_grid = np.fromfile(sidecar['cost_path'], dtype=dtype).reshape(sidecar['shape'])
+    else:
+        cost_grid = np.memmap(sidecar['cost_path'], dtype=dtype, mode=mmap_mode, shape=sidecar['shape'])
+
+    return cost_grid
+
+
+def load_scenario(path:str, sim_class=A_Star_Portals, mmap_mode:str='r', **kwargs):
+    """ Build a simulation around a saved scenario, using the cost grid without copying it.
+
+    Args:
+        path (str): Path of the scenario, with or without the .json extension.
+        sim_class (type, optional): Class of the simulation to build. Defaults to A_Star_Portals.
+        mmap_mode (str, optional): How the cost grid is opened, see open_cost_grid(). Defaults to 'r'.
+        **kwargs: Other constructor arguments (e.g. h_mode, jit), overriding those saved in the sidecar.
+
+    Returns:
+        A_Star: Simulation with the saved terrain, portals, start and end positions.
+    """
+    sidecar = read_sidecar(path)
+    cost_grid = open_cost_grid(path, mmap_mode)
+
+    # The saved grid_dtypes is used if its cost dtype matches the file, otherwise the one that does (if any).
+    grid_dtypes = sidecar.get('grid_dtypes', 'standard')
+    if np.dtype(GRID_DTYPES[grid_dtypes]['cost']) != cost_grid.dtype:
+        grid_dtypes = next((key for key, dtypes in GRID_DTYPES.items() if np.dtype(dtypes['cost']) == cost_grid.dtype), grid_dtypes)
+
+    settings = dict(w=sidecar['shape'][0], h=sidecar['shape'][1],
+                    start_pos=sidecar['start_pos'], end_pos=sidecar['end_pos'],
+                    default_cost=sidecar['default_cost'], grid_dtypes=grid_dtypes)
+    settings.update(kwargs)
+
+    sim = sim_class(cost_grid=cost_grid, **settings)
+    if isinstance(sim, A_Star_Portals):
+        sim.portals = sidecar['portals']
+    return sim
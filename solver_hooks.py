@@ -0,0 +1,378 @@
+# Nathaniel Alden Homans Youngren
+# September 13, 2023
+
+import numpy as np
+from time import perf_counter
+
+# NOTE: INSTRUCTIONS
+#
+# 1. Attach hooks to any simulation (A_Star and its subclasses): hooks = Solver_Hooks(sim)
+# 2. Call hooks.enable_profiling() to time each phase of the search separately (see PROFILE_PHASES).
+#       > hooks.phase_times and hooks.phase_calls hold the time spent in and the number of calls to each phase,
+#           print(hooks.report()) summarizes them.
+#       > Phases nest (e.g. heuristics are calculated while expanding a cell), each time excludes the phases nested within it,
+#           so the times add up to the total time spent in the solver.
+# 3. Call hooks.enable_events() to record what happens to cells as the search progresses (see EVENT_KINDS).
+#       > Events are appended to hooks.ring (an Event_Ring of fixed size, the oldest events are overwritten),
+#       > and passed to every callback registered with hooks.add_callback(callback, kinds).
+# 4. Step or run the simulation as usual. The compiled engine (jit) is timed as a single phase and emits no events.
+# 5. Call hooks.disable_profiling(), hooks.disable_events() or hooks.detach() to remove the hooks again.
+# 6. For drawing, log = Change_Log(sim) collects the cells whose display changed (opened, closed, entering or leaving the path),
+#       log.take(sim.last_path) returns them once per frame, so a viewer only repaints those cells (see main.draw_changes()).
+#
+# Hooks wrap the simulation's methods on the instance itself, leaving the classes untouched.
+#   While disabled, nothing is wrapped, so the solver runs exactly as fast as without hooks.
+#
+
+# Methods timed by each phase, as {phase: [method names]}. Methods a simulation does not have are skipped.
+PROFILE_PHASES = {'select': ['select_next_pos'],
+                  'expand': ['search_neighbors'],
+                  'heuristic': ['distance_heuristic', 'heuristic_array', 'end_heuristic', 'end_heuristic_array',
+                                'precompute_heuristics', 'naive_recursive_portal_heuristic'],
+                  'portal_sort': ['sort_portal_heuristics', 'portal_distance_table'],
+                  'reconstruct': ['reconstruct_path'],
+                  'compiled': ['run_jit']}
+
+# Kinds of events, stored in the ring buffer by index
+#   > 'opened': a cell was searched for the first time, with its g.
+#   > 'improved': a shorter path to an open cell was found, its g and parent were updated.
+#   > 'closed': a cell was traversed.
+#   > 'closed_backward': a cell was traversed by the backward search of A_Star_Bidirectional, with its backward g (distance to the end).
+#   > 'goal': the search finished, at the cell traversed last.
+EVENT_KINDS = ['opened', 'improved', 'closed', 'closed_backward', 'goal']
+
+
+class Event_Ring():
+
+    def __init__(self, capacity:int=65536) -> None:
+        """ Fixed size buffer of search events, stored in numpy arrays. Once full, the oldest events are overwritten.
+
+        Args:
+            capacity (int, optional): Maximum number of events held. Defaults to 65536.
+        """
+        self.capacity = capacity
+        self.kinds = np.zeros(capacity, dtype=np.int8)      # Index into EVENT_KINDS
+        self.xs = np.zeros(capacity, dtype=np.int32)        # Cell coordinates
+        self.ys = np.zeros(capacity, dtype=np.int32)
+        self.gs = np.zeros(capacity, dtype=np.int64)        # g of the cell at the time of the event
+        self.steps = np.zeros(capacity, dtype=np.int64)     # step_count of the simulation at the time of the event
+
+        self.head = 0           # Index of the next event written
+        self.size = 0           # Number of events held
+        self.dropped = 0        # Number of events overwritten before being read
+
+
+    def __len__(self):
+        return self.size
+
+
+    def append(self, kind:str, xs, ys, gs, step:int):
+        """ Add a batch of events of the same kind.
+
+        Args:
+            kind (str): One of EVENT_KINDS.
+            xs, ys (np.ndarray): Coordinates of the cells.
+            gs (np.ndarray): g of each cell.
+            step (int): step_count of the simulation.
+        """
+        n = len(xs)
+        if n == 0:
+            return
+        if n > self.capacity:
+            xs, ys, gs = xs[-self.capacity:], ys[-self.capacity:], gs[-self.capacity:]
+            self.dropped += n - self.capacity
+            n = self.capacity
+
+        indices = (self.head + np.arange(n)) % self.capacity
+        self.kinds[indices] = EVENT_KINDS.index(kind)
+        self.xs[indices], self.ys[indices], self.gs[indices] = xs, ys, gs
+        self.steps[indices] = step
+
+        self.head = (self.head + n) % self.capacity
+        self.dropped += max(0, self.size + n - self.capacity)
+        self.size = min(self.size + n, self.capacity)
+
+
+    def events(self):
+        """ Events held, oldest first.
+
+        Returns:
+            [(str, (int, int), int, int), ...]: (kind, cell, g, step) of each event.
+        """
+        indices = (self.head - self.size + np.arange(self.size)) % self.capacity
+        return [(EVENT_KINDS[kind], (x, y), g, step) for kind, x, y, g, step in
+                zip(self.kinds[indices].tolist(), self.xs[indices].tolist(), self.ys[indices].tolist(),
+                    self.gs[indices].tolist(), self.steps[indices].tolist())]
+
+
+    def drain(self):
+        """ Events held, oldest first, emptying the buffer. """
+        events = self.events()
+        self.clear()
+        return events
+
+
+    def clear(self):
+        self.head = 0
+        self.size = 0
+
+
+class Solver_Hooks():
+
+    def __init__(self, sim) -> None:
+        """ Optional profiling and event hooks for a simulation.
+
+        Args:
+            sim (A_Star): Simulation to instrument.
+        """
+        self.sim = sim
+
+        self.wrapped = {'profiling': [], 'events': []}  # Names of methods wrapped on the simulation by each feature
+
+        # Profiling
+        self.phase_times = {phase: 0.0 for phase in PROFILE_PHASES}    # Time spent in each phase, excluding nested phases
+        self.phase_calls = {phase: 0 for phase in PROFILE_PHASES}      # Number of calls to each phase
+        self.phase_stack = []   # Time spent in phases nested within each running phase, innermost last
+
+        # Events
+        self.ring = None        # Event_Ring of recorded events, None until events are enabled
+        self.callbacks = []     # [(callback, kinds), ...] receiving events as they happen
+
+
+    # # # # # # # # # # # # #
+    # Profiling
+
+    def enable_profiling(self):
+        """ Start timing each phase, adding to any previous times. """
+        if self.wrapped['profiling']:
+            return
+        for phase, names in PROFILE_PHASES.items():
+            for name in names:
+                if hasattr(self.sim, name):
+                    self.wrap('profiling', name, self.timed(phase, getattr(self.sim, name)))
+
+
+    def disable_profiling(self):
+        """ Stop timing, keeping the times recorded so far. """
+        self.unwrap('profiling')
+
+
+    def reset_profile(self):
+        """ Clear the times and calls recorded. """
+        for phase in PROFILE_PHASES:
+            self.phase_times[phase] = 0.0
+            self.phase_calls[phase] = 0
+
+
+    def timed(self, phase:str, method):
+        """ Wrap a method, adding its time (excluding nested phases) to a phase. """
+        phase_times, phase_calls, phase_stack = self.phase_times, self.phase_calls, self.phase_stack
+
+        def timed_method(*args, **kwargs):
+            phase_stack.append(0.0)
+            st = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - st
+                nested = phase_stack.pop()
+                phase_times[phase] += elapsed - nested
+                phase_calls[phase] += 1
+                if phase_stack:
+                    phase_stack[-1] += elapsed
+
+        return timed_method
+
+
+    def report(self):
+        """ Summary of the time spent in each phase.
+
+        Returns:
+            str: One line per phase that was called.
+        """
+        total = sum(self.phase_times.values()) or 1
+        lines = [f' > {phase:12} {self.phase_times[phase]:9.4f}s {self.phase_times[phase] / total:6.1%} {self.phase_calls[phase]:9} calls'
+                 for phase in PROFILE_PHASES if self.phase_calls[phase]]
+        return '\n'.join(lines)
+
+
+    # # # # # # # # # # # # #
+    # Events
+
+    def enable_events(self, ring_size:int=65536):
+        """ Start recording events into a ring buffer, and passing them to any callbacks.
+
+        Args:
+            ring_size (int, optional): Capacity of the ring buffer, 0 records events for callbacks only. Defaults to 65536.
+        """
+        if self.wrapped['events']:
+            return
+        self.ring = Event_Ring(ring_size) if ring_size > 0 else None
+
+        sim = self.sim
+        search_cells, search_cell, traverse_next = sim.search_cells, sim.search_cell, sim.traverse_next
+
+        def search_cells_events(xs, ys, *args, **kwargs):
+            # Compare the state and g of the cells before and after the batch is searched
+            in_grid = (xs >= 0) & (xs < sim.w) & (ys >= 0) & (ys < sim.h)
+            cxs, cys = xs[in_grid], ys[in_grid]
+            states, gs = sim.state_grid[cxs, cys].copy(), sim.g_grid[cxs, cys].copy()
+            search_cells(xs, ys, *args, **kwargs)
+            self.emit_changes(cxs, cys, states, gs)
+
+        def search_cell_events(pos, *args, **kwargs):
+            if not (0 <= pos[0] < sim.w and 0 <= pos[1] < sim.h):
+                return search_cell(pos, *args, **kwargs)
+            cxs, cys = np.array([pos[0]]), np.array([pos[1]])
+            states, gs = sim.state_grid[cxs, cys].copy(), sim.g_grid[cxs, cys].copy()
+            search_cell(pos, *args, **kwargs)
+            self.emit_changes(cxs, cys, states, gs)
+
+        def traverse_next_events():
+            finished = sim.finished
+            pos = traverse_next()
+            cxs, cys = np.array([pos[0]]), np.array([pos[1]])
+            # Cells of the bidirectional solver's backward search are not in the (forward) grids of the simulation
+            if getattr(sim, 'last_direction', None) == 'backward':
+                gs = sim.backward['g_grid'][cxs, cys].astype(np.int64)
+                self.emit('closed_backward', cxs, cys, gs)
+            else:
+                gs = sim.g_grid[cxs, cys].astype(np.int64)
+                self.emit('closed', cxs, cys, gs)
+            if sim.finished and not finished:
+                self.emit('goal', cxs, cys, gs)
+            return pos
+
+        self.wrap('events', 'search_cells', search_cells_events)
+        self.wrap('events', 'search_cell', search_cell_events)
+        self.wrap('events', 'traverse_next', traverse_next_events)
+
+
+    def disable_events(self):
+        """ Stop recording events, the ring buffer is kept. """
+        self.unwrap('events')
+
+
+    def add_callback(self, callback, kinds=None):
+        """ Register a function receiving events as they happen.
+
+        Args:
+            callback (function): Called as callback(kind, xs, ys, gs, step) with a batch of cells of the same kind of event,
+                        xs, ys and gs being numpy arrays of the cells' coordinates and g.
+            kinds ([str, ...], optional): Kinds of events passed to the callback. Defaults to None (all of EVENT_KINDS).
+        """
+        self.callbacks.append((callback, set(EVENT_KINDS if kinds is None else kinds)))
+
+
+    def remove_callback(self, callback):
+        self.callbacks = [(registered, kinds) for registered, kinds in self.callbacks if registered != callback]
+
+
+    def emit_changes(self, xs, ys, states, gs):
+        """ Emit 'opened' and 'improved' events for cells whose state or g changed.
+
+        Args:
+            xs, ys (np.ndarray): Coordinates of the cells.
+            states, gs (np.ndarray): State and g of each cell before the change.
+        """
+        new_states, new_gs = self.sim.state_grid[xs, ys], self.sim.g_grid[xs, ys].astype(np.int64)
+        opened = (states == 0) & (new_states == 1)
+        improved = (states == 1) & (new_gs < gs)
+        if opened.any():
+            self.emit('opened', xs[opened], ys[opened], new_gs[opened])
+        if improved.any():
+            self.emit('improved', xs[improved], ys[improved], new_gs[improved])
+
+
+    def emit(self, kind:str, xs, ys, gs):
+        """ Record a batch of events of the same kind, and pass it to the callbacks. """
+        step = self.sim.step_count
+        if self.ring is not None:
+            self.ring.append(kind, xs, ys, gs, step)
+        for callback, kinds in self.callbacks:
+            if kind in kinds:
+                callback(kind, xs, ys, gs, step)
+
+
+    # # # # # # # # # # # # #
+    # Wrapping
+
+    def wrap(self, feature:str, name:str, wrapper):
+        """ Replace a method of the simulation (on the instance only) with a wrapper. """
+        setattr(self.sim, name, wrapper)
+        self.wrapped[feature].append(name)
+
+
+    def unwrap(self, feature:str):
+        """ Restore the methods wrapped by a feature (the features wrap different methods, so the other is kept). """
+        for name in self.wrapped[feature]:
+            if name in vars(self.sim):
+                delattr(self.sim, name)
+        self.wrapped[feature] = []
+
+
+    def detach(self):
+        """ Remove all hooks from the simulation. """
+        self.unwrap('events')
+        self.unwrap('profiling')
+
+
+class Change_Log():
+
+    def __init__(self, sim) -> None:
+        """ Log of the cells whose display changed as a simulation steps, built on Solver_Hooks events.
+                Cells opened or closed are recorded as they happen, the path is compared once per take().
+                Changes made outside of the search (costs, positions, portals, resets) are not logged.
+
+        Args:
+            sim (A_Star): Simulation to log.
+        """
+        self.sim = sim
+        self.batches = []       # Flat indices (x * h + y) of the cells changed since the last take(), one array per event batch
+        self.path = []          # Path as of the last take()
+
+        self.hooks = Solver_Hooks(sim)
+        self.hooks.add_callback(self.record, ['opened', 'closed'])
+        self.hooks.enable_events(ring_size=0)
+
+
+    def record(self, kind, xs, ys, gs, step):
+        self.batches.append(xs * self.sim.h + ys)
+
+
+    def take(self, last_path=None):
+        """ Cells changed since the last call, emptying the log.
+
+        Args:
+            last_path ([(int, int), ...], optional): Current path, cells entering or leaving it (and its old and new ends) are included.
+                        Defaults to None (the path is not compared).
+
+        Returns:
+            np.ndarray: Unique flat indices (x * h + y) of the changed cells.
+        """
+        batches, self.batches = self.batches, []
+
+        # The path is cached by the simulation, so an unchanged path is the same list
+        if last_path is not None and last_path is not self.path:
+            path_diff = set(self.path) ^ set(last_path)
+            path_diff.update(path[i] for path in (self.path, last_path) if path for i in (0, -1))
+            if path_diff:
+                cells = np.array(list(path_diff))
+                batches.append(cells[:, 0] * self.sim.h + cells[:, 1])
+            self.path = last_path
+
+        if not batches:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(batches).astype(np.int64))
+
+
+    def clear(self, last_path=None):
+        """ Empty the log, e.g. after the whole grid was redrawn. """
+        self.batches = []
+        if last_path is not None:
+            self.path = last_path
+
+
+    def detach(self):
+        """ Stop logging, removing the hooks from the simulation. """
+        self.hooks.detach()